@@ -0,0 +1,92 @@
+import time
+import asyncio
+
+
+# Process-local cache for a value loaded from Mongo (header config, product table, ...).
+# The value is reloaded after `ttl_seconds` so other workers pick up admin changes, and
+# can be invalidated explicitly right after a write in this process.
+#
+# Loads are single-flight: concurrent callers of an empty or invalidated cache await one
+# load. Once the TTL runs out the old value keeps being served while one background task
+# reloads it, so only the first load (and a load after invalidate) is waited on.
+class TTLCache:
+    def __init__(self, loader, ttl_seconds: float):
+        self.loader = loader
+        self.ttl_seconds = ttl_seconds
+        self.value = None
+        self.loaded_at = None
+        # Bumped by invalidate(), so a load that started before it isn't taken as fresh
+        self.generation = 0
+        self._lock = asyncio.Lock()
+        self._refresh_task = None
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.load_errors = 0
+        self.last_load_seconds = None
+
+    def is_fresh(self) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl_seconds
+
+    async def get(self):
+        if self.is_fresh():
+            self.hits += 1
+            return self.value
+        if self.loaded_at is not None:
+            # Expired: serve the previous value and reload in the background
+            self.stale_hits += 1
+            if self._refresh_task is None or self._refresh_task.done():
+                self._refresh_task = asyncio.create_task(self._refresh())
+            return self.value
+        self.misses += 1
+        return await self._load()
+
+    # Load now (e.g. right after a sync wrote new data), whatever the cached state
+    async def reload(self):
+        self.invalidate()
+        return await self._load()
+
+    def invalidate(self) -> None:
+        self.loaded_at = None
+        self.generation += 1
+
+    async def _load(self):
+        async with self._lock:
+            if self.is_fresh():
+                # Loaded by the caller this one waited for
+                return self.value
+            generation = self.generation
+            started = time.monotonic()
+            try:
+                value = await self.loader()
+            except Exception:
+                self.load_errors += 1
+                raise
+            self.loads += 1
+            self.last_load_seconds = time.monotonic() - started
+            self.value = value
+            if generation == self.generation:
+                self.loaded_at = time.monotonic()
+            return value
+
+    async def _refresh(self):
+        try:
+            await self._load()
+        except Exception as e:
+            # Keep serving the previous value; the next get() retries
+            print(f"Background cache refresh failed: {str(e)}")
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "last_load_seconds": self.last_load_seconds,
+            "age_seconds": None if self.loaded_at is None else time.monotonic() - self.loaded_at,
+            "ttl_seconds": self.ttl_seconds,
+            "refreshing": self._refresh_task is not None and not self._refresh_task.done(),
+        }
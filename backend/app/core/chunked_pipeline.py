@@ -0,0 +1,290 @@
+import os
+import csv
+import zipfile
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from app.core.column_validation import scan_column, build_column_issues
+from app.core.helper import get_user_friendly_dtype
+from app.core.mapping import resolve_headers
+from app.core.money import VAT_ROUNDING_MODE, from_minor_units, total_amount
+from app.core.oss_rollup import group_oss_lines, merge_oss_lines, rollup_levels, write_oss_sheets
+from app.core.product_registry import suggest_rules
+from app.core.vat_engine import VAT_INVOICE_COLUMN, enrich_frame, unmatched_keys, _find_columns
+
+# Rows parsed, validated, enriched and written at a time in the out-of-core pipeline; peak
+# memory is bounded by one chunk (plus one carried invoice) and the (small) running aggregates
+PIPELINE_CHUNK_ROWS = int(os.getenv("PIPELINE_CHUNK_ROWS", 100_000))
+# Flagged rows kept per column and issue kind for the issue descriptions
+PIPELINE_SAMPLE_ROWS = 10
+# Rows per worksheet in xlsx output (the Excel limit, header included)
+EXCEL_MAX_ROWS = 1_048_576
+
+OUTPUT_FORMATS = ('csv', 'xlsx')
+SCAN_KEYS = ('null_rows', 'empty_rows', 'missing_rows', 'invalid_rows', 'constraint_rows')
+
+
+# Row chunks of an upload read straight from its file object, never the whole file.
+# CSV/TXT go through the pandas chunked reader, xlsx through openpyxl's read-only mode.
+def iter_file_chunks(filename: str, file_obj, chunk_rows: int = PIPELINE_CHUNK_ROWS):
+    if filename.endswith('.csv'):
+        yield from pd.read_csv(file_obj, chunksize=chunk_rows)
+    elif filename.endswith('.txt'):
+        yield from pd.read_csv(file_obj, delimiter='\t', chunksize=chunk_rows)
+    elif filename.endswith('.xlsx'):
+        workbook = load_workbook(file_obj, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            columns = [str(value) if value is not None else f"Unnamed: {position}" for position, value in enumerate(next(rows, ()))]
+            batch = []
+            for row in rows:
+                batch.append(row[:len(columns)])
+                if len(batch) >= chunk_rows:
+                    yield pd.DataFrame.from_records(batch, columns=columns)
+                    batch = []
+            if batch:
+                yield pd.DataFrame.from_records(batch, columns=columns)
+        finally:
+            workbook.close()
+    else:
+        # Legacy formats have no streaming reader: parse once, then chunk
+        df = pd.read_excel(file_obj)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows].reset_index(drop=True)
+
+
+# Column scan accumulated over chunks: full counts per issue kind plus the first flagged
+# rows (positions in the whole file)
+class ChunkedScan:
+    def __init__(self, data_type: str):
+        self.data_type = data_type
+        self.counts = dict.fromkeys(SCAN_KEYS, 0)
+        self.samples = {key: [] for key in SCAN_KEYS}
+
+    def add(self, scan: dict, offset: int):
+        for key in SCAN_KEYS:
+            rows = scan[key]
+            self.counts[key] += len(rows)
+            room = PIPELINE_SAMPLE_ROWS - len(self.samples[key])
+            if room > 0:
+                self.samples[key].extend((rows[:room] + offset).tolist())
+
+    def as_scan(self) -> dict:
+        scan = {key: np.asarray(rows, dtype=np.int64) for key, rows in self.samples.items()}
+        scan['counts'] = dict(self.counts)
+        return scan
+
+
+# Enriched rows written chunk by chunk to a CSV file or a write-only workbook (which
+# openpyxl streams to disk), rolling over to a new sheet at the Excel row limit
+class ReportWriter:
+    def __init__(self, path: str, output_format: str):
+        self.path = path
+        self.output_format = output_format
+        self.columns = None
+        self.sheet_rows = 0
+        if output_format == 'csv':
+            self.file = open(path, 'w', newline='', encoding='utf-8')
+            self.csv_writer = csv.writer(self.file)
+        else:
+            self.workbook = Workbook(write_only=True)
+            self.sheet = None
+
+    def write(self, chunk: pd.DataFrame):
+        if self.columns is None:
+            self.columns = [str(col) for col in chunk.columns]
+            if self.output_format == 'csv':
+                self.csv_writer.writerow(self.columns)
+        rows = chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+        if self.output_format == 'csv':
+            self.csv_writer.writerows(rows)
+            return
+        for row in rows:
+            if self.sheet is None or self.sheet_rows >= EXCEL_MAX_ROWS:
+                self._new_sheet()
+            self.sheet.append(row)
+            self.sheet_rows += 1
+
+    def _new_sheet(self):
+        sheet_number = len(self.workbook.worksheets) + 1
+        self.sheet = self.workbook.create_sheet("VAT Report" if sheet_number == 1 else f"VAT Report {sheet_number}")
+        self.sheet.append(self.columns)
+        self.sheet_rows = 1
+
+    def close(self):
+        if self.output_format == 'csv':
+            self.file.close()
+        else:
+            if self.sheet is None and self.columns is not None:
+                self._new_sheet()
+            if not self.workbook.worksheets:
+                self.workbook.create_sheet("VAT Report")
+            self.workbook.save(self.path)
+
+
+# parse -> validate -> enrich -> write over fixed-size row chunks. Validation issues,
+# per-country and OSS aggregates, unmatched product/country keys and totals are
+# accumulated as each chunk passes; the enriched rows go straight to the report file.
+# With per-invoice rounding a chunk's trailing invoice is carried into the next chunk, so
+# an invoice is never split (its lines must be contiguous in the file).
+# Blocking: run it in an executor.
+class ChunkedPipeline:
+    def __init__(self, header_config: dict, registry: dict, fx_table, output_format: str = 'csv'):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format '{output_format}', expected one of {', '.join(OUTPUT_FORMATS)}")
+        self.header_config = header_config
+        self.registry = registry
+        self.fx_table = fx_table
+        self.output_format = output_format
+
+        self.rename_map = None
+        self.scans: dict[str, ChunkedScan] = {}
+        self.total_rows = 0
+        self.manual_review_count = 0
+        self.ledger_sums = pd.Series(0, index=['net_price', 'total_vat', 'gross_total'], dtype=np.int64)
+        self.country_totals = None
+        self.oss_detail = None
+        self.unmatched = {}
+
+    def run(self, filename: str, file_obj, work_dir: str, base_name: str) -> dict:
+        report_path = os.path.join(work_dir, f"{base_name}_VAT_Report.{self.output_format}")
+        writer = ReportWriter(report_path, self.output_format)
+        try:
+            carry = None
+            for chunk in iter_file_chunks(filename, file_obj):
+                if carry is not None:
+                    chunk = pd.concat([carry, chunk], ignore_index=True)
+                chunk, carry = self.split_at_invoice(chunk)
+                if chunk is not None:
+                    writer.write(self.process_chunk(chunk))
+            if carry is not None:
+                writer.write(self.process_chunk(carry))
+        finally:
+            writer.close()
+
+        summary_path = os.path.join(work_dir, f"{base_name}_Summary.xlsx")
+        result = self.write_summary(summary_path)
+
+        zip_path = os.path.join(work_dir, f"{base_name}_VAT_Reports.zip")
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            zipf.write(report_path, os.path.basename(report_path))
+            zipf.write(summary_path, os.path.basename(summary_path))
+        result['zip_path'] = zip_path
+        return result
+
+    def resolve_headers(self, chunk: pd.DataFrame):
+        if self.rename_map is None:
+            self.rename_map = resolve_headers(list(chunk.columns), self.header_config['alias_index'])
+
+    # (lines to process now, lines of the last invoice held back for the next chunk), either
+    # None when empty. A chunk holding one invoice is held back whole, as it may go on.
+    def split_at_invoice(self, chunk: pd.DataFrame) -> tuple[pd.DataFrame | None, pd.DataFrame | None]:
+        if VAT_ROUNDING_MODE != 'invoice' or chunk.empty:
+            return chunk, None
+        self.resolve_headers(chunk)
+        # Columns as enrich_frame will see them after the rename (the last match wins)
+        invoice_positions = [position for position, col in enumerate(chunk.columns) if str(self.rename_map.get(col, col)).lower() == VAT_INVOICE_COLUMN]
+        if not invoice_positions:
+            return chunk, None
+        invoices = chunk.iloc[:, invoice_positions[-1]]
+        last_invoice = invoices.iloc[-1]
+        if pd.isna(last_invoice):
+            # Lines without an invoice number are invoices of their own
+            return chunk, None
+        other = np.flatnonzero(invoices.to_numpy() != last_invoice)
+        if not len(other):
+            return None, chunk
+        split = other[-1] + 1
+        return chunk.iloc[:split], chunk.iloc[split:]
+
+    # Validate, enrich and aggregate one chunk; returns it with user-facing column labels
+    def process_chunk(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        offset = self.total_rows
+        self.resolve_headers(chunk)
+        chunk = chunk.rename(columns=self.rename_map)
+
+        expected_types = self.header_config['expected_types']
+        constraints = self.header_config['constraints']
+        for header_value in chunk.columns:
+            column_scan = self.scans.get(header_value)
+            if column_scan is None:
+                column_scan = self.scans[header_value] = ChunkedScan(get_user_friendly_dtype(chunk[header_value].dtype))
+            column_scan.add(
+                scan_column(chunk[header_value], header_value, expected_types.get(header_value, "string"), constraints.get(header_value)),
+                offset,
+            )
+
+        chunk, found, _, ledger = enrich_frame(chunk, self.registry['rate_table'], self.fx_table)
+
+        self.total_rows += len(chunk)
+        self.manual_review_count += int((~found).sum())
+        self.ledger_sums += ledger[self.ledger_sums.index].sum()
+        country_col = _find_columns(chunk).get('country')
+        if country_col:
+            country_sums = ledger[['net_price', 'total_vat']].groupby(chunk[country_col].to_numpy()).sum()
+            self.country_totals = country_sums if self.country_totals is None else self.country_totals.add(country_sums, fill_value=0).astype(np.int64)
+        oss_lines = group_oss_lines(chunk, found, ledger)
+        self.oss_detail = oss_lines if self.oss_detail is None else merge_oss_lines([self.oss_detail, oss_lines])
+        for entry in unmatched_keys(chunk, found, sample_rows=PIPELINE_SAMPLE_ROWS):
+            key = (entry['product_type'], entry['country'])
+            merged = self.unmatched.setdefault(key, {'product_type': key[0], 'country': key[1], 'row_count': 0, 'rows': []})
+            merged['row_count'] += entry['row_count']
+            merged['rows'].extend(row + offset for row in entry['rows'][:PIPELINE_SAMPLE_ROWS - len(merged['rows'])])
+
+        return chunk.rename(columns=self.header_config['header_labels'])
+
+    def data_issues(self) -> list[dict]:
+        header_labels = self.header_config['header_labels']
+        issues = []
+        for header_value, column_scan in self.scans.items():
+            issues.extend(build_column_issues(
+                header_value,
+                header_labels.get(header_value, header_value),
+                column_scan.data_type,
+                self.header_config['expected_types'].get(header_value, "string"),
+                column_scan.as_scan(),
+                max(self.total_rows, 1),
+                self.header_config['constraints'].get(header_value),
+            ))
+        return issues
+
+    # Summary workbook (per-country summary, OSS sheets, data issues, missing VAT rules)
+    # and the JSON-ready pipeline result
+    def write_summary(self, path: str) -> dict:
+        if self.country_totals is not None:
+            summary = pd.DataFrame({
+                'Country': self.country_totals.index,
+                'Net Sales': from_minor_units(self.country_totals['net_price'].to_numpy()),
+                'VAT Amount': from_minor_units(self.country_totals['total_vat'].to_numpy()),
+            })
+        else:
+            summary = pd.DataFrame(columns=['Country', 'Net Sales', 'VAT Amount'])
+
+        data_issues = self.data_issues()
+        missing_headers = [field for field in self.header_config['required_headers'] if field not in self.scans]
+        unmatched_pairs = suggest_rules(self.registry, sorted(self.unmatched.values(), key=lambda entry: -entry['row_count']))
+
+        with pd.ExcelWriter(path, engine='openpyxl') as writer:
+            summary.to_excel(writer, index=False, sheet_name="Summary")
+            if self.oss_detail is not None:
+                write_oss_sheets(writer, rollup_levels(self.oss_detail))
+            pd.DataFrame(
+                [(issue['column_name'], issue['issue_type'], issue['issue_description']) for issue in data_issues],
+                columns=['Column', 'Issue', 'Description'],
+            ).to_excel(writer, index=False, sheet_name="Data Issues")
+            pd.DataFrame(
+                [(pair['product_type'], pair['country'], pair['row_count'], ", ".join(map(str, pair['rows']))) for pair in unmatched_pairs],
+                columns=['Product Type', 'Country', 'Rows', 'First Rows'],
+            ).to_excel(writer, index=False, sheet_name="Missing VAT Rules")
+
+        return {
+            'total_rows': self.total_rows,
+            'missing_headers': missing_headers,
+            'data_issue_count': len(data_issues),
+            'manual_review_count': self.manual_review_count,
+            'vat_summary': {
+                "overall_vat_amount": total_amount(self.ledger_sums['total_vat']),
+                "overall_net_price": total_amount(self.ledger_sums['net_price']),
+                "overall_gross_total": total_amount(self.ledger_sums['gross_total']),
+            },
+        }
@@ -0,0 +1,673 @@
+import os
+import re
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from app.core.helper import get_user_friendly_dtype
+from app.core.executors import get_process_pool, reset_process_pool, run_in_thread
+from app.core.constraints import CompiledConstraints
+
+# Fan columns out to the process pool only when the file is wide and long enough
+# for the worker round-trip to pay off
+PARALLEL_MIN_COLUMNS = int(os.getenv("PARALLEL_VALIDATION_MIN_COLUMNS", 16))
+PARALLEL_MIN_ROWS = int(os.getenv("PARALLEL_VALIDATION_MIN_ROWS", 5000))
+
+EMPTY_MARKERS = ['', 'nan', 'None', '(empty)', '(null)']
+DATE_FORMATS = ["%d-%m-%Y", "%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y", "%Y/%m/%d"]
+NUMERIC_PATTERN = re.compile(r'^-?\d+\.?\d*$')
+CURRENCY_PATTERN = re.compile(r'^[A-Z]{3}$')
+# Whole numbers written with a zero fraction ("3.0"); leading zeros stay significant
+INTEGRAL_DECIMAL_PATTERN = re.compile(r'^-?(0|[1-9][0-9]*)\.0+$')
+
+
+# Validate a single cell value against the expected type; returns (is_valid, error_msg)
+def validate_value(val, expected_type: str, header_value: str) -> tuple[bool, str]:
+    try:
+        if expected_type == 'integer':
+            # Check if it's a boolean first
+            if isinstance(val, bool):
+                return False, "Boolean value found where integer expected"
+            if isinstance(val, str):
+                # Remove whitespace and check if it's a valid integer string
+                clean_val = val.strip()
+                if not clean_val.replace('-', '').replace('+', '').isdigit():
+                    return False, f"Non-integer string: '{val}'"
+                int(clean_val)
+            else:
+                # For numeric types, check if it's a whole number
+                float_val = float(val)
+                if float_val != int(float_val):
+                    return False, f"Decimal value where integer expected: {val}"
+
+        elif expected_type == 'float':
+            try:
+                float(val)
+            except (ValueError, TypeError):
+                return False, f"Cannot convert to float: '{val}'"
+
+        elif expected_type == 'date':
+            # Try multiple date formats
+            for fmt in DATE_FORMATS:
+                try:
+                    pd.to_datetime(str(val), format=fmt, errors='raise')
+                    return True, ""
+                except Exception:
+                    continue
+            try:
+                pd.to_datetime(str(val), errors='raise')
+            except Exception:
+                return False, f"Invalid date format: '{val}'"
+
+        elif expected_type == 'text_only':
+            # Text that shouldn't contain only numbers
+            if NUMERIC_PATTERN.match(str(val).strip()):
+                return False, f"Numeric value found where text expected: '{val}'"
+
+        elif expected_type == 'string':
+            str_val = str(val).strip()
+
+            # Business logic rules based on column name
+            if header_value == 'product_type':
+                if NUMERIC_PATTERN.match(str_val):
+                    return False, f"Product type should not be a number: '{val}'"
+                elif len(str_val) < 2:
+                    return False, f"Product type too short: '{val}'"
+
+            elif header_value == 'country':
+                if NUMERIC_PATTERN.match(str_val):
+                    return False, f"Country should not be a number: '{val}'"
+
+            elif header_value == 'currency':
+                if not CURRENCY_PATTERN.match(str_val.upper()):
+                    return False, f"Invalid currency code format: '{val}' (should be 3 letters like EUR, USD)"
+
+    except Exception as validation_error:
+        return False, f"Validation error: {str(validation_error)}"
+
+    return True, ""
+
+
+# Factorize a column into per-row codes (-1 for nulls) and the row position of one
+# representative per distinct value. Code k first appears at representatives[k].
+def factorize_column(series: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    codes, _ = pd.factorize(series, use_na_sentinel=True)
+    present = codes >= 0
+
+    if series.dtype == object and pd.api.types.infer_dtype(series, skipna=True).startswith('mixed'):
+        # Equal values of different Python types (1, 1.0, True) can validate differently; keep them apart
+        type_codes, type_uniques = pd.factorize(series.map(type))
+        combined = codes * len(type_uniques) + type_codes
+        codes = np.full(len(series), -1, dtype=np.int64)
+        codes[present], _ = pd.factorize(combined[present])
+
+    distinct_codes, first_positions = np.unique(codes, return_index=True)
+    return codes, first_positions[distinct_codes >= 0]
+
+
+# Scan one column and return the positions (0-based) of null, missing, invalid and
+# constraint-breaking cells.
+# Validators run once per distinct value and the verdicts are broadcast back to the rows
+# through the factorized codes, so the Python work is O(unique values), not O(rows).
+def scan_column(series: pd.Series, header_value: str, expected_type: str, constraints: CompiledConstraints | None = None) -> dict:
+    codes, representatives = factorize_column(series)
+    null_mask = codes < 0
+    present = ~null_mask
+
+    distinct_values = series.iloc[representatives].tolist()
+    distinct_empty = np.fromiter((str(val).strip() in EMPTY_MARKERS for val in distinct_values), dtype=bool, count=len(distinct_values))
+    distinct_invalid = np.fromiter(
+        (
+            # Blank strings are reported as missing, not as invalid
+            not (isinstance(val, str) and val.strip() == '') and not validate_value(val, expected_type, header_value)[0]
+            for val in distinct_values
+        ),
+        dtype=bool,
+        count=len(distinct_values),
+    )
+
+    empty_mask = np.zeros(len(series), dtype=bool)
+    empty_mask[present] = distinct_empty[codes[present]]
+    # Nulls count as empty when their text form is a marker ("nan", "None")
+    empty_mask[null_mask] = series[null_mask].astype(str).str.strip().isin(EMPTY_MARKERS).to_numpy()
+
+    invalid_mask = np.zeros(len(series), dtype=bool)
+    invalid_mask[present] = distinct_invalid[codes[present]]
+
+    # Header constraint rules, evaluated on the distinct non-missing values
+    constraint_mask = np.zeros(len(series), dtype=bool)
+    if constraints is not None and constraints.has_value_rules:
+        distinct_violations = constraints.violations(distinct_values) & ~distinct_empty
+        constraint_mask[present] = distinct_violations[codes[present]]
+
+    return {
+        'null_rows': np.flatnonzero(null_mask),
+        'empty_rows': np.flatnonzero(empty_mask),
+        'missing_rows': np.flatnonzero(null_mask | empty_mask),
+        'invalid_rows': np.flatnonzero(invalid_mask),
+        'constraint_rows': np.flatnonzero(constraint_mask),
+    }
+
+
+# Number of flagged rows of one kind. Scans accumulated over chunks keep only the first
+# rows of each kind and carry the full counts separately.
+def _scan_count(scan: dict, key: str) -> int:
+    return scan.get('counts', {}).get(key, len(scan.get(key, [])))
+
+
+# Turn a column scan into the MISSING_DATA / INVALID_TYPE issue dicts the frontend expects
+def build_column_issues(header_value: str, header_label: str, data_type: str, expected_type: str, scan: dict, total_rows: int, constraints: CompiledConstraints | None = None) -> list[dict]:
+    issues = []
+
+    missing_rows = scan['missing_rows']
+    total_empty = _scan_count(scan, 'missing_rows')
+    # Optional columns (required: false) may be left blank
+    if total_empty > 0 and (constraints is None or constraints.required):
+        missing_rows_display = [str(row + 2) for row in missing_rows.tolist()]
+        issue_description = f"Column '{header_label}' has {total_empty} missing values"
+        if total_empty > 10:
+            issue_description += f" (showing first 10 rows: {','.join(missing_rows_display[:10])}...)"
+        else:
+            issue_description += f" in rows: {', '.join(missing_rows_display)}"
+
+        issues.append({
+            'header_value': header_value,
+            'header_label': header_label,
+            'original_column': header_value,
+            'issue_type': 'MISSING_DATA',
+            'issue_description': issue_description,
+            'column_name': header_label,
+            'data_type': data_type,
+            'null_count': _scan_count(scan, 'null_rows'),
+            'empty_count': _scan_count(scan, 'empty_rows'),
+            'total_missing': total_empty,
+            'percentage': round((total_empty / total_rows) * 100, 2),
+            'missing_rows': missing_rows_display,
+            'has_more_rows': total_empty > 10
+        })
+
+    invalid_rows = scan['invalid_rows']
+    invalid_count = _scan_count(scan, 'invalid_rows')
+    if invalid_count > 0:
+        invalid_rows_display = [int(row) + 2 for row in invalid_rows[:10]]  # +2 for 1-indexed + header row
+        issue_description = f"Column '{header_label}' has invalid {expected_type} values in rows: {', '.join(map(str, invalid_rows_display))}"
+        if invalid_count > 10:
+            issue_description += "..."
+
+        issues.append({
+            'header_value': header_value,
+            'header_label': header_label,
+            'original_column': header_value,
+            'issue_type': 'INVALID_TYPE',
+            'issue_description': issue_description,
+            'column_name': header_label,
+            'expected_type': expected_type,
+            'invalid_rows': invalid_rows_display,
+            'invalid_count': invalid_count,
+            'total_rows': total_rows,
+            'percentage': round((invalid_count / total_rows) * 100, 2),
+            'has_more_rows': invalid_count > 10
+        })
+
+    constraint_rows = scan.get('constraint_rows', [])
+    violation_count = _scan_count(scan, 'constraint_rows')
+    if violation_count > 0 and constraints is not None:
+        violation_rows_display = [int(row) + 2 for row in constraint_rows[:10]]
+        issue_description = f"Column '{header_label}' has {violation_count} values that break its rules ({constraints.describe()}) in rows: {', '.join(map(str, violation_rows_display))}"
+        if violation_count > 10:
+            issue_description += "..."
+
+        issues.append({
+            'header_value': header_value,
+            'header_label': header_label,
+            'original_column': header_value,
+            'issue_type': 'CONSTRAINT_VIOLATION',
+            'issue_description': issue_description,
+            'column_name': header_label,
+            'constraints': constraints.spec,
+            'invalid_rows': violation_rows_display,
+            'invalid_count': violation_count,
+            'total_rows': total_rows,
+            'percentage': round((violation_count / total_rows) * 100, 2),
+            'has_more_rows': violation_count > 10
+        })
+
+    return issues
+
+
+# Serialize a column as an Arrow IPC stream so workers receive columnar buffers
+# instead of a pickled object array. Mixed-type object columns (e.g. Excel cells
+# holding both numbers and text) have no Arrow type and are shipped as-is.
+def encode_column(series: pd.Series):
+    try:
+        array = pa.Array.from_pandas(series)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return series.reset_index(drop=True)
+
+    batch = pa.record_batch([array], names=["value"])
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def _encode_columns(df: pd.DataFrame) -> list:
+    return [encode_column(df.iloc[:, position]) for position in range(len(df.columns))]
+
+
+def decode_column(payload) -> pd.Series:
+    if isinstance(payload, pd.Series):
+        return payload
+    table = pa.ipc.open_stream(payload).read_all()
+    return table.column(0).to_pandas()
+
+
+# Process pool entry point: must stay a top-level function so it can be pickled
+def _scan_column_job(payload, header_value: str, expected_type: str, constraints: CompiledConstraints | None) -> dict:
+    return scan_column(decode_column(payload), header_value, expected_type, constraints)
+
+
+async def _scan_columns_parallel(df: pd.DataFrame, expected_types: dict, constraints: dict) -> list[dict]:
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    # Encoding copies every column, so it runs off the event loop too
+    payloads = await run_in_thread(_encode_columns, df)
+    futures = [
+        loop.run_in_executor(
+            pool,
+            _scan_column_job,
+            payload,
+            header_value,
+            expected_types.get(header_value, "string"),
+            constraints.get(header_value),
+        )
+        for payload, header_value in zip(payloads, df.columns)
+    ]
+    # gather keeps the results in column order regardless of completion order
+    return await asyncio.gather(*futures)
+
+
+# Scan every column of `frame` in column order, fanning out to the process pool for wide files
+async def _scan_frame(frame: pd.DataFrame, expected_types: dict, constraints: dict) -> list[dict]:
+    if len(frame.columns) >= PARALLEL_MIN_COLUMNS and len(frame) >= PARALLEL_MIN_ROWS:
+        try:
+            return await _scan_columns_parallel(frame, expected_types, constraints)
+        except BrokenProcessPool as pool_error:
+            print(f"Validation pool failed, falling back to inline validation: {str(pool_error)}")
+            reset_process_pool()
+
+    return await run_in_thread(_scan_frame_inline, frame, expected_types, constraints)
+
+
+def _scan_frame_inline(frame: pd.DataFrame, expected_types: dict, constraints: dict) -> list[dict]:
+    return [
+        scan_column(frame.iloc[:, position], header_value, expected_types.get(header_value, "string"), constraints.get(header_value))
+        for position, header_value in enumerate(frame.columns)
+    ]
+
+
+# Per-row content hash. Cells are hashed by a canonical text so the same value hashes
+# identically across uploads whatever dtype its column was read as: 3.5 (float column) and
+# "3.5" (text column) match, and so do 100 (int column) and 100.0 (a column read as float
+# because a cell was blank). Blank cells all hash as "".
+def hash_rows(df: pd.DataFrame) -> np.ndarray:
+    if len(df.columns) == 0:
+        return np.zeros(len(df), dtype=np.uint64)
+    text = pd.DataFrame({position: _hash_text(df.iloc[:, position]) for position in range(len(df.columns))})
+    return pd.util.hash_pandas_object(text, index=False).to_numpy()
+
+
+def _hash_text(col: pd.Series) -> np.ndarray:
+    if pd.api.types.is_object_dtype(col.dtype):
+        # Text, possibly mixed with numbers (xlsx): canonicalize each distinct value once
+        codes, uniques = pd.factorize(col)
+        canonical = np.array([_cell_text(value) for value in uniques] + [""], dtype=object)
+        return canonical[codes]
+    text = col.astype(str).to_numpy(dtype=object)
+    if pd.api.types.is_float_dtype(col.dtype):
+        values = col.to_numpy(dtype=float)
+        integral = np.isfinite(values) & (np.floor(values) == values) & (np.abs(values) < 2 ** 53)
+        text[integral] = values[integral].astype(np.int64).astype(str)
+    text[col.isna().to_numpy()] = ""
+    return text
+
+
+def _cell_text(value) -> str:
+    if isinstance(value, (float, np.floating)) and np.isfinite(value) and float(value).is_integer() and abs(value) < 2 ** 53:
+        return str(int(value))
+    if isinstance(value, str) and INTEGRAL_DECIMAL_PATTERN.match(value):
+        # "3.0" hashes like the 3.0 it parses to in a float column
+        return value.split('.')[0]
+    return str(value)
+
+
+# Match rows of a re-upload against the previous session by content hash.
+# Returns, for every new row, the position of an identical previous row or -1.
+def match_previous_rows(row_hashes: np.ndarray, previous_hashes: np.ndarray) -> np.ndarray:
+    previous_index = pd.Index(previous_hashes)
+    first_seen = ~previous_index.duplicated()
+    unique_index = previous_index[first_seen]
+    matches = unique_index.get_indexer(row_hashes)
+    return np.where(matches >= 0, np.flatnonzero(first_seen)[matches], -1)
+
+
+# Rebuild a column scan from the previous session's verdicts for unchanged rows plus
+# a fresh scan of the changed rows
+def _merge_scan(previous_scan: dict, previous_rows: int, changed_scan: dict, matched_old: np.ndarray, changed_positions: np.ndarray, total_rows: int) -> dict:
+    reused = matched_old >= 0
+    scan = {}
+    for key in ('null_rows', 'empty_rows', 'invalid_rows', 'constraint_rows'):
+        previous_mask = np.zeros(previous_rows, dtype=bool)
+        previous_mask[previous_scan[key]] = True
+        mask = np.zeros(total_rows, dtype=bool)
+        mask[reused] = previous_mask[matched_old[reused]]
+        mask[changed_positions[changed_scan[key]]] = True
+        scan[key] = np.flatnonzero(mask)
+    scan['missing_rows'] = np.union1d(scan['null_rows'], scan['empty_rows'])
+    return scan
+
+
+# Blocking part of an incremental validation: match rows against the previous session,
+# split the columns into those whose verdicts can be reused for unchanged rows and those
+# rescanned in full, and cut out the frames to scan
+def _plan_incremental_scan(df: pd.DataFrame, column_dtypes: list[str], row_hashes: np.ndarray, previous_state: dict) -> tuple:
+    matched_old = match_previous_rows(row_hashes, previous_state['row_hashes'])
+    changed_positions = np.flatnonzero(matched_old < 0)
+
+    # Columns whose dtype changed are rescanned in full: the same text can validate
+    # differently once it is parsed as a number
+    reuse_columns = [
+        position for position, dtype in enumerate(column_dtypes)
+        if dtype == previous_state['column_dtypes'][position]
+    ]
+    rescan_columns = [position for position in range(len(column_dtypes)) if position not in reuse_columns]
+    return matched_old, changed_positions, reuse_columns, rescan_columns, df.iloc[changed_positions, reuse_columns], df.iloc[:, rescan_columns]
+
+
+def _assemble_scans(previous_state: dict, columns: list, reuse_columns: list[int], changed_scans: list[dict], rescan_columns: list[int], full_scans: list[dict], matched_old: np.ndarray, changed_positions: np.ndarray, total_rows: int) -> list[dict]:
+    scans = [None] * len(columns)
+    for position, changed_scan in zip(reuse_columns, changed_scans):
+        scans[position] = _merge_scan(
+            previous_state['scans'][columns[position]],
+            len(previous_state['row_hashes']),
+            changed_scan,
+            matched_old,
+            changed_positions,
+            total_rows,
+        )
+    for position, full_scan in zip(rescan_columns, full_scans):
+        scans[position] = full_scan
+    return scans
+
+
+# Scans and data issues keyed by column
+def _column_issues(df: pd.DataFrame, columns: list, scans: list[dict], expected_types: dict, header_labels: dict, constraints: dict) -> tuple[dict, dict]:
+    column_scans = {}
+    column_issues = {}
+    for position, (header_value, scan) in enumerate(zip(columns, scans)):
+        column_scans[header_value] = scan
+        try:
+            column_issues[header_value] = build_column_issues(
+                header_value,
+                header_labels.get(header_value, header_value),
+                get_user_friendly_dtype(df.iloc[:, position].dtype),
+                expected_types.get(header_value, "string"),
+                scan,
+                len(df),
+                constraints.get(header_value),
+            )
+        except Exception as col_error:
+            print(f"Error building issues for column {header_value}: {str(col_error)}")
+            column_issues[header_value] = []
+    return column_scans, column_issues
+
+
+# Validate every column of the (already renamed) DataFrame. Returns the data issues in
+# column order plus the validation state (per-column scans, row hashes) that the session
+# keeps so later cell edits and corrected re-uploads can be revalidated incrementally.
+# When `previous_state` comes from a session with the same columns and header types,
+# only rows whose content hash is new are validated; the rest reuse cached verdicts.
+async def validate_columns(df: pd.DataFrame, expected_types: dict, header_labels: dict, previous_state: dict | None = None, constraints: dict | None = None) -> tuple[list[dict], dict]:
+    constraints = constraints or {}
+    columns = list(df.columns)
+    column_dtypes = [str(dtype) for dtype in df.dtypes]
+    row_hashes = await run_in_thread(hash_rows, df)
+
+    can_reuse = (
+        previous_state is not None
+        and previous_state.get('columns') == columns
+        and previous_state.get('expected_types') == expected_types
+        and previous_state.get('constraints', {}) == constraints
+    )
+
+    if not can_reuse:
+        scans = await _scan_frame(df, expected_types, constraints)
+        reused_rows = 0
+    else:
+        matched_old, changed_positions, reuse_columns, rescan_columns, changed_frame, rescan_frame = await run_in_thread(
+            _plan_incremental_scan, df, column_dtypes, row_hashes, previous_state
+        )
+        reused_rows = len(df) - len(changed_positions)
+
+        changed_scans = await _scan_frame(changed_frame, expected_types, constraints)
+        full_scans = await _scan_frame(rescan_frame, expected_types, constraints)
+        scans = await run_in_thread(
+            _assemble_scans, previous_state, columns, reuse_columns, changed_scans, rescan_columns, full_scans, matched_old, changed_positions, len(df)
+        )
+
+    column_scans, column_issues = await run_in_thread(_column_issues, df, columns, scans, expected_types, header_labels, constraints)
+
+    data_issues = [issue for issues in column_issues.values() for issue in issues]
+    return data_issues, {
+        'columns': columns,
+        'column_dtypes': column_dtypes,
+        'row_hashes': row_hashes,
+        'reused_rows': reused_rows,
+        'constraints': constraints,
+        'scans': column_scans,
+        'column_issues': column_issues,
+    }
+
+
+# Positions of rows whose (product_type, country) pair has no rule in the products
+# registry. The pair key is normalized once per distinct combination and tested against
+# the registry's hash set; the verdict is broadcast back to rows. Rows where either cell
+# is missing are skipped, they are already reported as MISSING_DATA.
+def find_unknown_pairs(product_types: pd.Series, countries: pd.Series, known_pairs: set) -> np.ndarray:
+    type_codes, type_uniques = pd.factorize(product_types, use_na_sentinel=True)
+    country_codes, _ = pd.factorize(countries, use_na_sentinel=True)
+    present = (type_codes >= 0) & (country_codes >= 0)
+
+    pair_codes = np.full(len(product_types), -1, dtype=np.int64)
+    pair_codes[present], _ = pd.factorize(country_codes[present] * max(len(type_uniques), 1) + type_codes[present])
+    distinct_codes, first_positions = np.unique(pair_codes, return_index=True)
+    representatives = first_positions[distinct_codes >= 0]
+
+    distinct_unknown = np.fromiter(
+        (
+            str(product_type).strip() not in EMPTY_MARKERS
+            and str(country).strip() not in EMPTY_MARKERS
+            and (str(product_type).strip().lower(), str(country).strip().lower()) not in known_pairs
+            for product_type, country in zip(product_types.iloc[representatives].tolist(), countries.iloc[representatives].tolist())
+        ),
+        dtype=bool,
+        count=len(representatives),
+    )
+
+    unknown_mask = np.zeros(len(product_types), dtype=bool)
+    unknown_mask[present] = distinct_unknown[pair_codes[present]]
+    return np.flatnonzero(unknown_mask)
+
+
+# Build the UNKNOWN_PRODUCT_COUNTRY issue from the flagged row positions
+def build_registry_issues(df: pd.DataFrame, unknown_rows: np.ndarray, header_labels: dict) -> list[dict]:
+    unknown_count = len(unknown_rows)
+    if unknown_count == 0:
+        return []
+
+    combinations = (
+        df.iloc[unknown_rows][['product_type', 'country']]
+        .astype(str)
+        .apply(lambda col: col.str.strip())
+        .value_counts()
+        .head(20)
+    )
+    unknown_combinations = [
+        {'product_type': product_type, 'country': country, 'count': int(count)}
+        for (product_type, country), count in combinations.items()
+    ]
+
+    header_label = header_labels.get('product_type', 'product_type')
+    country_label = header_labels.get('country', 'country')
+    invalid_rows_display = [int(row) + 2 for row in unknown_rows[:10]]
+    issue_description = (
+        f"{unknown_count} rows have a {header_label} / {country_label} combination with no VAT rule "
+        f"(e.g. '{unknown_combinations[0]['product_type']}' / '{unknown_combinations[0]['country']}') "
+        f"in rows: {', '.join(map(str, invalid_rows_display))}"
+    )
+    if unknown_count > 10:
+        issue_description += "..."
+
+    return [{
+        'header_value': 'product_type',
+        'header_label': header_label,
+        'original_column': 'product_type',
+        'issue_type': 'UNKNOWN_PRODUCT_COUNTRY',
+        'issue_description': issue_description,
+        'column_name': header_label,
+        'invalid_rows': invalid_rows_display,
+        'invalid_count': unknown_count,
+        'total_rows': len(df),
+        'percentage': round((unknown_count / len(df)) * 100, 2),
+        'has_more_rows': unknown_count > 10,
+        'unknown_combinations': unknown_combinations,
+    }]
+
+
+# Check (product_type, country) pairs against the registry and record the result on the
+# validation state. With `positions`, only those rows are rechecked (after cell edits).
+def check_registry_pairs(df: pd.DataFrame, validation_state: dict, known_pairs: set, positions: np.ndarray | None = None) -> None:
+    validation_state.setdefault('unknown_pair_rows', np.array([], dtype=np.int64))
+    # Without both columns, or with an empty registry, there is nothing to check against
+    if 'product_type' not in df.columns or 'country' not in df.columns or not known_pairs:
+        validation_state['unknown_pair_rows'] = np.array([], dtype=np.int64)
+        validation_state['row_issues'] = []
+        return
+
+    if positions is None:
+        validation_state['unknown_pair_rows'] = find_unknown_pairs(df['product_type'], df['country'], known_pairs)
+    else:
+        positions = np.unique(np.asarray(positions, dtype=np.int64))
+        flagged = positions[find_unknown_pairs(df['product_type'].iloc[positions], df['country'].iloc[positions], known_pairs)]
+        kept = np.setdiff1d(validation_state['unknown_pair_rows'], positions, assume_unique=True)
+        validation_state['unknown_pair_rows'] = np.union1d(kept, flagged)
+
+    validation_state['row_issues'] = build_registry_issues(df, validation_state['unknown_pair_rows'], validation_state['header_labels'])
+
+
+# Full issue list in display order: per-column issues, then cross-column row issues
+def collect_data_issues(validation_state: dict) -> list[dict]:
+    data_issues = [issue for issues in validation_state['column_issues'].values() for issue in issues]
+    data_issues.extend(validation_state.get('row_issues', []))
+    return data_issues
+
+
+# Cell-level view of a scan: which issue types flag each of the given positions
+def _flagged_cells(scan: dict, positions: np.ndarray) -> dict[str, np.ndarray]:
+    return {
+        'MISSING_DATA': np.isin(positions, scan['missing_rows']),
+        'INVALID_TYPE': np.isin(positions, scan['invalid_rows']),
+        'CONSTRAINT_VIOLATION': np.isin(positions, scan['constraint_rows']),
+    }
+
+
+# Re-run the validators for the touched cells only and patch the stored scans and
+# column issues in place. `touched` maps a column to the row positions that changed.
+# Cost is proportional to the number of edits (plus the issue lists of touched columns),
+# never to the number of rows in the file.
+def revalidate_cells(df: pd.DataFrame, validation_state: dict, touched: dict[str, list[int]]) -> dict:
+    scans = validation_state['scans']
+    column_issues = validation_state['column_issues']
+    expected_types = validation_state['expected_types']
+    header_labels = validation_state['header_labels']
+    constraints = validation_state.get('constraints', {})
+
+    resolved = []
+    new = []
+    for header_value, touched_positions in touched.items():
+        positions = np.unique(np.asarray(touched_positions, dtype=np.int64))
+        expected_type = expected_types.get(header_value, "string")
+        header_label = header_labels.get(header_value, header_value)
+        col_pos = df.columns.get_loc(header_value)
+        column_constraints = constraints.get(header_value)
+        scan = scans[header_value]
+        scan.setdefault('constraint_rows', np.array([], dtype=np.int64))
+        before = _flagged_cells(scan, positions)
+
+        values = df.iloc[positions, col_pos].tolist()
+        null_rows, empty_rows, invalid_rows, constraint_rows = [], [], [], []
+        messages = {}
+        if column_constraints is not None and column_constraints.has_value_rules:
+            violated = column_constraints.violations(values)
+        else:
+            violated = np.zeros(len(values), dtype=bool)
+        for pos, val, breaks_rule in zip(positions.tolist(), values, violated.tolist()):
+            is_null = bool(pd.isnull(val))
+            if is_null:
+                null_rows.append(pos)
+            if str(val).strip() in EMPTY_MARKERS:
+                empty_rows.append(pos)
+            if is_null or (isinstance(val, str) and val.strip() == ''):
+                continue
+            is_valid, error_msg = validate_value(val, expected_type, header_value)
+            if not is_valid:
+                invalid_rows.append(pos)
+                messages[('INVALID_TYPE', pos)] = error_msg
+            if breaks_rule and str(val).strip() not in EMPTY_MARKERS:
+                constraint_rows.append(pos)
+                messages[('CONSTRAINT_VIOLATION', pos)] = f"Value '{val}' in column '{header_label}' {column_constraints.describe()}"
+
+        for key, flagged in (
+            ('null_rows', null_rows),
+            ('empty_rows', empty_rows),
+            ('invalid_rows', invalid_rows),
+            ('constraint_rows', constraint_rows),
+        ):
+            kept = np.setdiff1d(scan[key], positions, assume_unique=True)
+            scan[key] = np.union1d(kept, np.asarray(flagged, dtype=np.int64))
+        scan['missing_rows'] = np.union1d(scan['null_rows'], scan['empty_rows'])
+
+        after = _flagged_cells(scan, positions)
+        for issue_type in ('MISSING_DATA', 'INVALID_TYPE', 'CONSTRAINT_VIOLATION'):
+            if issue_type == 'MISSING_DATA' and column_constraints is not None and not column_constraints.required:
+                continue
+            for pos in positions[before[issue_type] & ~after[issue_type]].tolist():
+                resolved.append({'row': pos + 2, 'column': header_value, 'column_name': header_label, 'issue_type': issue_type})
+            for pos in positions[~before[issue_type] & after[issue_type]].tolist():
+                new.append({
+                    'row': pos + 2,
+                    'column': header_value,
+                    'column_name': header_label,
+                    'issue_type': issue_type,
+                    'message': messages.get((issue_type, pos), f"Column '{header_label}' is missing a value"),
+                })
+
+        column_issues[header_value] = build_column_issues(
+            header_value,
+            header_label,
+            get_user_friendly_dtype(df.iloc[:, col_pos].dtype),
+            expected_type,
+            scan,
+            len(df),
+            column_constraints,
+        )
+
+    # Keep row hashes and column dtypes current so the session can still serve as the
+    # base of a later re-upload diff
+    if touched:
+        edited_rows = np.unique(np.concatenate([np.asarray(rows, dtype=np.int64) for rows in touched.values()]))
+        validation_state['row_hashes'][edited_rows] = hash_rows(df.iloc[edited_rows])
+    validation_state['column_dtypes'] = [str(dtype) for dtype in df.dtypes]
+
+    return {'resolved': resolved, 'new': new}
@@ -0,0 +1,78 @@
+import re
+import numpy as np
+import pandas as pd
+
+# Optional rule fields a header document may carry
+CONSTRAINT_FIELDS = ('regex', 'min_value', 'max_value', 'allowed_values', 'max_length', 'required')
+
+
+# Business rules for one header, compiled once per header-config change. Checks run on
+# arrays of values (the distinct values of a column), never cell by cell.
+class CompiledConstraints:
+    def __init__(self, spec: dict):
+        self.spec = {field: spec.get(field) for field in CONSTRAINT_FIELDS if spec.get(field) is not None}
+        self.required = bool(self.spec.get('required', True))
+        self.pattern = re.compile(self.spec['regex']) if self.spec.get('regex') else None
+        self.min_value = self.spec.get('min_value')
+        self.max_value = self.spec.get('max_value')
+        self.allowed_values = (
+            {str(value).strip().lower() for value in self.spec['allowed_values']}
+            if self.spec.get('allowed_values') else None
+        )
+        self.max_length = self.spec.get('max_length')
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, CompiledConstraints) and self.spec == other.spec
+
+    @property
+    def has_value_rules(self) -> bool:
+        return any(rule is not None for rule in (self.pattern, self.min_value, self.max_value, self.allowed_values, self.max_length))
+
+    # Human-readable summary used in issue descriptions
+    def describe(self) -> str:
+        rules = []
+        if self.pattern is not None:
+            rules.append(f"must match pattern {self.pattern.pattern}")
+        if self.min_value is not None:
+            rules.append(f"must be at least {self.min_value}")
+        if self.max_value is not None:
+            rules.append(f"must be at most {self.max_value}")
+        if self.allowed_values is not None:
+            rules.append(f"must be one of {', '.join(sorted(self.allowed_values))}")
+        if self.max_length is not None:
+            rules.append(f"must be at most {self.max_length} characters")
+        return "; ".join(rules)
+
+    # Boolean array: True where a (non-missing) value breaks at least one rule
+    def violations(self, values: list) -> np.ndarray:
+        violated = np.zeros(len(values), dtype=bool)
+        if not values or not self.has_value_rules:
+            return violated
+
+        text = pd.Series(values, dtype=object).astype(str).str.strip()
+        if self.pattern is not None:
+            violated |= ~text.str.fullmatch(self.pattern).fillna(False).to_numpy(dtype=bool)
+        if self.min_value is not None or self.max_value is not None:
+            # Non-numeric values are the type check's business, only range-check numbers
+            numbers = pd.to_numeric(text, errors='coerce').to_numpy(dtype=float)
+            if self.min_value is not None:
+                violated |= numbers < self.min_value
+            if self.max_value is not None:
+                violated |= numbers > self.max_value
+        if self.allowed_values is not None:
+            violated |= ~text.str.lower().isin(self.allowed_values).to_numpy()
+        if self.max_length is not None:
+            violated |= (text.str.len() > self.max_length).to_numpy()
+        return violated
+
+
+# Compile the constraint fields of every header that defines any
+def compile_header_constraints(headers: list[dict]) -> dict[str, CompiledConstraints]:
+    compiled = {}
+    for header in headers:
+        if any(header.get(field) is not None for field in CONSTRAINT_FIELDS):
+            try:
+                compiled[header['value']] = CompiledConstraints(header)
+            except re.error as regex_error:
+                print(f"Ignoring invalid regex for header {header['value']}: {str(regex_error)}")
+    return compiled
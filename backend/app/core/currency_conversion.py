@@ -1,11 +1,17 @@
+import os
+import hashlib
 from collections import defaultdict
-from pymongo import DESCENDING
-from datetime import datetime
+import numpy as np
+import pandas as pd
 from app.core.database import db
+from app.core.cache import TTLCache
+from app.core.money import to_minor_units, from_minor_units
 
 async def get_ecb_fx_rates_from_db() -> dict[str, dict[str, float]]:
     historical_rates = defaultdict(dict)
-    cursor = db["currency_update"].find().sort("date", DESCENDING)
+    # Only the rate fields, unsorted: FxTable orders each series itself, and a server-side
+    # sort of the whole (growing) collection is the slowest part of the read
+    cursor = db["currency_update"].find({}, {"_id": 0, "date": 1, "currency_code": 1, "value": 1})
 
     async for doc in cursor:
         date = doc.get("date")
@@ -18,35 +24,190 @@ async def get_ecb_fx_rates_from_db() -> dict[str, dict[str, float]]:
     return historical_rates
 
 
-def get_fx_rate_by_date_from_db_rates(rates_dict: dict[str, dict[str, float]], order_date: str, currency: str) -> float:
-    currency = currency.upper()
-    if currency == "EUR":
-        return 1.0
+# How an order date is matched to an ECB rate date:
+#   "nearest"  - closest published date on either side (ties go to the later date), as before
+#   "previous" - the last published date on or before the order date (previous business
+#                day for weekends/holidays); orders older than the series use its first date
+FX_MATCH_MODES = ('nearest', 'previous')
+FX_MATCH_MODE = os.getenv("FX_MATCH_MODE", "nearest")
 
-    try:
-        target_date = datetime.strptime(order_date, "%Y-%m-%d")
 
-        # Exact match
-        if order_date in rates_dict and currency in rates_dict[order_date]:
-            return rates_dict[order_date][currency]
+# Per-currency sorted rate series for vectorized as-of lookups. Built once from the
+# {date: {currency: rate}} dict returned by get_ecb_fx_rates_from_db.
+class FxTable:
+    def __init__(self, series: dict[str, tuple[np.ndarray, np.ndarray]]):
+        self.series = series  # currency -> (datetime64[D] dates ascending, rates)
+
+        # Content fingerprint, so caches and preloaded workers can tell rate tables apart
+        digest = hashlib.sha1()
+        for currency in sorted(series):
+            dates, rates = series[currency]
+            digest.update(currency.encode())
+            digest.update(dates.astype(np.int64).tobytes())
+            digest.update(rates.tobytes())
+        self.version = digest.hexdigest()
+
+    @classmethod
+    def from_rates(cls, rates_dict: dict) -> "FxTable":
+        by_currency = defaultdict(list)
+        for date, day_rates in rates_dict.items():
+            parsed = pd.to_datetime(date, format="%Y-%m-%d", errors="coerce") if isinstance(date, str) else pd.to_datetime(date, errors="coerce")
+            if pd.isna(parsed):
+                print(f"Skipping FX rates with unreadable date: {date!r}")
+                continue
+            day = parsed.to_datetime64().astype("datetime64[D]")
+            for currency, rate in day_rates.items():
+                if currency != "EUR" and rate:
+                    by_currency[currency.upper()].append((day, float(rate)))
+
+        series = {}
+        for currency, points in by_currency.items():
+            dates = np.array([day for day, _ in points], dtype="datetime64[D]")
+            rates = np.array([rate for _, rate in points], dtype=float)
+            order = np.argsort(dates, kind="stable")
+            dates, rates = dates[order], rates[order]
+            # One rate per date; keep the last stored value for duplicates
+            keep = np.append(dates[1:] != dates[:-1], True)
+            series[currency] = (dates[keep], rates[keep])
+        return cls(series)
+
+    def currencies(self) -> list[str]:
+        return sorted(self.series)
+
+    # Rates and the rate dates used for each (currency, order date). Currencies without a
+    # series get rate 1.0 and no rate date, like the single-value lookup.
+    def lookup(self, currencies: np.ndarray, order_dates: np.ndarray, mode: str = FX_MATCH_MODE) -> tuple[np.ndarray, np.ndarray]:
+        if mode not in FX_MATCH_MODES:
+            raise ValueError(f"Unknown FX match mode '{mode}', expected one of {', '.join(FX_MATCH_MODES)}")
+
+        order_dates = np.asarray(order_dates, dtype="datetime64[D]")
+        rates = np.ones(len(order_dates), dtype=float)
+        rate_dates = np.full(len(order_dates), np.datetime64("NaT"), dtype="datetime64[D]")
+
+        currency_codes, currency_uniques = pd.factorize(np.asarray(currencies, dtype=object))
+        for code, currency in enumerate(currency_uniques):
+            if currency not in self.series:
+                continue
+            dates, currency_rates = self.series[currency]
+            rows = np.flatnonzero(currency_codes == code)
+            targets = order_dates[rows]
+
+            chosen = _match_rate_dates(dates, targets, mode)
+            rates[rows] = currency_rates[chosen]
+            rate_dates[rows] = dates[chosen]
+
+        return rates, rate_dates
+
+    # Single (currency, order date) lookup for per-request callers, without the column
+    # factorization: (rate, rate date), or (1.0, None) for currencies without a series
+    def lookup_one(self, currency: str, order_date: np.datetime64, mode: str = FX_MATCH_MODE) -> tuple[float, np.datetime64 | None]:
+        if mode not in FX_MATCH_MODES:
+            raise ValueError(f"Unknown FX match mode '{mode}', expected one of {', '.join(FX_MATCH_MODES)}")
+        if currency not in self.series:
+            return 1.0, None
+        dates, currency_rates = self.series[currency]
+        chosen = _match_rate_dates(dates, np.array([order_date], dtype="datetime64[D]"), mode)[0]
+        return float(currency_rates[chosen]), dates[chosen]
+
+
+# Position in the ascending `dates` of the rate date used for each order date in `targets`
+def _match_rate_dates(dates: np.ndarray, targets: np.ndarray, mode: str) -> np.ndarray:
+    # Index of the last rate date <= order date (-1 when the order predates the series)
+    previous = np.searchsorted(dates, targets, side="right") - 1
+    has_previous = previous >= 0
+    following = np.minimum(previous + 1, len(dates) - 1)
+    has_following = previous + 1 < len(dates)
+
+    if mode == "previous":
+        return np.where(has_previous, previous, following)
+
+    previous_gap = np.where(has_previous, (targets - dates[np.maximum(previous, 0)]).astype(np.int64), np.iinfo(np.int64).max)
+    following_gap = np.where(has_following, (dates[following] - targets).astype(np.int64), np.iinfo(np.int64).max)
+    # Exact matches have a zero gap; on equal gaps the later date wins
+    return np.where(previous_gap < following_gap, previous, following)
+
 
-        # Find closest date
-        closest_date = None
-        min_diff = None
+# Bulk EUR conversion for callers outside enrichment (column arrays, one entry per item):
+# amount / rate at the matched ECB rate date, rounded to cents like enrich_frame. EUR
+# amounts pass through at rate 1.0 without a rate date; currencies without a rate series
+# are left unconverted (None amount and rate) rather than passed through as EUR. Raises
+# ValueError for unreadable dates. Returns JSON-ready lists.
+def convert_amounts(fx_table: FxTable, amounts: list[float], currencies: list[str], dates: list[str], mode: str = FX_MATCH_MODE) -> dict:
+    amounts = np.asarray(amounts, dtype=float)
+    currency_codes, currency_uniques = pd.factorize(np.asarray(currencies, dtype=object))
+    normalized = np.array([str(currency).strip().upper() for currency in currency_uniques], dtype=object)
+    currencies = normalized[currency_codes]
 
-        for date_str in rates_dict:
-            if currency in rates_dict[date_str]:
-                current_date = datetime.strptime(date_str, "%Y-%m-%d")
-                diff = abs((current_date - target_date).days)
+    # Batches repeat few distinct dates: parse each once
+    date_codes, date_uniques = pd.factorize(np.asarray(dates, dtype=object))
+    parsed_uniques = pd.to_datetime(pd.Series(date_uniques, dtype=object), format="%Y-%m-%d", errors="coerce").to_numpy().astype("datetime64[D]")
+    order_dates = parsed_uniques[date_codes]
+    unreadable = np.flatnonzero(np.isnat(order_dates))
+    if len(unreadable):
+        raise ValueError(f"Invalid date '{dates[unreadable[0]]}' at position {unreadable[0]}, expected YYYY-MM-DD")
 
-                if min_diff is None or diff < min_diff:
-                    min_diff = diff
-                    closest_date = date_str
+    rates, rate_dates = fx_table.lookup(currencies, order_dates, mode)
+    is_eur = (normalized == "EUR")[currency_codes]
+    known = np.array([currency == "EUR" or currency in fx_table.series for currency in normalized], dtype=bool)[currency_codes]
+    # A zero rate can't convert anything
+    known &= rates != 0
 
-        if closest_date:
-            return rates_dict[closest_date][currency]
+    converted = np.where(known, from_minor_units(to_minor_units(amounts / np.where(known, rates, 1.0))), np.nan)
+    # Likewise format each distinct rate date once
+    rate_date_codes, rate_date_uniques = pd.factorize(rate_dates.view(np.int64))
+    rate_date_strings = np.datetime_as_string(rate_date_uniques.astype("datetime64[D]"), unit="D").astype(object)[rate_date_codes]
 
+    return {
+        "currency": "EUR",
+        "converted_amounts": _nullable_list(converted, known),
+        "fx_rates": _nullable_list(rates, known),
+        "fx_rate_dates": _nullable_list(rate_date_strings, known & ~is_eur),
+        "unknown_currencies": sorted(currency for currency in normalized if currency != "EUR" and currency not in fx_table.series),
+    }
+
+
+# Values as a list with None where `mask` is False
+def _nullable_list(values: np.ndarray, mask: np.ndarray) -> list:
+    if mask.all():
+        return values.tolist()
+    return np.where(mask, values, None).tolist()
+
+
+async def load_fx_table() -> FxTable:
+    fx_table = FxTable.from_rates(await get_ecb_fx_rates_from_db())
+    print(f"Loaded FX table {fx_table.version[:8]} for {len(fx_table.series)} currencies")
+    return fx_table
+
+
+# ECB rates change once a day; the sync routes reload right after writing. Expiry only
+# matters for workers that didn't run the sync, and they reload in the background.
+FX_TABLE_TTL_SECONDS = float(os.getenv("FX_TABLE_TTL_SECONDS", 300))
+
+fx_table_cache = TTLCache(load_fx_table, FX_TABLE_TTL_SECONDS)
+
+
+async def get_fx_table() -> FxTable:
+    return await fx_table_cache.get()
+
+
+def invalidate_fx_table() -> None:
+    fx_table_cache.invalidate()
+
+
+# Reload after new rates were written, so no request waits for the load
+async def reload_fx_table() -> None:
+    try:
+        await fx_table_cache.reload()
     except Exception as e:
-        print(f"Error fetching FX rate: {e}")
+        # Left invalidated, the next request loads it
+        print(f"Could not reload FX table: {str(e)}")
+
 
-    return 1.0
+# Cache counters plus what the cached table holds, without triggering a load
+def fx_table_stats() -> dict:
+    fx_table = fx_table_cache.value
+    return {
+        **fx_table_cache.stats(),
+        "version": None if fx_table is None else fx_table.version,
+        "currencies": None if fx_table is None else len(fx_table.series),
+    }
@@ -0,0 +1,87 @@
+import os
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Number of worker processes for CPU-bound pipeline stages (defaults to one per core)
+PROCESS_POOL_SIZE = int(os.getenv("PROCESS_POOL_SIZE", os.cpu_count() or 1))
+# Threads for blocking stages that would otherwise run on the event loop: file parsing,
+# openpyxl rendering and pandas stages too small for the process pool
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", min(32, (os.cpu_count() or 1) + 4)))
+
+_process_pool: ProcessPoolExecutor | None = None
+_thread_pool: ThreadPoolExecutor | None = None
+
+# Pools whose workers are preloaded through an initializer, by name -> (key, pool). The key
+# identifies the preloaded data; asking for a different key replaces the pool.
+_initialized_pools: dict[str, tuple[object, ProcessPoolExecutor]] = {}
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # "spawn" keeps workers free of the parent's event loop and Mongo client threads
+        _process_pool = ProcessPoolExecutor(
+            max_workers=PROCESS_POOL_SIZE,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE, thread_name_prefix="pipeline")
+    return _thread_pool
+
+
+# Run a blocking call on the thread pool so the event loop keeps serving other requests
+async def run_in_thread(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_thread_pool(), functools.partial(func, *args, **kwargs))
+
+
+def reset_process_pool():
+    # Called after a worker crash (BrokenProcessPool) so the next job gets a fresh pool
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+    _process_pool = None
+
+
+def get_initialized_pool(name: str, key, initializer, initargs: tuple) -> ProcessPoolExecutor:
+    current = _initialized_pools.get(name)
+    if current is not None and current[0] == key:
+        return current[1]
+    if current is not None:
+        # Jobs already submitted finish on the old workers
+        current[1].shutdown(wait=False)
+    pool = ProcessPoolExecutor(
+        max_workers=PROCESS_POOL_SIZE,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initializer,
+        initargs=initargs,
+    )
+    _initialized_pools[name] = (key, pool)
+    return pool
+
+
+def reset_initialized_pool(name: str):
+    current = _initialized_pools.pop(name, None)
+    if current is not None:
+        current[1].shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pools():
+    global _process_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=True, cancel_futures=True)
+        _thread_pool = None
+    for name in list(_initialized_pools):
+        _, pool = _initialized_pools.pop(name)
+        pool.shutdown(wait=True, cancel_futures=True)
+
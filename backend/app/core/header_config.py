@@ -0,0 +1,52 @@
+import os
+import json
+import hashlib
+from app.models.header_model import get_all_headers
+from app.core.helper import TYPE_MAP
+from app.core.mapping import AliasIndex
+from app.core.cache import TTLCache
+from app.core.constraints import compile_header_constraints
+
+HEADER_CONFIG_TTL_SECONDS = float(os.getenv("HEADER_CONFIG_TTL_SECONDS", 60))
+
+
+# Compile the headers collection into everything validation needs, once per config change
+async def load_header_config() -> dict:
+    all_headers = await get_all_headers()
+
+    required_headers = []
+    header_labels = {}
+    expected_types = {}
+    for header in all_headers:
+        value = header['value']
+        if header.get('required', True):
+            required_headers.append(value)
+        header_labels[value] = header['label']
+        # Map the raw type from the database using TYPE_MAP
+        raw_type = header.get('type', 'string')
+        expected_types[value] = TYPE_MAP.get(raw_type.lower(), 'string')
+
+    # Content fingerprint of the config; identical across workers for the same documents
+    version = hashlib.sha1(json.dumps(all_headers, sort_keys=True, default=str).encode()).hexdigest()
+    print(f"Loaded header config {version[:8]} with {len(all_headers)} headers")
+
+    return {
+        'version': version,
+        'headers': all_headers,
+        'required_headers': required_headers,
+        'header_labels': header_labels,
+        'expected_types': expected_types,
+        'alias_index': AliasIndex.from_header_docs(all_headers),
+        'constraints': compile_header_constraints(all_headers),
+    }
+
+
+header_config_cache = TTLCache(load_header_config, HEADER_CONFIG_TTL_SECONDS)
+
+
+async def get_header_config() -> dict:
+    return await header_config_cache.get()
+
+
+def invalidate_header_config() -> None:
+    header_config_cache.invalidate()
@@ -152,11 +152,32 @@ def generate_manual_review_summary(manual_rows: List[Dict]) -> str:
     return "\n".join(summary_lines)
 
 
-async def rename_columns_with_labels(df: pd.DataFrame) -> pd.DataFrame:
+def generate_rule_suggestions_summary(unmatched_pairs: List[Dict]) -> str:
+    summary_lines = ["Missing VAT rules (closest existing rules):\n"]
+
+    for pair in unmatched_pairs:
+        line = f"{pair['product_type']} / {pair['country']} ({pair['row_count']} rows)"
+        if pair.get("suggestions"):
+            candidates = [
+                f"{s['product_type']} / {s['country']} (VAT {s['vat_rate']}%, score {s['score']})"
+                for s in pair["suggestions"]
+            ]
+            line += ": " + "; ".join(candidates)
+        else:
+            line += ": no similar rule"
+        summary_lines.append(line)
+
+    return "\n".join(summary_lines)
+
+
+# Header value -> label, from the header config
+async def get_header_labels() -> Dict[str, str]:
     all_headers = await get_all_headers()
-    
-    header_labels = {header['value']: header['label'] for header in all_headers}
+    return {header['value']: header['label'] for header in all_headers}
 
+
+# Rename system columns to their labels; the blocking part of rename_columns_with_labels
+def rename_with_labels(df: pd.DataFrame, header_labels: Dict[str, str]) -> pd.DataFrame:
     rename_map = {}
     for col in df.columns:
         if col in header_labels:
@@ -169,3 +190,7 @@ async def rename_columns_with_labels(df: pd.DataFrame) -> pd.DataFrame:
         print("No columns found that match header values for renaming")
 
     return df
+
+
+async def rename_columns_with_labels(df: pd.DataFrame) -> pd.DataFrame:
+    return rename_with_labels(df, await get_header_labels())
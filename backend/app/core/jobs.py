@@ -0,0 +1,157 @@
+import json
+import uuid
+import asyncio
+from datetime import datetime, timedelta
+
+# Background jobs for work too slow for one HTTP request (validating or reporting large
+# uploads behind a proxy timeout). Kept in memory like processed_data_store: a job lives in
+# this process and is dropped JOB_TTL after it finished.
+JOB_TTL = timedelta(hours=1)
+# Seconds between keep-alive comments on an idle progress stream
+JOB_EVENT_KEEPALIVE = 15
+
+# Stages of each job kind with their share of the progress bar, in order
+JOB_STAGES = {
+    'validate': {'parsing': 0.4, 'validating': 0.6},
+    'vat_report': {'enriching': 0.7, 'rendering': 0.2, 'emailing': 0.1},
+}
+
+jobs_store: dict[str, "Job"] = {}
+
+
+class Job:
+    def __init__(self, kind: str):
+        self.job_id = str(uuid.uuid4())
+        self.kind = kind
+        self.status = "queued"
+        self.stage = "queued"
+        self.percent = 0.0
+        self.error = None
+        # JSON-ready result, plus (file name, media type, bytes) when the job produced a file
+        self.result = None
+        self.download = None
+        self.created_at = datetime.now()
+        self.finished_at = None
+        self.task = None
+        self._changed = asyncio.Event()
+
+    # Progress within `stage`; with `parts` the job works through that many equal parts
+    # (files) and `part` is the current one. Call from the event loop.
+    def progress(self, stage: str, fraction: float = 0.0, part: int = 0, parts: int = 1):
+        stages = JOB_STAGES[self.kind]
+        start = 0.0
+        for name, share in stages.items():
+            if name == stage:
+                break
+            start += share
+        fraction = min(max(fraction, 0.0), 1.0)
+        percent = 100 * (part + start + stages[stage] * fraction) / parts
+        self.status = "running"
+        self.stage = stage
+        # Never move the bar backwards
+        self.percent = round(max(self.percent, min(percent, 100.0)), 1)
+        self._notify()
+
+    def finish(self, result=None, download: tuple[str, str, bytes] | None = None):
+        self.status = "done"
+        self.stage = "done"
+        self.percent = 100.0
+        self.result = result
+        self.download = download
+        self.finished_at = datetime.now()
+        self._notify()
+
+    def fail(self, error: str):
+        self.status = "failed"
+        self.error = error
+        self.finished_at = datetime.now()
+        self._notify()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def _notify(self):
+        # Wake the current waiters; later waiters get a fresh event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    # Wait for the next update, at most `timeout` seconds; True when there was one
+    async def wait_for_update(self, timeout: float) -> bool:
+        changed = self._changed
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def status_payload(self) -> dict:
+        payload = {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "percent": self.percent,
+            "created_at": self.created_at.isoformat(),
+        }
+        if self.error is not None:
+            payload["error"] = self.error
+        if self.status == "done":
+            payload["has_download"] = self.download is not None
+        return payload
+
+
+# Run `runner(job)` as a background task. The runner reports progress and calls
+# job.finish(); any exception fails the job with its message.
+def start_job(kind: str, runner) -> Job:
+    cleanup_old_jobs()
+    job = Job(kind)
+    jobs_store[job.job_id] = job
+
+    async def run():
+        try:
+            await runner(job)
+            if not job.finished:
+                job.finish()
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            print(f"Job {job.job_id} ({kind}) failed: {detail}")
+            import traceback
+            traceback.print_exc()
+            job.fail(str(detail))
+
+    # The store holds the task reference so it isn't garbage collected mid-run
+    job.task = asyncio.create_task(run())
+    return job
+
+
+def get_job(job_id: str) -> Job | None:
+    return jobs_store.get(job_id)
+
+
+def cleanup_old_jobs():
+    current_time = datetime.now()
+    expired_keys = [
+        job_id for job_id, job in jobs_store.items()
+        if job.finished and current_time - job.finished_at > JOB_TTL
+    ]
+    for job_id in expired_keys:
+        del jobs_store[job_id]
+
+
+# Server-sent events for a job: a "progress" event per update (coalesced when the client
+# is slower than the job), then one "done" or "failed" event, after which the stream ends
+async def iter_job_events(job: Job):
+    last_sent = None
+    while True:
+        payload = job.status_payload()
+        if payload != last_sent:
+            event = job.status if job.finished else "progress"
+            yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+            last_sent = payload
+            # Look again before waiting: the job may have moved on while the event was sent
+            continue
+        if job.finished:
+            return
+        if not await job.wait_for_update(JOB_EVENT_KEEPALIVE):
+            yield ": keep-alive\n\n"
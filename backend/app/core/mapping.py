@@ -1,3 +1,5 @@
+from app.core.text_index import normalize_text, NgramIndex
+
 HEADERS_ALIASES = {
     "order_date": ["Order Date", "Date", "Invoice Date"],
     "order_id": ["Order Number", "Order ID", "Invoice No"],
@@ -15,25 +17,83 @@ HEADERS_ALIASES = {
 }
 
 
-def resolve_headers(input_headers: list[str], aliases: dict[str, list[str]]) -> dict[str, str]:
-    # Initialize an empty dictionary to store the final mapping
+# Precompiled alias index: normalized alias -> internal field for exact matches, plus a
+# character n-gram index over the same aliases to suggest fields for unknown headers
+class AliasIndex:
+    def __init__(self):
+        self.exact = {}
+        self.labels = {}
+        self.ngrams = NgramIndex()
+
+    def add(self, internal_field: str, alias: str) -> None:
+        normalized = normalize_text(alias)
+        # First registration wins, so the header collection takes priority over static aliases
+        if not normalized or normalized in self.exact:
+            return
+        self.exact[normalized] = internal_field
+        self.ngrams.add(normalized, internal_field)
+
+    @classmethod
+    def from_aliases(cls, aliases: dict[str, list[str]]) -> "AliasIndex":
+        index = cls()
+        for internal_field, possible_aliases in aliases.items():
+            index.add(internal_field, internal_field)
+            for alias in possible_aliases:
+                index.add(internal_field, alias)
+        return index
+
+    # Build from header documents; static HEADERS_ALIASES only add extra spellings for
+    # fields that are configured in the collection and never override it
+    @classmethod
+    def from_header_docs(cls, headers: list[dict], static_aliases: dict[str, list[str]] = HEADERS_ALIASES) -> "AliasIndex":
+        index = cls()
+        # Explicit aliases first, then labels and values, so an admin-configured alias is never shadowed
+        for header in headers:
+            index.labels[header['value']] = header.get('label', header['value'])
+            for alias in header.get('aliases') or []:
+                index.add(header['value'], alias)
+        for header in headers:
+            index.add(header['value'], header.get('label', ''))
+            index.add(header['value'], header['value'])
+        for internal_field, possible_aliases in static_aliases.items():
+            if internal_field not in index.labels:
+                continue
+            for alias in possible_aliases:
+                index.add(internal_field, alias)
+        return index
+
+    def resolve(self, header) -> str | None:
+        return self.exact.get(normalize_text(header))
+
+    # Ranked field suggestions for a header that has no exact alias match
+    def suggest(self, header, limit: int = 3) -> list[dict]:
+        suggestions = []
+        seen_fields = set()
+        for score, alias, internal_field in self.ngrams.search(normalize_text(header), limit=limit * 3):
+            if internal_field in seen_fields:
+                continue
+            seen_fields.add(internal_field)
+            suggestions.append({
+                'header_value': internal_field,
+                'header_label': self.labels.get(internal_field, internal_field),
+                'matched_alias': alias,
+                'score': score,
+            })
+            if len(suggestions) == limit:
+                break
+        return suggestions
+
+
+def resolve_headers(input_headers: list[str], aliases) -> dict[str, str]:
+    index = aliases if isinstance(aliases, AliasIndex) else AliasIndex.from_aliases(aliases)
+
+    # Map each input header to its internal field; each field is claimed by the first matching header
     mapping = {}
+    claimed_fields = set()
+    for header in input_headers:
+        internal_field = index.resolve(header)
+        if internal_field and internal_field not in claimed_fields:
+            mapping[header] = internal_field
+            claimed_fields.add(internal_field)
 
-    # Convert all input headers to lowercase and strip spaces for case-insensitive matching
-    lower_input = [h.lower().strip() for h in input_headers]
-
-    # Loop through each internal field and its list of possible aliases
-    for internal_field, possible_aliases in aliases.items():
-        for alias in possible_aliases:
-            # Normalize the alias for comparison
-            normalized_alias = alias.lower().strip()
-            # Check if the normalized alias is present in the normalized input headers
-            if normalized_alias in lower_input:
-                # If found, get the original (actual) header name from input_headers
-                matched_input = input_headers[lower_input.index(normalized_alias)]
-                # Map the original input header to the internal standardized field name
-                mapping[matched_input] = internal_field
-                break  # Stop checking aliases once a match is found for this field
-
-    # Return the final header mapping dictionary
     return mapping
@@ -0,0 +1,88 @@
+import os
+import numpy as np
+
+# Money is carried as int64 minor units (cents) and VAT rates as int64 millionths
+# (19% -> 190000, 5.5% -> 55000), so every product and sum is exact integer arithmetic
+# and only the explicit rounding steps below can move a cent.
+MINOR_UNITS = 100
+RATE_SCALE = 1_000_000
+
+# "line": round the VAT of every line half-up to the cent.
+# "invoice": round once per (invoice, rate) and spread the cents back over the lines.
+ROUNDING_MODES = ('line', 'invoice')
+VAT_ROUNDING_MODE = os.getenv("VAT_ROUNDING_MODE", "line")
+
+
+def _to_scaled_int(values, scale: int) -> np.ndarray:
+    values = np.asarray(values, dtype=float)
+    values = np.where(np.isfinite(values), values, 0.0)
+    # Drop float noise first (2.675 is stored as 2.67499999...) so half-up applies to the
+    # decimal the user typed, then round half away from zero
+    scaled = np.round(np.abs(values) * scale, 6)
+    return (np.sign(values) * np.floor(scaled + 0.5)).astype(np.int64)
+
+
+# Float amounts -> int64 cents, half-up; NaN/inf become 0 like safe_round
+def to_minor_units(amounts) -> np.ndarray:
+    return _to_scaled_int(amounts, MINOR_UNITS)
+
+
+def from_minor_units(units) -> np.ndarray:
+    return np.asarray(units, dtype=np.int64) / MINOR_UNITS
+
+
+# VAT percentage (5.5) -> int64 millionths of the fraction (55000)
+def percent_to_rate(percent) -> np.ndarray:
+    return _to_scaled_int(percent, RATE_SCALE // 100)
+
+
+def rate_to_fraction(rates) -> np.ndarray:
+    return np.asarray(rates, dtype=np.int64) / RATE_SCALE
+
+
+def _divide_half_up(numerators: np.ndarray, divisor: int) -> np.ndarray:
+    return np.sign(numerators) * ((np.abs(numerators) + divisor // 2) // divisor)
+
+
+# VAT per line: cents * rate, rounded half-up to the cent
+def apply_rate(units: np.ndarray, rates: np.ndarray) -> np.ndarray:
+    return _divide_half_up(units * rates, RATE_SCALE)
+
+
+# VAT rounded once per group (invoice + rate). The group total is rounded half-up and the
+# cents are allocated back to the lines by largest remainder, so lines always sum to it.
+def apply_rate_per_group(units: np.ndarray, rates: np.ndarray, group_codes: np.ndarray) -> np.ndarray:
+    numerators = units * rates
+    n_groups = int(group_codes.max()) + 1 if len(group_codes) else 0
+
+    group_numerators = np.zeros(n_groups, dtype=np.int64)
+    np.add.at(group_numerators, group_codes, numerators)
+    group_totals = _divide_half_up(group_numerators, RATE_SCALE)
+
+    base = numerators // RATE_SCALE
+    remainders = numerators - base * RATE_SCALE
+    group_base = np.zeros(n_groups, dtype=np.int64)
+    np.add.at(group_base, group_codes, base)
+    extra_cents = group_totals - group_base
+
+    # Rank lines inside each group by remainder (largest first); the top `extra_cents` get +1
+    order = np.lexsort((-remainders, group_codes))
+    sorted_groups = group_codes[order]
+    group_starts = np.searchsorted(sorted_groups, np.arange(n_groups))
+    ranks = np.empty(len(units), dtype=np.int64)
+    ranks[order] = np.arange(len(units)) - group_starts[sorted_groups]
+
+    return base + (ranks < extra_cents[group_codes])
+
+
+def compute_vat(units: np.ndarray, rates: np.ndarray, group_codes: np.ndarray | None = None, mode: str = VAT_ROUNDING_MODE) -> np.ndarray:
+    if mode not in ROUNDING_MODES:
+        raise ValueError(f"Unknown VAT rounding mode '{mode}', expected one of {', '.join(ROUNDING_MODES)}")
+    if mode == 'invoice' and group_codes is not None:
+        return apply_rate_per_group(units, rates, group_codes)
+    return apply_rate(units, rates)
+
+
+# Exact total of a minor-unit column, returned as a float amount
+def total_amount(units: np.ndarray) -> float:
+    return int(np.asarray(units, dtype=np.int64).sum()) / MINOR_UNITS
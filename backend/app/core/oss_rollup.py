@@ -0,0 +1,152 @@
+import os
+import numpy as np
+import pandas as pd
+from app.core.money import from_minor_units, rate_to_fraction
+from app.core.vat_engine import map_distinct, _find_columns, _order_date_strings, _parse_order_dates
+
+# Reporting period of the OSS return: "quarter" (the OSS filing period) or "month"
+OSS_PERIODS = {'quarter': 'Q', 'month': 'M'}
+OSS_PERIOD = os.getenv("OSS_PERIOD", "quarter")
+UNDATED_PERIOD = "Undated"
+
+GOODS = "Goods"
+SHIPPING = "Shipping"
+
+# Aggregation levels of the rollup, finest first. Only the first is grouped from the rows,
+# the others are re-summed from it.
+OSS_ROLLUP_LEVELS = {
+    'detail': ['country', 'vat_rate', 'supply', 'period'],
+    'by_country_rate': ['country', 'vat_rate', 'period'],
+    'by_country': ['country', 'period'],
+    'by_period': ['period'],
+}
+
+# Report sheet per level, with the user-facing column labels
+OSS_SHEETS = {
+    'detail': "OSS Return",
+    'by_country_rate': "OSS by Country and Rate",
+    'by_country': "OSS by Country",
+}
+OSS_COLUMN_LABELS = {
+    'country': "Country",
+    'vat_rate': "VAT Rate (%)",
+    'supply': "Supply",
+    'period': "Period",
+    'taxable_amount': "Taxable Amount",
+    'vat_amount': "VAT Amount",
+    'line_count': "Lines",
+}
+
+
+def _periods(parsed_dates: np.ndarray, period: str) -> np.ndarray:
+    if period not in OSS_PERIODS:
+        raise ValueError(f"Unknown OSS period '{period}', expected one of {', '.join(OSS_PERIODS)}")
+    labels = pd.PeriodIndex(pd.DatetimeIndex(parsed_dates), freq=OSS_PERIODS[period]).astype(str).to_numpy(dtype=object)
+    return np.where(np.isnat(parsed_dates), UNDATED_PERIOD, labels)
+
+
+# OSS return lines of an enriched (unrenamed) frame and its cent ledger, grouped by member
+# state x VAT rate (millionths) x goods/shipping x period. Every row with a VAT rule
+# contributes a goods line and, when it has a shipping amount, a shipping line at the
+# shipping rate; the lines are grouped once on categorical keys and amounts stay in cents.
+def group_oss_lines(df: pd.DataFrame, found: np.ndarray, ledger: pd.DataFrame, period: str = OSS_PERIOD) -> pd.DataFrame:
+    columns = _find_columns(df)
+    countries = (
+        map_distinct(df[columns['country']], lambda val: str(val).strip())
+        if 'country' in columns else np.full(len(df), "", dtype=object)
+    )
+    periods = _periods(_parse_order_dates(_order_date_strings(df, columns)), period)
+
+    goods = np.flatnonzero(found)
+    shipping = goods[ledger['shipping_amount'].to_numpy()[goods] != 0]
+    lines = np.concatenate([goods, shipping])
+    supplies = np.repeat([GOODS, SHIPPING], [len(goods), len(shipping)])
+
+    line_frame = pd.DataFrame({
+        'country': pd.Categorical(countries[lines]),
+        'vat_rate': np.concatenate([ledger['vat_rate'].to_numpy()[goods], ledger['shipping_vat_rate'].to_numpy()[shipping]]),
+        'supply': pd.Categorical(supplies, categories=[GOODS, SHIPPING]),
+        'period': pd.Categorical(periods[lines]),
+        'taxable_amount': np.concatenate([ledger['net_price'].to_numpy()[goods], ledger['shipping_amount'].to_numpy()[shipping]]),
+        'vat_amount': np.concatenate([ledger['vat'].to_numpy()[goods], ledger['shipping_vat'].to_numpy()[shipping]]),
+        'line_count': np.ones(len(lines), dtype=np.int64),
+    })
+
+    return line_frame.groupby(OSS_ROLLUP_LEVELS['detail'], observed=True, sort=True).sum().reset_index()
+
+
+# Combine grouped OSS lines (e.g. of consecutive row chunks) into one grouping
+def merge_oss_lines(details: list[pd.DataFrame]) -> pd.DataFrame:
+    merged = pd.concat(details, ignore_index=True)
+    return merged.groupby(OSS_ROLLUP_LEVELS['detail'], observed=True, sort=True)[['taxable_amount', 'vat_amount', 'line_count']].sum().reset_index()
+
+
+# OSS return rollup at every level of OSS_ROLLUP_LEVELS: {level: DataFrame} with amounts
+# in currency units and rates in percent
+def build_oss_rollup(df: pd.DataFrame, found: np.ndarray, ledger: pd.DataFrame, period: str = OSS_PERIOD) -> dict[str, pd.DataFrame]:
+    return rollup_levels(group_oss_lines(df, found, ledger, period))
+
+
+# Every rollup level from the finest grouping (cents)
+def rollup_levels(detail: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    rollup = {}
+    for level, keys in OSS_ROLLUP_LEVELS.items():
+        grouped = detail if level == 'detail' else detail.groupby(keys, observed=True, sort=True)[['taxable_amount', 'vat_amount', 'line_count']].sum().reset_index()
+        rollup[level] = _to_amounts(grouped)
+    return rollup
+
+
+def _to_amounts(grouped: pd.DataFrame) -> pd.DataFrame:
+    grouped = grouped.copy()
+    for col in grouped.columns:
+        if isinstance(grouped[col].dtype, pd.CategoricalDtype):
+            grouped[col] = grouped[col].astype(str)
+    if 'vat_rate' in grouped:
+        grouped['vat_rate'] = np.round(rate_to_fraction(grouped['vat_rate'].to_numpy()) * 100, 4)
+    grouped['taxable_amount'] = from_minor_units(grouped['taxable_amount'].to_numpy())
+    grouped['vat_amount'] = from_minor_units(grouped['vat_amount'].to_numpy())
+    return grouped
+
+
+# JSON-ready rollup: {level: [record, ...]}
+def rollup_records(rollup: dict[str, pd.DataFrame]) -> dict[str, list[dict]]:
+    return {level: frame.to_dict(orient="records") for level, frame in rollup.items()}
+
+
+# Add the OSS sheets to an open openpyxl ExcelWriter
+def write_oss_sheets(writer: pd.ExcelWriter, rollup: dict[str, pd.DataFrame]):
+    for level, sheet_name in OSS_SHEETS.items():
+        rollup[level].rename(columns=OSS_COLUMN_LABELS).to_excel(writer, index=False, sheet_name=sheet_name)
+
+
+# Monthly contribution of an enrichment to the persisted quarterly aggregates, in cents.
+# Undated lines can't be assigned to a quarter and are only counted.
+def monthly_contributions(df: pd.DataFrame, found: np.ndarray, ledger: pd.DataFrame) -> tuple[list[dict], int]:
+    detail = group_oss_lines(df, found, ledger, period='month')
+    undated = detail['period'].astype(str) == UNDATED_PERIOD
+    detail = detail.loc[~undated].rename(columns={'period': 'month'})
+    detail['country'] = detail['country'].astype(str)
+    detail['supply'] = detail['supply'].astype(str)
+    return detail.to_dict(orient="records"), int(undated.sum())
+
+
+# Months ("2024-01") of a calendar quarter
+def quarter_months(year: int, quarter: int) -> list[str]:
+    return [f"{year}-{month:02d}" for month in range(3 * quarter - 2, 3 * quarter + 1)]
+
+
+# Merge persisted monthly aggregates into quarter totals: per country, VAT rate and supply,
+# per month, and overall
+def merge_aggregates(aggregates: list[dict]) -> dict:
+    frame = pd.DataFrame(aggregates, columns=['month', 'country', 'vat_rate', 'supply', 'taxable_amount', 'vat_amount', 'line_count'])
+    frame = frame.astype({'vat_rate': np.int64, 'taxable_amount': np.int64, 'vat_amount': np.int64, 'line_count': np.int64})
+    sums = ['taxable_amount', 'vat_amount', 'line_count']
+    return {
+        'by_country_rate': _to_amounts(frame.groupby(['country', 'vat_rate', 'supply'], sort=True)[sums].sum().reset_index()),
+        'by_month': _to_amounts(frame.groupby('month', sort=True)[sums].sum().reset_index()),
+        'totals': {
+            'taxable_amount': float(from_minor_units(frame['taxable_amount'].sum())),
+            'vat_amount': float(from_minor_units(frame['vat_amount'].sum())),
+            'line_count': int(frame['line_count'].sum()),
+        },
+    }
@@ -0,0 +1,88 @@
+import os
+import json
+import hashlib
+from app.models.product_model import get_all_products
+from app.core.cache import TTLCache
+from app.core.vat_engine import build_rate_table, effective_rules
+from app.core.text_index import normalize_text, NgramIndex
+
+PRODUCT_REGISTRY_TTL_SECONDS = float(os.getenv("PRODUCT_REGISTRY_TTL_SECONDS", 60))
+
+# Closest existing rules offered for each product type / country with no VAT rule
+PRODUCT_SUGGESTION_LIMIT = int(os.getenv("PRODUCT_SUGGESTION_LIMIT", 3))
+PRODUCT_SUGGESTION_MIN_SCORE = float(os.getenv("PRODUCT_SUGGESTION_MIN_SCORE", 0.25))
+
+
+# Same normalization enrichment uses for its (product_type, country) lookup
+def normalize_key(value) -> str:
+    return str(value).strip().lower()
+
+
+# Load the products collection once per change and index the known (product_type, country) pairs
+async def load_product_registry() -> dict:
+    products = await get_all_products()
+
+    pairs = set()
+    for prod in products:
+        product_type = normalize_key(prod.get('product_type', ''))
+        country = normalize_key(prod.get('country', ''))
+        if product_type and country:
+            pairs.add((product_type, country))
+
+    # Content fingerprint of the product table; identical across workers for the same documents
+    version = hashlib.sha1(json.dumps(products, sort_keys=True, default=str).encode()).hexdigest()
+    print(f"Loaded product registry {version[:8]} with {len(pairs)} product/country pairs")
+
+    return {
+        'version': version,
+        'products': products,
+        'pairs': pairs,
+        'rate_table': build_rate_table(products),
+        'rule_index': build_rule_index(products),
+    }
+
+
+# Character n-gram index over "<product type> <country>" of every rule, one entry per
+# pair: the winning product (see effective_rules) with the latest valid_from
+def build_rule_index(products: list[dict]) -> NgramIndex:
+    latest = {}
+    for (product_type, country, _), prod in sorted(effective_rules(products).items(), key=lambda item: item[0]):
+        latest[(product_type, country)] = prod
+
+    index = NgramIndex()
+    for key, prod in latest.items():
+        index.add(normalize_text(f"{key[0]} {key[1]}"), {
+            'product_id': prod.get('_id'),
+            'product_type': prod.get('product_type'),
+            'country': prod.get('country'),
+            'vat_rate': prod.get('vat_rate'),
+            'shipping_vat_rate': prod.get('shipping_vat_rate'),
+        })
+    return index
+
+
+# Attach the closest existing rules to each distinct unmatched (product_type, country).
+# `unmatched` holds one entry per distinct key, so the index is queried once per key no
+# matter how many rows share it.
+def suggest_rules(registry: dict, unmatched: list[dict], limit: int = PRODUCT_SUGGESTION_LIMIT) -> list[dict]:
+    rule_index = registry['rule_index']
+    suggested = []
+    for entry in unmatched:
+        query = normalize_text(f"{entry['product_type']} {entry['country']}")
+        matches = rule_index.search(query, limit=limit, min_score=PRODUCT_SUGGESTION_MIN_SCORE)
+        suggested.append({
+            **entry,
+            'suggestions': [{**payload, 'score': score} for score, _, payload in matches],
+        })
+    return suggested
+
+
+product_registry_cache = TTLCache(load_product_registry, PRODUCT_REGISTRY_TTL_SECONDS)
+
+
+async def get_product_registry() -> dict:
+    return await product_registry_cache.get()
+
+
+def invalidate_product_registry() -> None:
+    product_registry_cache.invalidate()
@@ -1,12 +1,14 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 import aiosmtplib
 from email.message import EmailMessage
-from app.core.helper import generate_manual_review_summary
+from app.core.helper import generate_manual_review_summary, generate_rule_suggestions_summary
 
 
-async def send_manual_vat_email(to_email: str, user_email: str, attachment: bytes, manual_review_rows: List[Dict]):
+async def send_manual_vat_email(to_email: str, user_email: str, attachment: bytes, manual_review_rows: List[Dict], unmatched_pairs: Optional[List[Dict]] = None):
 
     summary_text = generate_manual_review_summary(manual_review_rows)
+    if unmatched_pairs:
+        summary_text = generate_rule_suggestions_summary(unmatched_pairs) + "\n\n" + summary_text
     msg = EmailMessage()
     msg["Subject"] = "Manual VAT Processing Required"
     msg["From"] = "mailer@xtechon.com"
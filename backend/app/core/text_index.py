@@ -0,0 +1,61 @@
+import re
+import heapq
+import unicodedata
+from collections import defaultdict
+
+NON_ALNUM_PATTERN = re.compile(r'[^0-9a-z]+')
+
+
+# Normalize free text for matching: strip diacritics, lowercase, and collapse
+# punctuation/underscores/whitespace runs into single spaces
+# ("Destination_Country", "destination-country", "Déstination Country" -> "destination country")
+def normalize_text(text) -> str:
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return NON_ALNUM_PATTERN.sub(' ', stripped.lower()).strip()
+
+
+def char_ngrams(text: str, n: int = 3) -> set[str]:
+    padded = f" {text} "
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+# Inverted character n-gram index over a fixed set of normalized strings.
+# A query only touches the posting lists of its own n-grams, so ranking stays
+# sub-millisecond even with thousands of entries.
+class NgramIndex:
+    def __init__(self, n: int = 3):
+        self.n = n
+        self.entries = []        # (normalized text, payload)
+        self.gram_counts = []    # number of distinct n-grams per entry
+        self.postings = defaultdict(list)
+
+    def add(self, text: str, payload) -> None:
+        entry_id = len(self.entries)
+        grams = char_ngrams(text, self.n)
+        self.entries.append((text, payload))
+        self.gram_counts.append(len(grams))
+        for gram in grams:
+            self.postings[gram].append(entry_id)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    # Return up to `limit` (score, text, payload) tuples ranked by Dice similarity of n-gram sets
+    def search(self, text: str, limit: int = 5, min_score: float = 0.3) -> list[tuple[float, str, object]]:
+        grams = char_ngrams(text, self.n)
+        shared = defaultdict(int)
+        for gram in grams:
+            for entry_id in self.postings.get(gram, ()):
+                shared[entry_id] += 1
+
+        scored = []
+        for entry_id, common in shared.items():
+            score = 2 * common / (len(grams) + self.gram_counts[entry_id])
+            if score >= min_score:
+                scored.append((score, entry_id))
+
+        best = heapq.nlargest(limit, scored)
+        return [(round(score, 3), *self.entries[entry_id]) for score, entry_id in best]
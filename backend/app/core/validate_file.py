@@ -1,19 +1,35 @@
 from io import BytesIO
 import io
 import zipfile
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import pandas as pd
 from fastapi import BackgroundTasks, Form, UploadFile, HTTPException, APIRouter, File
-from fastapi.responses import JSONResponse, StreamingResponse
-from app.models.header_model import get_all_headers
-from app.models.product_model import get_all_products
-from app.core.helper import rename_columns_with_labels, safe_float, safe_round, dataframe_to_json_safe, get_user_friendly_dtype, TYPE_MAP
-from app.core.currency_conversion import get_ecb_fx_rates_from_db, get_fx_rate_by_date_from_db_rates
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
+from app.core.helper import get_header_labels, rename_with_labels, dataframe_to_json_safe
+from app.core.currency_conversion import FxTable, get_fx_table
+from app.core.vat_engine import enrich_frame, enrich_frame_parallel, resolve_rules, expand_to_invoices, ledger_totals, unmatched_keys
+from app.core.money import VAT_ROUNDING_MODE, from_minor_units
+from app.core.oss_rollup import OSS_PERIOD, build_oss_rollup, rollup_records, write_oss_sheets
 from app.core.send_mail import send_manual_vat_email, send_vat_report_email_safely
+from app.core.column_validation import validate_columns, revalidate_cells, check_registry_pairs, collect_data_issues, match_previous_rows
+from app.core.product_registry import get_product_registry, suggest_rules
+from app.core.header_config import get_header_config
+from app.core.mapping import resolve_headers
+from app.core.chunked_pipeline import ChunkedPipeline, OUTPUT_FORMATS
+from app.core.executors import run_in_thread
+from app.schemas.session_schemas import CellEditRequest
+import numpy as np
 from openpyxl.styles import PatternFill, Font
 from openpyxl import Workbook, load_workbook
-import re
 import uuid
+import hashlib
+import os
+import json
+import shutil
+import asyncio
+import tempfile
+import contextlib
 from datetime import datetime, timedelta
 
 router = APIRouter()
@@ -21,6 +37,68 @@ router = APIRouter()
 # In-memory storage for processed data (in production, use Redis or database)2
 processed_data_store: Dict[str, Dict[str, Any]] = {}
 
+# Validated frames keyed by (content hash, file type, header-config version, registry
+# version). Sessions created from identical uploads share one entry (and one DataFrame);
+# the entry is dropped when the last session referencing it expires or detaches for editing.
+validation_cache: Dict[tuple, Dict[str, Any]] = {}
+
+# Per cache key: (lock, number of uploads holding or waiting for it). Identical uploads
+# arriving together are validated once; the others wait and then share that entry.
+validation_locks: Dict[tuple, list] = {}
+
+UPLOAD_READ_CHUNK_SIZE = 1024 * 1024
+
+@contextlib.asynccontextmanager
+async def validation_key_lock(cache_key: tuple):
+    entry = validation_locks.setdefault(cache_key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del validation_locks[cache_key]
+
+def acquire_cached_validation(cache_key: tuple) -> Dict[str, Any] | None:
+    entry = validation_cache.get(cache_key)
+    if entry is not None:
+        entry['refcount'] += 1
+    return entry
+
+def release_cached_validation(cache_key: tuple | None):
+    entry = validation_cache.get(cache_key)
+    if entry is None:
+        return
+    entry['refcount'] -= 1
+    if entry['refcount'] <= 0:
+        del validation_cache[cache_key]
+
+# Give a session its own copy of a shared frame and validation state before mutating it.
+# The copies are made on the thread pool; call with the session lock held.
+async def detach_session_frame(stored_data: Dict[str, Any]):
+    cache_key = stored_data.get('frame_key')
+    if cache_key is None:
+        return
+    validation_state, original_df = await run_in_thread(_copy_session_frame, stored_data['validation_state'], stored_data['original_df'])
+    stored_data['validation_state'] = validation_state
+    stored_data['validation_result'] = dict(stored_data['validation_result'])
+    stored_data['original_df'] = original_df
+    stored_data['frame_key'] = None
+    release_cached_validation(cache_key)
+
+def _copy_session_frame(validation_state: Dict[str, Any], original_df: pd.DataFrame) -> tuple:
+    validation_state = dict(validation_state)
+    validation_state['scans'] = {col: {key: rows.copy() for key, rows in scan.items()} for col, scan in validation_state['scans'].items()}
+    validation_state['column_issues'] = dict(validation_state['column_issues'])
+    validation_state['row_hashes'] = validation_state['row_hashes'].copy()
+    return validation_state, original_df.copy()
+
+# Per-session lock serializing enrichment and cell edits, whose blocking parts run on the
+# thread pool and could otherwise interleave on the same frame
+def session_lock(stored_data: Dict[str, Any]) -> asyncio.Lock:
+    return stored_data.setdefault('lock', asyncio.Lock())
+
 # Cleanup old entries (older than 1 hour)
 def cleanup_old_data():
     current_time = datetime.now()
@@ -29,16 +107,28 @@ def cleanup_old_data():
         if current_time - data['timestamp'] > timedelta(hours=1):
             expired_keys.append(key)
     for key in expired_keys:
-        del processed_data_store[key]
+        expired = processed_data_store.pop(key)
+        release_cached_validation(expired.get('frame_key'))
 
-# Read uploaded file and return headers + DataFrame
-async def extract_file_headers(file: UploadFile) -> tuple[list[str], pd.DataFrame]:
+# Stream the upload into memory through a fast hash so identical uploads can be recognised
+async def read_upload(file: UploadFile) -> tuple[bytes, str]:
+    hasher = hashlib.blake2b(digest_size=16)
+    buffer = BytesIO()
+    while True:
+        chunk = await file.read(UPLOAD_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        hasher.update(chunk)
+        buffer.write(chunk)
+    return buffer.getvalue(), hasher.hexdigest()
+
+# Parse file content into headers + DataFrame
+def parse_file_content(filename: str, content: bytes) -> tuple[list[str], pd.DataFrame]:
     try:
-        content = await file.read()
         file_data = BytesIO(content)
-        if file.filename.endswith('.csv'):
+        if filename.endswith('.csv'):
             df = pd.read_csv(file_data)
-        elif file.filename.endswith('.txt'):
+        elif filename.endswith('.txt'):
             df = pd.read_csv(file_data, delimiter='\t')
         else:
             df = pd.read_excel(file_data)
@@ -50,39 +140,30 @@ async def extract_file_headers(file: UploadFile) -> tuple[list[str], pd.DataFram
             detail=f"Error reading file: {str(e)}"
         )
 
-async def validate_file_data(file_headers: list[str], df: pd.DataFrame) -> dict:
+# Returns the validation result sent to the frontend plus the validation state
+# (per-column scans, row hashes) kept on the session for incremental revalidation.
+# `previous_state` is the validation state of an earlier upload of the same file;
+# rows whose content is unchanged reuse its verdicts instead of being revalidated.
+async def validate_file_data(file_headers: list[str], df: pd.DataFrame, previous_state: dict | None = None) -> tuple[dict, dict]:
     try:
-        all_headers = await get_all_headers()
-        alias_to_value = {}
-        required_headers = []
-        header_labels = {}
-        expected_types = {}
-        
-        for header in all_headers:
-            value = header['value']
-            required_headers.append(value)
-            header_labels[value] = header['label']
-            for alias in header['aliases']:
-                alias_to_value[alias.strip().lower()] = value
-                         
-            # Get the raw type from database
-            raw_type = header.get('type', 'string')
-            print(f"Header: {value}, Raw type from DB: {raw_type}")
-                        
-            # Map the type using TYPE_MAP
-            mapped_type = TYPE_MAP.get(raw_type.lower(), 'string')
-            expected_types[value] = mapped_type
-
-        rename_map = {}
-        for col in df.columns:
-            normalized = col.strip().lower()
-            mapped_value = alias_to_value.get(normalized)
-            if mapped_value:
-                rename_map[col] = mapped_value
+        header_config = await get_header_config()
+        required_headers = header_config['required_headers']
+        header_labels = header_config['header_labels']
+        expected_types = header_config['expected_types']
+        alias_index = header_config['alias_index']
+        constraints = header_config['constraints']
 
+        # Map file columns to standardized header values through the precompiled alias index
+        rename_map = resolve_headers(list(df.columns), alias_index)
         df.rename(columns=rename_map, inplace=True)
         print("DataFrame Columns", df.columns.to_list())
 
+        # Suggest the closest configured headers for columns that matched no alias
+        unmatched_columns = [
+            {'column': str(col), 'suggestions': alias_index.suggest(col)}
+            for col in df.columns if col not in header_labels
+        ]
+
         # Create detailed missing headers info
         missing_headers_detailed = []
         for field in required_headers:
@@ -94,192 +175,15 @@ async def validate_file_data(file_headers: list[str], df: pd.DataFrame) -> dict:
                     'description': f"Required column '{header_labels.get(field, field)}' is missing from the file"
                 })
 
-        data_issues = []
-        for header_value in df.columns:
-            if header_value not in df.columns:
-                continue
-            col_dtype = get_user_friendly_dtype(df[header_value].dtype)
-            try:
-                null_mask = df[header_value].isnull()
-                empty_mask = df[header_value].astype(str).str.strip().isin(['', 'nan', 'None', '(empty)', '(null)'])
-                combined_mask = null_mask | empty_mask
-                null_count = int(null_mask.sum())
-                empty_count = int(empty_mask.sum())
-                total_empty = int(combined_mask.sum())
-
-                if total_empty > 0:
-                    missing_rows = df.index[combined_mask].tolist()
-                    missing_rows_display = [str(row + 2) for row in missing_rows]
-                    issue_description = f"Column '{header_labels.get(header_value, header_value)}' has {total_empty} missing values"
-                    if len(missing_rows) > 10:
-                        issue_description += f" (showing first 10 rows: {','.join(missing_rows_display[:10])}...)"
-                    else:
-                        issue_description += f" in rows: {', '.join(missing_rows_display)}"
-
-                    data_issues.append({
-                        'header_value': header_value,
-                        'header_label': header_labels.get(header_value, header_value),
-                        'original_column': header_value,
-                        'issue_type': 'MISSING_DATA',
-                        'issue_description': issue_description,
-                        'column_name': header_labels.get(header_value, header_value),
-                        'data_type': col_dtype,
-                        'null_count': null_count,
-                        'empty_count': empty_count,
-                        'total_missing': total_empty,
-                        'percentage': round((total_empty / len(df)) * 100, 2),
-                        'missing_rows': missing_rows_display,
-                        'has_more_rows': len(missing_rows) > 10
-                    })
-                        
-            except Exception as col_error:
-                print(f"Error processing missing data for column {header_value}: {str(col_error)}")
-                           
-            # Enhanced Data Type Validation
-            try:
-                invalid_type_rows = []
-                expected_type = expected_types.get(header_value, "string")
-                                
-                print(f"Validating column '{header_value}' against expected type: {expected_type}")
-                                
-                # Get sample of data for debugging
-                sample_data = df[header_value].dropna().head(5).tolist()
-                print(f"Sample data: {sample_data}")
-                                
-                for idx, val in df[header_value].items():
-                    # Skip null/empty values as they're handled separately
-                    if pd.isnull(val) or (isinstance(val, str) and val.strip() == ''):
-                        continue
-                                        
-                    is_valid = True
-                    error_msg = ""
-                                        
-                    try:
-                        if expected_type == 'integer':
-                            # Check if it's a boolean first
-                            if isinstance(val, bool):
-                                is_valid = False
-                                error_msg = "Boolean value found where integer expected"
-                            else:
-                                # Try to convert to int
-                                if isinstance(val, str):
-                                    # Remove whitespace and check if it's a valid integer string
-                                    clean_val = val.strip()
-                                    if not clean_val.replace('-', '').replace('+', '').isdigit():
-                                        is_valid = False
-                                        error_msg = f"Non-integer string: '{val}'"
-                                    else:
-                                        int(clean_val)
-                                else:
-                                    # For numeric types, check if it's a whole number
-                                    float_val = float(val)
-                                    if float_val != int(float_val):
-                                        is_valid = False
-                                        error_msg = f"Decimal value where integer expected: {val}"
-                                    else:
-                                        int(float_val)
-                                                
-                        elif expected_type == 'float':
-                            try:
-                                float(val)
-                            except (ValueError, TypeError):
-                                is_valid = False
-                                error_msg = f"Cannot convert to float: '{val}'"
-                                                
-                        elif expected_type == 'date':
-                            # Try multiple date formats
-                            date_formats = ["%d-%m-%Y", "%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y", "%Y/%m/%d"]
-                            date_parsed = False
-                                                        
-                            for fmt in date_formats:
-                                try:
-                                    pd.to_datetime(str(val), format=fmt, errors='raise')
-                                    date_parsed = True
-                                    break
-                                except:
-                                    continue
-                                                        
-                            if not date_parsed:
-                                try:
-                                    pd.to_datetime(str(val), errors='raise')
-                                    date_parsed = True
-                                except:
-                                    is_valid = False
-                                    error_msg = f"Invalid date format: '{val}'"
-                                                                                    
-                        elif expected_type == 'text_only':
-                            # New validation: text that shouldn't contain only numbers
-                            str_val = str(val).strip()
-                            # Check if the value is purely numeric (including decimals)
-                            if re.match(r'^-?\d+\.?\d*$', str_val):
-                                is_valid = False
-                                error_msg = f"Numeric value found where text expected: '{val}'"
-                                                
-                        elif expected_type == 'string':
-                            # Enhanced string validation
-                            str_val = str(val).strip()
-                                                        
-                            # Check for business logic rules based on column name
-                            if header_value == 'product_type':
-                                # Special validation for product_type - shouldn't be purely numeric
-                                if re.match(r'^-?\d+\.?\d*$', str_val):
-                                    is_valid = False
-                                    error_msg = f"Product type should not be a number: '{val}'"
-                                # Could also check against known product types
-                                elif len(str_val) < 2:
-                                    is_valid = False
-                                    error_msg = f"Product type too short: '{val}'"
-                                                        
-                            elif header_value == 'country':
-                                # Country names shouldn't be numbers
-                                if re.match(r'^-?\d+\.?\d*$', str_val):
-                                    is_valid = False
-                                    error_msg = f"Country should not be a number: '{val}'"
-                                                        
-                            elif header_value == 'currency':
-                                # Currency codes should be 3 letters
-                                if not re.match(r'^[A-Z]{3}$', str_val.upper()):
-                                    is_valid = False
-                                    error_msg = f"Invalid currency code format: '{val}' (should be 3 letters like EUR, USD)"
-                                                        
-                            # General string validation - just ensure it can be converted to string
-                            try:
-                                str(val)
-                            except:
-                                is_valid = False
-                                error_msg = f"Cannot convert to string: '{val}'"
-                                        
-                    except Exception as validation_error:
-                        is_valid = False
-                        error_msg = f"Validation error: {str(validation_error)}"
-                                        
-                    if not is_valid:
-                        print(f"Type validation failed for value '{val}' at row {idx + 2}: {error_msg}")
-                        invalid_type_rows.append(idx + 2)  # +2 for 1-indexed + header row
-                                
-                if invalid_type_rows:
-                    invalid_rows_display = invalid_type_rows[:10]
-                    issue_description = f"Column '{header_labels.get(header_value, header_value)}' has invalid {expected_type} values in rows: {', '.join(map(str, invalid_rows_display))}"
-                    if len(invalid_type_rows) > 10:
-                        issue_description += "..."
-                                        
-                    data_issues.append({
-                        'header_value': header_value,
-                        'header_label': header_labels.get(header_value, header_value),
-                        'original_column': header_value,  # Now using standardized name
-                        'issue_type': 'INVALID_TYPE',
-                        'issue_description': issue_description,
-                        'column_name': header_labels.get(header_value, header_value),
-                        'expected_type': expected_type,
-                        'invalid_rows': invalid_rows_display,
-                        'invalid_count': len(invalid_type_rows),
-                        'total_rows': len(df),
-                        'percentage': round((len(invalid_type_rows) / len(df)) * 100, 2),
-                        'has_more_rows': len(invalid_type_rows) > 10
-                    })
-                        
-            except Exception as type_error:
-                print(f"Error during type validation for column {header_value}: {str(type_error)}")
+        # Validate every column (fanned out across the process pool for wide files)
+        _, validation_state = await validate_columns(df, expected_types, header_labels, previous_state, constraints)
+        validation_state['expected_types'] = expected_types
+        validation_state['header_labels'] = header_labels
+
+        # Catch product/country pairs with no VAT rule now rather than at enrichment time
+        product_registry = await get_product_registry()
+        await run_in_thread(check_registry_pairs, df, validation_state, product_registry['pairs'])
+        data_issues = collect_data_issues(validation_state)
 
         return {
             'missing_headers': [field for field in required_headers if field not in df.columns],
@@ -287,8 +191,9 @@ async def validate_file_data(file_headers: list[str], df: pd.DataFrame) -> dict:
             'matched_columns': {v: v for v in df.columns},  # Now both key and value are standardized
             'header_labels': header_labels,
             'data_issues': data_issues,
+            'unmatched_columns': unmatched_columns,
             'total_rows': len(df),
-        }
+        }, validation_state
     except Exception as e:
         print(f"Validation error: {str(e)}")
         raise HTTPException(
@@ -296,324 +201,534 @@ async def validate_file_data(file_headers: list[str], df: pd.DataFrame) -> dict:
             detail=f"Validation error: {str(e)}"
         )
 
-async def enrich_dataframe_with_vat(df: pd.DataFrame) -> tuple:
+# Enrich a frame against the given (or current) product registry and FX table. `df` is
+# updated in place with the unrenamed enriched columns; returns the assembled report parts
+# plus the per-row found mask and cent ledger. `progress` receives the fraction enriched.
+async def enrich_session_frame(df: pd.DataFrame, registry: dict | None = None, fx_table: FxTable | None = None, progress=None) -> tuple:
     try:
-        # 1. Get VAT products from database
-        vat_products = await get_all_products()
-        print(f"Retrieved {len(vat_products)} VAT products from database")
-                
-        # 2. Build a lookup dictionary for (product_type, country) -> VAT info
-        vat_lookup = {}
-        for prod in vat_products:
-            try:
-                product_type = str(prod.get('product_type', '')).strip().lower()
-                country = str(prod.get('country', '')).strip().lower()
-                if product_type and country:
-                    key = (product_type, country)
-                    vat_lookup[key] = prod
-                    print(f"Added VAT lookup: {key} -> VAT: {prod.get('vat_rate', 0)}%, Shipping VAT: {prod.get('shipping_vat_rate', 0)}%")
-            except Exception as prod_error:
-                print(f"Error processing VAT product: {prod_error}")
-                continue
-                
-        print(f"Built VAT lookup with {len(vat_lookup)} entries")
-        print(f"VAT lookup keys: {list(vat_lookup.keys())}")
-                
-        # 3. Identify relevant columns in the DataFrame
-        available_columns = [col.lower() for col in df.columns]
-        print(f"Available columns (lowercase): {available_columns}")
-        
-        # Try to find the right column names for product_type, country, net_price, shipping_amount, currency, order_date
-        product_type_col = None
-        country_col = None
-        net_price_col = None
-        shipping_amount_col = None
-        currency_col = None
-        order_date_col = None
-        
-        #For internal testing
-        currencies = []
-        net_prices = []
-        
-        # Find columns by name (case-insensitive)
-        for col in df.columns:
-            col_lower = col.lower()
-            if col_lower == 'order_date':
-                order_date_col = col
-            elif col_lower == 'product_type':
-                product_type_col = col
-            elif col_lower == 'country':
-                country_col = col
-            elif col_lower == 'net_price':
-                net_price_col = col
-                net_prices = df['net_price']
-            elif col_lower == 'shipping_amount':
-                shipping_amount_col = col
-            elif col_lower == 'currency':
-                currency_col = col
-                currencies = df['currency']
-
-        # 4. Prepare lists to store calculated values for new columns
-        vat_rates = []          
-        vat_amounts = []
-        shipping_vat_rates = []
-        shipping_vat_amounts = []
-        total_vat_amounts = []
-        gross_total_amounts = []
-        
-        # Lists for converted prices and currencies
-        converted_prices = []
-        converted_shipping_prices = []
-        final_currencies = []
-        vat_lookup_status = []
-        debug_info = []
-        
-        # 5. Fetch ECB currency rates for conversion
-        ecb_rates = await get_ecb_fx_rates_from_db()
-        # Track rows that need manual review
-        manual_review_rows = []
-                
-        # 6. Process each row in the DataFrame
-        for idx, row in df.iterrows():
-            try:
-                # Get currency and order date for this row
-                currency = str(row[currency_col]).strip().upper() if currency_col else "EUR"
-                order_date = str(row[order_date_col]).strip() if order_date_col else None
-                
-                # Extract product type and country
-                product_type = str(row[product_type_col]).strip().lower() if product_type_col else str(row.get("product_type", "")).strip().lower()
-                country = str(row[country_col]).strip().lower() if country_col else str(row.get("country", "")).strip().lower()
-                
-                # Extract net price and shipping amount
-                net_price = safe_float(row[net_price_col]) if net_price_col else safe_float(row.get("price", 0))
-                shipping_amount = safe_float(row[shipping_amount_col]) if shipping_amount_col else safe_float(row.get("shipping_amount", 0))
-                                
-                # 7. Convert currency to EUR if needed
-                fx_rate = None
-                if currency != "EUR" and order_date:
-                    order_date_str = pd.to_datetime(order_date).strftime('%Y-%m-%d')
-                    fx_rate = get_fx_rate_by_date_from_db_rates(ecb_rates, order_date_str, currency)
-                    if fx_rate:
-                        net_price = safe_round(net_price / fx_rate, 2)
-                        shipping_amount = safe_round(shipping_amount / fx_rate, 2)
-                        print(f"Row {idx}: Converted from {currency} to EUR using rate {fx_rate} for date {order_date}")
-                    else:
-                        print(f"Row {idx}: No FX rate found for {currency} on or before {order_date}, using original values")
-                
-                converted_prices.append(net_price)
-                converted_shipping_prices.append(shipping_amount)
-                final_currencies.append("EUR" if currency != "EUR" and fx_rate else currency)
-                                
-                total_net_price = safe_round(sum(converted_prices), 2)
-                print("Converted Prices", converted_prices)
-                print(f"Row {idx}: product_type='{product_type}', country='{country}', price={net_price}, shipping_price={shipping_amount}")
-                                
-                # 8. Look up VAT data for this product_type and country
-                lookup_key = (product_type, country)
-                vat_data = vat_lookup.get(lookup_key)
-                
-                if vat_data:
-                    # Extract VAT rates and calculate VAT amounts
-                    vat_rate = safe_float(vat_data.get("vat_rate", 2))
-                    vat_rate = safe_round((vat_rate / 100), 2)
-                    shipping_vat_rate = safe_float(vat_data.get("shipping_vat_rate", 2))
-                    shipping_vat_rate = safe_round((shipping_vat_rate / 100), 2)
-                                        
-                    vat_amount = safe_round(vat_rate * net_price, 2)
-                    shipping_vat_amount = safe_round(shipping_vat_rate * shipping_amount, 2)
-                    total_vat = safe_round(vat_amount + shipping_vat_amount, 2)
-                    gross_total = safe_round(net_price + vat_amount + shipping_vat_amount, 2)
-                    lookup_status = "Found"
-                    debug_msg = f"VAT found: {vat_rate}% VAT, {shipping_vat_rate}% shipping VAT"
-                    print(f"Row {idx}: {debug_msg}")
-                else:
-                    # No VAT data found - use defaults and log for manual review
-                    manual_review_rows.append(row.to_dict())
-                    vat_rate = "Not Found"
-                    shipping_vat_rate = "Not Found"
-                    vat_amount = "Not Found"
-                    shipping_vat_amount = "Not Found"
-                    gross_total = 0.0
-                    total_vat = 0.0
-                    lookup_status = "Not Found"
-                    debug_msg = f"No VAT data found for key: {lookup_key}"
-                    print(f"Row {idx}: {debug_msg}")
-                                
-                # Store calculated values for this row
-                vat_rates.append(vat_rate)
-                vat_amounts.append(vat_amount)
-                shipping_vat_rates.append(shipping_vat_rate)
-                shipping_vat_amounts.append(shipping_vat_amount)
-                total_vat_amounts.append(total_vat)
-                gross_total_amounts.append(gross_total)
-                vat_lookup_status.append(lookup_status)
-                debug_info.append(debug_msg)
-                            
-            except Exception as row_error:
-                print(f"Error processing row {idx}: {str(row_error)}")
-                manual_review_rows.append(idx)
-                # Use safe defaults for this row
-                vat_rates.append(0.0)
-                vat_amounts.append(0.0)
-                shipping_vat_rates.append(0.0)
-                shipping_vat_amounts.append(0.0)
-                total_vat_amounts.append(0.0)
-                gross_total_amounts.append(0.0)
-                vat_lookup_status.append("Error")
-                debug_info.append(f"Error: {str(row_error)}")
-                        
-        # 9. Update DataFrame with converted prices and currencies
-        if net_price_col:
-            df[net_price_col] = converted_prices
-        if shipping_amount_col:
-            df[shipping_amount_col] = converted_shipping_prices
-        if currency_col:
-            df[currency_col] = final_currencies
-        
-        # 10. Add new VAT-related columns to the DataFrame
-        df["Previous Currency"] = currencies
-        df["Previous Net Price"] = net_prices
-        df["VAT Rate"] = vat_rates
-        df["Product VAT"] = vat_amounts
-        df["Shipping VAT Rate"] = shipping_vat_rates
-        df["Shipping VAT"] = shipping_vat_amounts
-        df["Total VAT"] = total_vat_amounts
-        df["Final Gross Total"] = gross_total_amounts
-        
-        # 11. Optionally, rename columns to user-friendly labels from header config
-        df = await rename_columns_with_labels(df)
-                
-        # 12. Print final DataFrame for debugging
-        pd.set_option('display.max_columns', None)
-        pd.set_option('display.width', None)
-        pd.set_option('display.max_colwidth', None)
-        print("DataFrame table (full view with renamed headers):")
-        print(df)
-        
-        # 13. Create a summary VAT report by country
-        summary = df.groupby('Country').agg({
-            'Net Price': 'sum',
-            'Total VAT': 'sum'
-        }).reset_index()
-        summary.rename(columns={
-            'Net Price': 'Net Sales',
-            'Total VAT': 'VAT Amount'
-        }, inplace=True)
-        print("Summary VAT Report by Country:")
-        print(summary)
-        
-        print("Manual Review", manual_review_rows)
-        manual_df = pd.DataFrame(manual_review_rows)
-        manual_df = await rename_columns_with_labels(manual_df)
+        # 1. VAT rate table (product_type, country) -> rates, rebuilt only when products change
+        registry = registry or await get_product_registry()
+        rate_table = registry['rate_table']
+        print(f"Using VAT rate table with {len(rate_table)} entries")
 
-        # Overwrite manual_review_rows with renamed version
-        manual_review_rows = manual_df.to_dict(orient="records")
+        # 2. ECB currency rates for conversion, reloaded only after a sync or TTL
+        fx_table = fx_table or await get_fx_table()
 
-        manual_review_df = []
-        manual_review_df = df.to_dict(orient="records")
+        # 3. Convert currencies, join rates and compute VAT columns (updates df in place)
+        df, found, _, ledger = await enrich_frame_parallel(df, rate_table, fx_table, registry['version'], progress)
 
-        # Track rows that need manual review
-        print("Manual DataFrame", manual_df)
-        
-        # 14. Return the enriched DataFrame and summary DataFrame
-        if len(manual_review_rows) > 0:
-            return {
-                "status": "manual_review_required",
-                "message": "Some rows could not be processed automatically. We'll email you the results within 24 hours.",
-                "manual_review_count": len(manual_review_rows),
-                "require_email": True,  # Frontend will use this flag to prompt the user
-                "manual_review_rows": manual_review_df,
-            }
-        
-        # At the end of enrich_dataframe_with_vat
-        return (
-                df,
-                summary,
-                manual_df,
-                {
-                    "overall_vat_amount": safe_round(sum(total_vat_amounts), 2),
-                    "overall_net_price": total_net_price,
-                    "overall_gross_total": safe_float(sum(gross_total_amounts), 2)
-                }
-            )
-            
+        return await assemble_enrichment(df, found, ledger), found, ledger
+
+    except Exception as e:
+        print(f"Error in VAT enrichment: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Failed to enrich data with VAT: {str(e)}")
+
+
+# Report parts from an enriched frame: (renamed enriched df, per-country summary,
+# manual-review rows, totals). The labels are read here; the renames and the per-country
+# groupby run on the thread pool.
+async def assemble_enrichment(df: pd.DataFrame, found: np.ndarray, ledger: pd.DataFrame) -> tuple:
+    header_labels = await get_header_labels()
+    return await run_in_thread(_assemble_enrichment, df, found, ledger, header_labels)
+
+
+def _assemble_enrichment(df: pd.DataFrame, found: np.ndarray, ledger: pd.DataFrame, header_labels: dict) -> tuple:
+    # Rows without a VAT rule need manual review
+    manual_df = df.loc[~found]
+
+    # Rename columns to user-friendly labels from header config
+    df = rename_with_labels(df, header_labels)
+    manual_df = rename_with_labels(manual_df, header_labels)
+
+    # Summary VAT report by country from the exact cent amounts
+    country_totals = ledger[['net_price', 'total_vat']].groupby(df['Country'].to_numpy()).sum()
+    summary = pd.DataFrame({
+        'Country': country_totals.index,
+        'Net Sales': from_minor_units(country_totals['net_price'].to_numpy()),
+        'VAT Amount': from_minor_units(country_totals['total_vat'].to_numpy()),
+    })
+    print("Summary VAT Report by Country:")
+    print(summary)
+
+    return df, summary, manual_df, ledger_totals(ledger)
+
+
+# Report/email result shape: the manual-review payload when any row lacks a VAT rule,
+# otherwise (enriched_df, summary_df, manual_df, vat_summary)
+def build_enrichment_result(enriched: tuple, unmatched_pairs: list[dict] | None = None):
+    df, summary, manual_df, vat_summary = enriched
+    manual_review_count = len(manual_df)
+    if manual_review_count > 0:
+        print(f"{manual_review_count} rows need manual review")
+        return {
+            "status": "manual_review_required",
+            "message": "Some rows could not be processed automatically. We'll email you the results within 24 hours.",
+            "manual_review_count": manual_review_count,
+            "require_email": True,  # Frontend will use this flag to prompt the user
+            "manual_review_rows": df.to_dict(orient="records"),
+            # Closest existing VAT rules per missing product type / country
+            "unmatched_pairs": unmatched_pairs or [],
+        }
+    return enriched
+
+
+# Unmatched (product_type, country) keys of an enriched frame with rule suggestions
+async def find_unmatched_pairs(frame: pd.DataFrame, found: np.ndarray, registry: dict | None = None) -> list[dict]:
+    if found.all():
+        return []
+    registry = registry or await get_product_registry()
+    return await run_in_thread(_unmatched_pairs, frame, found, registry)
+
+
+def _unmatched_pairs(frame: pd.DataFrame, found: np.ndarray, registry: dict) -> list[dict]:
+    return suggest_rules(registry, unmatched_keys(frame, found))
+
+
+# Enrichment memoized on the session, keyed by the product-table and FX-data versions it
+# was computed with. Report, email and preview calls share it until the rules, the rates
+# or the session data change. The memo is shared: callers must not mutate what it holds.
+async def get_session_enrichment(stored_data: Dict[str, Any], progress=None) -> Dict[str, Any]:
+    async with session_lock(stored_data):
+        return await _get_session_enrichment(stored_data, progress)
+
+
+async def _get_session_enrichment(stored_data: Dict[str, Any], progress=None) -> Dict[str, Any]:
+    registry = await get_product_registry()
+    fx_table = await get_fx_table()
+    enrichment_key = (registry['version'], fx_table.version)
+
+    memo = stored_data.get('enrichment')
+    if memo is not None and memo['key'] == enrichment_key:
+        print(f"Reusing enrichment for versions {registry['version'][:8]}/{fx_table.version[:8]}")
+        return memo
+
+    if memo is not None and memo['key'][1] == fx_table.version:
+        # Only the VAT rules changed: recompute just the rows whose rule changed
+        return await refresh_session_enrichment(stored_data, registry, fx_table)
+
+    if memo is None:
+        # A corrected re-upload takes the unchanged rows from the session it replaces
+        reused = await reuse_previous_enrichment(stored_data, registry, fx_table)
+        if reused is not None:
+            return reused
+
+    frame = await run_in_thread(stored_data['original_df'].copy)
+    enriched, found, ledger = await enrich_session_frame(frame, registry, fx_table, progress)
+    return await store_session_enrichment(stored_data, registry, fx_table, frame, enriched, found, ledger, recomputed_rows=len(frame))
+
+
+async def store_session_enrichment(stored_data: Dict[str, Any], registry: dict, fx_table: FxTable, frame: pd.DataFrame, enriched: tuple, found: np.ndarray, ledger: pd.DataFrame, recomputed_rows: int) -> Dict[str, Any]:
+    unmatched_pairs = await find_unmatched_pairs(frame, found, registry)
+    memo = {
+        'key': (registry['version'], fx_table.version),
+        'frame': frame,
+        'enriched': enriched,
+        'result': await run_in_thread(build_enrichment_result, enriched, unmatched_pairs),
+        'unmatched_pairs': unmatched_pairs,
+        'oss_rollup': await run_in_thread(build_oss_rollup, frame, found, ledger),
+        # Per-row outcome of the VAT lookup, kept so later runs only revisit what changed
+        'found': found,
+        'ledger': ledger,
+        'recomputed_rows': recomputed_rows,
+    }
+    stored_data['enrichment'] = memo
+    return memo
+
+
+# Re-run enrichment for the rows the new rule table resolves differently (typically the
+# "Not Found" rows an admin just added rules for) and merge them into the stored result.
+# Requires a stored enrichment computed with the current FX data.
+async def refresh_session_enrichment(stored_data: Dict[str, Any], registry: dict, fx_table: FxTable) -> Dict[str, Any]:
+    memo = stored_data['enrichment']
+    original_df = stored_data['original_df']
+
+    try:
+        frame, found, ledger, recomputed_rows = await run_in_thread(_recompute_stale_rows, memo, original_df, registry, fx_table)
+        enriched = await assemble_enrichment(frame, found, ledger)
+    except Exception as e:
+        print(f"Error in VAT re-enrichment: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Failed to enrich data with VAT: {str(e)}")
+
+    return await store_session_enrichment(stored_data, registry, fx_table, frame, enriched, found, ledger, recomputed_rows=recomputed_rows)
+
+
+# Blocking part of refresh_session_enrichment: find the rows the new rule table resolves
+# differently and merge their re-enrichment into copies of the stored frame, mask and ledger
+def _recompute_stale_rows(memo: Dict[str, Any], original_df: pd.DataFrame, registry: dict, fx_table: FxTable) -> tuple:
+    rate_table = registry['rate_table']
+    ledger = memo['ledger']
+    found, vat_rates, shipping_vat_rates = resolve_rules(original_df, rate_table)
+    stale = np.flatnonzero(
+        (found != memo['found'])
+        | (vat_rates != ledger['vat_rate'].to_numpy())
+        | (shipping_vat_rates != ledger['shipping_vat_rate'].to_numpy())
+    )
+    stale = expand_to_invoices(original_df, stale)
+    print(f"Re-enriching {len(stale)} of {len(original_df)} rows for VAT rules {registry['version'][:8]}")
+
+    frame = memo['frame']
+    found = memo['found']
+    if len(stale):
+        frame, found, ledger = _enrich_rows_into(frame.copy(), found.copy(), ledger.copy(), original_df, stale, rate_table, fx_table)
+    return frame, found, ledger, len(stale)
+
+
+# Enrich the rows at `positions` of `original_df` and write them into the given enriched
+# frame, found mask and ledger (modified in place and returned)
+def _enrich_rows_into(frame: pd.DataFrame, found: np.ndarray, ledger: pd.DataFrame, original_df: pd.DataFrame, positions: np.ndarray, rate_table, fx_table: FxTable) -> tuple:
+    part, part_found, _, part_ledger = enrich_frame(original_df.iloc[positions].copy(), rate_table, fx_table)
+    for col in part.columns:
+        column = frame[col].to_numpy(dtype=object if frame[col].dtype != part[col].dtype else None, copy=True)
+        column[positions] = part[col].to_numpy()
+        frame[col] = pd.Series(column, index=frame.index).infer_objects()
+    ledger.iloc[positions] = part_ledger.to_numpy()
+    found[positions] = part_found
+    return frame, found, ledger
+
+
+# Enrichment of a corrected re-upload built from the session it replaces: rows whose
+# content hash matches a row of that session's current enrichment (same rule and FX
+# versions) are copied from it, only new or changed rows are enriched. Per-invoice rounding
+# depends on the other lines of each invoice, so that mode always enriches in full.
+# Returns None when there is nothing to reuse.
+async def reuse_previous_enrichment(stored_data: Dict[str, Any], registry: dict, fx_table: FxTable) -> Dict[str, Any] | None:
+    previous = processed_data_store.get(stored_data.get('previous_session_id'))
+    if previous is None or VAT_ROUNDING_MODE != 'line':
+        return None
+    previous_memo = previous.get('enrichment')
+    if previous_memo is None or previous_memo['key'] != (registry['version'], fx_table.version):
+        return None
+    if list(previous['original_df'].columns) != list(stored_data['original_df'].columns):
+        return None
+
+    try:
+        reused = await run_in_thread(_reuse_matched_rows, stored_data, previous['validation_state']['row_hashes'], previous_memo, registry, fx_table)
+        if reused is None:
+            return None
+        frame, found, ledger, recomputed_rows = reused
+        enriched = await assemble_enrichment(frame, found, ledger)
     except Exception as e:
         print(f"Error in VAT enrichment: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to enrich data with VAT: {str(e)}")
 
+    return await store_session_enrichment(stored_data, registry, fx_table, frame, enriched, found, ledger, recomputed_rows=recomputed_rows)
+
+
+# Blocking part of reuse_previous_enrichment
+def _reuse_matched_rows(stored_data: Dict[str, Any], previous_hashes: np.ndarray, previous_memo: Dict[str, Any], registry: dict, fx_table: FxTable) -> tuple | None:
+    original_df = stored_data['original_df']
+    matched_old = match_previous_rows(stored_data['validation_state']['row_hashes'], previous_hashes)
+    matched = matched_old >= 0
+    if not matched.any():
+        return None
+    changed = np.flatnonzero(~matched)
+    print(f"Enriching {len(changed)} of {len(original_df)} rows, the rest reused from the replaced session")
+
+    # Rows of the previous enrichment in the new row order; changed rows are overwritten
+    take = np.where(matched, matched_old, 0)
+    frame = previous_memo['frame'].iloc[take].set_axis(original_df.index)
+    ledger = previous_memo['ledger'].iloc[take].set_axis(original_df.index)
+    found = previous_memo['found'][take].copy()
+    if len(changed):
+        frame, found, ledger = _enrich_rows_into(frame, found, ledger, original_df, changed, registry['rate_table'], fx_table)
+    return frame, found, ledger, len(changed)
+
+
+ALLOWED_UPLOAD_EXTENSIONS = ['.csv', '.txt', '.xls', '.xlsx']
+
+# Validation state of the session a corrected re-upload replaces, so unchanged rows are
+# not revalidated
+def previous_validation_state(previous_session_id: Optional[str]) -> dict | None:
+    if previous_session_id and previous_session_id in processed_data_store:
+        return processed_data_store[previous_session_id].get('validation_state')
+    return None
+
+# Result entry for an upload whose type can't be validated, None when it can
+def unsupported_upload(file_name: str) -> Dict[str, Any] | None:
+    file_extension = '.' + file_name.split('.')[-1].lower()
+    if file_extension in ALLOWED_UPLOAD_EXTENSIONS:
+        return None
+    return {
+        "file_name": file_name,
+        "success": False,
+        "message": f"Unsupported file type: {file_extension}"
+    }
+
+def upload_error(file_name: str, e: Exception) -> Dict[str, Any]:
+    print(f"Error processing file {file_name}: {str(e)}")
+    import traceback
+    traceback.print_exc()
+    return {
+        "file_name": file_name,
+        "success": False,
+        "message": f"Error validating file: {str(e)}"
+    }
+
+# Validate one upload's content and open a session for it; returns the result entry sent
+# to the frontend. `previous_session_id` links the session a corrected re-upload replaces:
+# its unchanged rows are not revalidated, and later not re-enriched either. `progress`,
+# when given, is told when parsing and validation start.
+async def validate_upload(file_name: str, content: bytes, content_hash: str, previous_session_id: Optional[str] = None, progress=None) -> Dict[str, Any]:
+    previous_state = previous_validation_state(previous_session_id)
+    file_extension = '.' + file_name.split('.')[-1].lower()
+    header_config = await get_header_config()
+    # The result includes the product/country pairs missing from the registry, so a
+    # registry change invalidates it just like a header-config change
+    registry = await get_product_registry()
+    cache_key = (content_hash, file_extension, header_config['version'], registry['version'])
+
+    async with validation_key_lock(cache_key):
+        cached = acquire_cached_validation(cache_key)
+        if cached is not None:
+            # Identical file already validated against the same header config and registry
+            print(f"Reusing validation for identical upload {content_hash}")
+            headers = cached['headers']
+            df = cached['df']
+            validation_result = cached['validation_result']
+            validation_state = cached['validation_state']
+            reused_rows = len(df)
+        else:
+            # Extract headers and data from file
+            if progress:
+                progress('parsing')
+            headers, df = await run_in_thread(parse_file_content, file_name, content)
+            del content
+
+            if not headers:
+                return {
+                    "file_name": file_name,
+                    "success": False,
+                    "message": "No headers found in the file"
+                }
+
+            # Validate file data
+            if progress:
+                progress('validating')
+            validation_result, validation_state = await validate_file_data(headers, df, previous_state)
+            reused_rows = validation_state['reused_rows']
+            print(f"File validation completed ({reused_rows} unchanged rows reused)")
+
+            validation_cache[cache_key] = {
+                'df': df,
+                'headers': headers,
+                'validation_result': validation_result,
+                'validation_state': validation_state,
+                'refcount': 1,
+            }
+
+    has_issues = len(validation_result['missing_headers']) > 0 or len(validation_result['data_issues']) > 0
+
+    # Generate unique session ID for this file
+    session_id = str(uuid.uuid4())
+
+    # Store processed data in memory (use Redis/DB in production)
+    processed_data_store[session_id] = {
+        'timestamp': datetime.now(),
+        'file_name': file_name,
+        'content_hash': content_hash,
+        'original_df': df,  # Shared with other sessions of the same upload; detach before mutating
+        'frame_key': cache_key,
+        'validation_result': validation_result,
+        'validation_state': validation_state,
+        'headers': headers,
+        'has_issues': has_issues,
+        'previous_session_id': previous_session_id if previous_state is not None else None,
+    }
+
+    return {
+        "file_name": file_name,
+        "session_id": session_id,  # Return session ID to frontend
+        "success": not has_issues,
+        "has_issues": has_issues,
+        "validation_result": validation_result,
+        "reused_rows": reused_rows,
+        "message": "File has validation issues" if has_issues else "File validation completed successfully"
+    }
+
+
 @router.post("/validate-file")
-async def validate_file(files: List[UploadFile] = File(...)):
+async def validate_file(files: List[UploadFile] = File(...), previous_session_id: Optional[str] = Form(None)):
     cleanup_old_data()  # Clean up old data before processing
     results = []
-    
+
     for file in files:
         try:
             print(f"Processing file: {file.filename}")
-                        
+
             # Check file type
-            allowed_extensions = ['.csv', '.txt', '.xls', '.xlsx']
-            file_extension = '.' + file.filename.split('.')[-1].lower()
-            if file_extension not in allowed_extensions:
-                results.append({
-                    "file_name": file.filename,
-                    "success": False,
-                    "message": f"Unsupported file type: {file_extension}"
-                })
-                continue
-                        
-            # Extract headers and data from file
-            headers, df = await extract_file_headers(file)
-                        
-            if not headers:
-                results.append({
-                    "file_name": file.filename,
-                    "success": False,
-                    "message": "No headers found in the file"
-                })
+            unsupported = unsupported_upload(file.filename)
+            if unsupported is not None:
+                results.append(unsupported)
                 continue
-                        
-            # Validate file data
-            validation_result = await validate_file_data(headers, df)
-            print("File validation completed")
-            
-            has_issues = len(validation_result['missing_headers']) > 0 or len(validation_result['data_issues']) > 0
-            
-            # Generate unique session ID for this file
-            session_id = str(uuid.uuid4())
-            
-            # Store processed data in memory (use Redis/DB in production)
-            processed_data_store[session_id] = {
-                'timestamp': datetime.now(),
-                'file_name': file.filename,
-                'original_df': df.copy(),  # Store original DataFrame
-                'validation_result': validation_result,
-                'headers': headers,
-                'has_issues': has_issues
-            }
-            
-            results.append({
-                "file_name": file.filename,
-                "session_id": session_id,  # Return session ID to frontend
-                "success": not has_issues,
-                "has_issues": has_issues,
-                "validation_result": validation_result,
-                "message": "File has validation issues" if has_issues else "File validation completed successfully"
-            })
-                    
+
+            # Stream the upload through the content hash
+            content, content_hash = await read_upload(file)
+            # A corrected re-upload can link the session it replaces so unchanged rows are not redone
+            results.append(await validate_upload(file.filename, content, content_hash, previous_session_id))
+
         except Exception as e:
-            print(f"Error processing file {file.filename}: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            results.append({
-                "file_name": file.filename,
-                "success": False,
-                "message": f"Error validating file: {str(e)}"
-            })
-    
+            results.append(upload_error(file.filename, e))
+
     return {"files": results}
 
+# Write one edited value into the stored frame, keeping numeric columns numeric where possible
+def set_cell_value(df: pd.DataFrame, pos: int, col_pos: int, value):
+    dtype = df.dtypes.iloc[col_pos]
+    if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+        try:
+            number = np.nan if value is None or str(value).strip() == '' else float(value)
+            if pd.api.types.is_integer_dtype(dtype):
+                if not (np.isfinite(number) and number.is_integer()):
+                    df.isetitem(col_pos, df.iloc[:, col_pos].astype(float))
+                else:
+                    number = int(number)
+            df.iat[pos, col_pos] = number
+            return
+        except (TypeError, ValueError, OverflowError):
+            pass
+    if not pd.api.types.is_object_dtype(dtype):
+        df.isetitem(col_pos, df.iloc[:, col_pos].astype(object))
+    df.iat[pos, col_pos] = value
+
+
+# Apply inline cell corrections to a session and revalidate only the touched cells
+@router.patch("/session/{session_id}/cells")
+async def edit_session_cells(session_id: str, payload: CellEditRequest):
+    if session_id not in processed_data_store:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+
+    stored_data = processed_data_store[session_id]
+    # Edits and enrichment of a session run one at a time (enrichment works off the event loop)
+    async with session_lock(stored_data):
+        await detach_session_frame(stored_data)
+        df = stored_data['original_df']
+        validation_result = stored_data['validation_result']
+        validation_state = stored_data['validation_state']
+        label_to_value = {label: value for value, label in validation_state['header_labels'].items()}
+
+        # Resolve every edit before touching the frame so a bad edit leaves the session unchanged
+        resolved_edits = []
+        for edit in payload.edits:
+            column = edit.column if edit.column in df.columns else label_to_value.get(edit.column)
+            if column not in validation_state['scans']:
+                raise HTTPException(status_code=400, detail=f"Unknown column: '{edit.column}'")
+            pos = edit.row - 2
+            if pos < 0 or pos >= len(df):
+                raise HTTPException(status_code=400, detail=f"Row {edit.row} is out of range")
+            resolved_edits.append((pos, column, edit.value))
+
+        touched = {}
+        for pos, column, value in resolved_edits:
+            set_cell_value(df, pos, df.columns.get_loc(column), value)
+            touched.setdefault(column, []).append(pos)
+
+        delta = revalidate_cells(df, validation_state, touched)
+
+        # Recheck the registry pairs of rows whose product type or country changed
+        pair_rows = np.unique(np.asarray(touched.get('product_type', []) + touched.get('country', []), dtype=np.int64))
+        if len(pair_rows):
+            unknown_before = np.isin(pair_rows, validation_state.get('unknown_pair_rows', []))
+            product_registry = await get_product_registry()
+            check_registry_pairs(df, validation_state, product_registry['pairs'], pair_rows)
+            unknown_after = np.isin(pair_rows, validation_state['unknown_pair_rows'])
+            pair_label = validation_state['header_labels'].get('product_type', 'product_type')
+            for pos in pair_rows[unknown_before & ~unknown_after].tolist():
+                delta['resolved'].append({'row': pos + 2, 'column': 'product_type', 'column_name': pair_label, 'issue_type': 'UNKNOWN_PRODUCT_COUNTRY'})
+            for pos in pair_rows[~unknown_before & unknown_after].tolist():
+                delta['new'].append({
+                    'row': pos + 2,
+                    'column': 'product_type',
+                    'column_name': pair_label,
+                    'issue_type': 'UNKNOWN_PRODUCT_COUNTRY',
+                    'message': "No VAT rule exists for this product type and country",
+                })
+
+        # Reassemble the issue list in column order from the per-column cache
+        validation_result['data_issues'] = collect_data_issues(validation_state)
+        stored_data.pop('enrichment', None)
+        has_issues = len(validation_result['missing_headers']) > 0 or len(validation_result['data_issues']) > 0
+        stored_data['has_issues'] = has_issues
+        stored_data['timestamp'] = datetime.now()
+
+        return {
+            "session_id": session_id,
+            "applied_edits": len(resolved_edits),
+            "resolved_issues": delta['resolved'],
+            "new_issues": delta['new'],
+            "updated_issues": {column: validation_state['column_issues'][column] for column in touched},
+            "has_issues": has_issues,
+        }
+
+# First rows, per-country summary and totals of the session's VAT report, served from the
+# session enrichment so a following download or email doesn't enrich again
+@router.get("/session/{session_id}/vat-preview")
+async def preview_vat_report(session_id: str, limit: int = 50):
+    if session_id not in processed_data_store:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+
+    enrichment = await get_session_enrichment(processed_data_store[session_id])
+    enriched_df, summary_df, manual_df, vat_summary = enrichment['enriched']
+
+    return {
+        "session_id": session_id,
+        "status": "manual_review_required" if len(manual_df) > 0 else "ready",
+        "row_count": len(enriched_df),
+        "manual_review_count": len(manual_df),
+        "unmatched_pairs": enrichment['unmatched_pairs'],
+        "vat_summary": vat_summary,
+        "summary": dataframe_to_json_safe(summary_df),
+        "rows": dataframe_to_json_safe(enriched_df.head(max(limit, 0))),
+    }
+
+# Bring the session's VAT report up to date with the current rules after manual-review
+# rows were fixed by adding products: only rows whose rule changed are recomputed
+@router.post("/session/{session_id}/re-enrich")
+async def re_enrich_session(session_id: str):
+    if session_id not in processed_data_store:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+
+    stored_data = processed_data_store[session_id]
+    previous = stored_data.get('enrichment')
+    previously_missing = int((~previous['found']).sum()) if previous is not None else None
+
+    enrichment = await get_session_enrichment(stored_data)
+    enriched_df, summary_df, manual_df, vat_summary = enrichment['enriched']
+    stored_data['timestamp'] = datetime.now()
+
+    return {
+        "session_id": session_id,
+        "status": "manual_review_required" if len(manual_df) > 0 else "ready",
+        "recomputed_rows": enrichment['recomputed_rows'] if enrichment is not previous else 0,
+        "resolved_rows": previously_missing - len(manual_df) if previously_missing is not None else None,
+        "manual_review_count": len(manual_df),
+        "unmatched_pairs": enrichment['unmatched_pairs'],
+        "vat_summary": vat_summary,
+    }
+
+# OSS return figures of the session: member state x VAT rate x goods/shipping x period,
+# plus the coarser levels, from the session enrichment
+@router.get("/session/{session_id}/oss-rollup")
+async def get_oss_rollup(session_id: str):
+    if session_id not in processed_data_store:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+
+    enrichment = await get_session_enrichment(processed_data_store[session_id])
+    _, _, manual_df, _ = enrichment['enriched']
+
+    return {
+        "session_id": session_id,
+        "period": OSS_PERIOD,
+        # Rows without a VAT rule are left out until they are resolved
+        "manual_review_count": len(manual_df),
+        "levels": rollup_records(enrichment['oss_rollup']),
+    }
+
 @router.get("/download-vat-issues/{session_id}")
 async def download_vat_issues(session_id: str):
     try:
@@ -622,180 +737,329 @@ async def download_vat_issues(session_id: str):
             raise HTTPException(status_code=404, detail="Session not found or expired")
         
         stored_data = processed_data_store[session_id]
-        df = stored_data['original_df'].copy()
         validation_result = stored_data['validation_result']
         file_name = stored_data['file_name']
-        
-        # Format date columns
-        for col in df.columns:
-            if "order date" in col.lower():
-                df[col] = pd.to_datetime(df[col], errors="coerce").dt.strftime("%d-%m-%Y")
 
         # Get header labels mapping
-        all_headers = await get_all_headers()
-        header_labels = {}
-                
-        # Build mapping from header values to labels
-        for header in all_headers:
-            value = header['value']
-            label = header['label']
-            header_labels[value] = label
-                
-        reverse_rename_map = {}
-        for key, val in header_labels.items():
-            reverse_rename_map[key] = val
-                
-        # Create rename mapping for existing columns
-        rename_map = {}
-        for col in df.columns:
-            # Check if this column has a corresponding label
-            if col in header_labels:
-                rename_map[col] = header_labels[col]
-                
-        # Apply the renaming
-        if rename_map:
-            df.rename(columns=rename_map, inplace=True)
-                
-        issues = validation_result.get("data_issues", [])
-        missing_headers = validation_result.get("missing_headers_detailed", [])
-        header_labels = validation_result.get("header_labels", {})
-        
-        # Insert placeholder columns for missing headers
-        missing_labels = [mh["header_label"] for mh in missing_headers]
-        for label in missing_labels:
-            if label not in df.columns:
-                df[label] = ""
-
-        # Build issues sheet
-        issues_rows = []
-        for mh in missing_headers:
-            issues_rows.append({
-                "Issue Type": "Missing Header",
-                "Column": mh["header_label"],
-                "Description": mh["description"]
-            })
-        
-        for issue in issues:
-            issues_rows.append({
-                "Issue Type": issue["issue_type"],
-                "Column": issue["column_name"],
-                "Description": issue["issue_description"],
-                "Missing Count": issue.get("total_missing", ""),
-                "Missing %": issue.get("percentage", "")
-            })
-
-        issues_df = pd.DataFrame(issues_rows or [{
-            "Issue Type": "None",
-            "Column": "All",
-            "Description": "No missing headers or data issues found."
-        }])
-
-        # --- Create Excel workbook ---
-        wb = Workbook()
-        ws_data = wb.active
-        ws_data.title = "User Data"
-        
-        from openpyxl.styles import PatternFill, Font, Border, Side, Alignment
-        from openpyxl.utils import get_column_letter
-        from openpyxl.utils.dataframe import dataframe_to_rows
-
-        # Fills
-        red_fill = PatternFill(start_color="FF9999", end_color="FF9999", fill_type="solid")    # Header or invalid type
-        orange_fill = PatternFill(start_color="FFBF00", end_color="FFF2CC", fill_type="solid")  # Missing values
-        header_fill = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")  # Normal header
-        bold_font = Font(bold=True)
-        thin_border = Border(
-            left=Side(style="thin"), right=Side(style="thin"),
-            top=Side(style="thin"), bottom=Side(style="thin")
+        header_labels = await get_header_labels()
+
+        # Copy the frame while no cell edit is applying, then render off the event loop
+        async with session_lock(stored_data):
+            df = await run_in_thread(stored_data['original_df'].copy)
+        content = await run_in_thread(render_vat_issues_workbook, df, validation_result, header_labels)
+
+        download_name = file_name.rsplit('.', 1)[0] + "_validation_annotated.xlsx"
+        return StreamingResponse(
+            io.BytesIO(content),
+            media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            headers={"Content-Disposition": f"attachment; filename={download_name}"}
         )
 
-        # --- Write data ---
-        for r in dataframe_to_rows(df, index=False, header=True):
-            ws_data.append(r)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Could not generate issue report: {str(e)}")
+
+# Report rendering. openpyxl work is blocking, the routes run these through the thread pool.
+
+# Annotated copy of the upload: the data with missing headers and flagged cells
+# highlighted, plus a sheet listing the validation issues. `header_labels` maps header
+# values to labels from the header config.
+def render_vat_issues_workbook(df: pd.DataFrame, validation_result: dict, header_labels: dict) -> bytes:
+    # Format date columns
+    for col in df.columns:
+        if "order date" in col.lower():
+            df[col] = pd.to_datetime(df[col], errors="coerce").dt.strftime("%d-%m-%Y")
+
+    reverse_rename_map = {}
+    for key, val in header_labels.items():
+        reverse_rename_map[key] = val
+
+    # Create rename mapping for existing columns
+    rename_map = {}
+    for col in df.columns:
+        # Check if this column has a corresponding label
+        if col in header_labels:
+            rename_map[col] = header_labels[col]
+
+    # Apply the renaming
+    if rename_map:
+        df.rename(columns=rename_map, inplace=True)
+
+    issues = validation_result.get("data_issues", [])
+    missing_headers = validation_result.get("missing_headers_detailed", [])
+    header_labels = validation_result.get("header_labels", {})
+
+    # Insert placeholder columns for missing headers
+    missing_labels = [mh["header_label"] for mh in missing_headers]
+    for label in missing_labels:
+        if label not in df.columns:
+            df[label] = ""
+
+    # Build issues sheet
+    issues_rows = []
+    for mh in missing_headers:
+        issues_rows.append({
+            "Issue Type": "Missing Header",
+            "Column": mh["header_label"],
+            "Description": mh["description"]
+        })
+
+    for issue in issues:
+        issues_rows.append({
+            "Issue Type": issue["issue_type"],
+            "Column": issue["column_name"],
+            "Description": issue["issue_description"],
+            "Missing Count": issue.get("total_missing", ""),
+            "Missing %": issue.get("percentage", "")
+        })
+
+    issues_df = pd.DataFrame(issues_rows or [{
+        "Issue Type": "None",
+        "Column": "All",
+        "Description": "No missing headers or data issues found."
+    }])
+
+    # --- Create Excel workbook ---
+    wb = Workbook()
+    ws_data = wb.active
+    ws_data.title = "User Data"
+
+    from openpyxl.styles import PatternFill, Font, Border, Side, Alignment
+    from openpyxl.utils import get_column_letter
+    from openpyxl.utils.dataframe import dataframe_to_rows
+
+    # Fills
+    red_fill = PatternFill(start_color="FF9999", end_color="FF9999", fill_type="solid")    # Header or invalid type
+    orange_fill = PatternFill(start_color="FFBF00", end_color="FFF2CC", fill_type="solid")  # Missing values
+    header_fill = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")  # Normal header
+    bold_font = Font(bold=True)
+    thin_border = Border(
+        left=Side(style="thin"), right=Side(style="thin"),
+        top=Side(style="thin"), bottom=Side(style="thin")
+    )
+
+    # --- Write data ---
+    for r in dataframe_to_rows(df, index=False, header=True):
+        ws_data.append(r)
+
+    col_name_to_index = {col: idx for idx, col in enumerate(df.columns)}
+
+    # --- Highlight headers ---
+    for col_idx, col in enumerate(df.columns, start=1):
+        cell = ws_data.cell(row=1, column=col_idx)
+        cell.font = bold_font
+        cell.border = thin_border
+        cell.alignment = Alignment(horizontal="center")
+        cell.fill = red_fill if col in missing_labels else header_fill
 
-        col_name_to_index = {col: idx for idx, col in enumerate(df.columns)}
+    # --- Highlight issues ---
+    for issue in issues:
+        original_col = issue.get("original_column")
+        if not original_col:
+            continue
 
-        # --- Highlight headers ---
-        for col_idx, col in enumerate(df.columns, start=1):
-            cell = ws_data.cell(row=1, column=col_idx)
+        # Map system name to label
+        renamed_col = reverse_rename_map.get(original_col, original_col)
+        if renamed_col not in col_name_to_index:
+            continue
+
+        col_idx = col_name_to_index[renamed_col] + 1  # openpyxl is 1-indexed
+
+        if issue["issue_type"] == "MISSING_DATA":
+            for row_str in issue.get("missing_rows", []):
+                try:
+                    row_num = int(row_str)
+                    ws_data.cell(row=row_num, column=col_idx).fill = orange_fill
+                except Exception:
+                    continue
+        elif issue["issue_type"] in ("INVALID_TYPE", "CONSTRAINT_VIOLATION", "UNKNOWN_PRODUCT_COUNTRY"):
+            for row_num in issue.get("invalid_rows", []):
+                try:
+                    ws_data.cell(row=row_num, column=col_idx).fill = red_fill
+                except Exception:
+                    continue
+
+    # --- Style data cells + autosize ---
+    for row in ws_data.iter_rows(min_row=2):
+        for cell in row:
+            cell.border = thin_border
+            cell.alignment = Alignment(vertical="center")
+
+    for col in ws_data.columns:
+        max_len = max((len(str(cell.value)) for cell in col if cell.value), default=10)
+        col_letter = get_column_letter(col[0].column)
+        ws_data.column_dimensions[col_letter].width = max_len + 2
+
+    # --- Add issues sheet ---
+    ws_issues = wb.create_sheet("Validation Issues")
+    for r in dataframe_to_rows(issues_df, index=False, header=True):
+        ws_issues.append(r)
+
+    for col in ws_issues.iter_cols(min_row=1, max_row=1):
+        for cell in col:
+            cell.fill = header_fill
             cell.font = bold_font
             cell.border = thin_border
-            cell.alignment = Alignment(horizontal="center")
-            cell.fill = red_fill if col in missing_labels else header_fill
 
-        # --- Highlight issues ---
-        for issue in issues:
-            original_col = issue.get("original_column")
-            if not original_col:
-                continue
-            
-            # Map system name to label
-            renamed_col = reverse_rename_map.get(original_col, original_col)
-            if renamed_col not in col_name_to_index:
-                continue
-            
-            col_idx = col_name_to_index[renamed_col] + 1  # openpyxl is 1-indexed
-            
-            if issue["issue_type"] == "MISSING_DATA":
-                for row_str in issue.get("missing_rows", []):
-                    try:
-                        row_num = int(row_str)
-                        ws_data.cell(row=row_num, column=col_idx).fill = orange_fill
-                    except Exception:
-                        continue
-            elif issue["issue_type"] == "INVALID_TYPE":
-                for row_num in issue.get("invalid_rows", []):
-                    try:
-                        ws_data.cell(row=row_num, column=col_idx).fill = red_fill
-                    except Exception:
-                        continue
-
-        # --- Style data cells + autosize ---
-        for row in ws_data.iter_rows(min_row=2):
-            for cell in row:
-                cell.border = thin_border
-                cell.alignment = Alignment(vertical="center")
-
-        for col in ws_data.columns:
-            max_len = max((len(str(cell.value)) for cell in col if cell.value), default=10)
-            col_letter = get_column_letter(col[0].column)
-            ws_data.column_dimensions[col_letter].width = max_len + 2
-
-        # --- Add issues sheet ---
-        ws_issues = wb.create_sheet("Validation Issues")
-        for r in dataframe_to_rows(issues_df, index=False, header=True):
-            ws_issues.append(r)
-
-        for col in ws_issues.iter_cols(min_row=1, max_row=1):
-            for cell in col:
-                cell.fill = header_fill
-                cell.font = bold_font
-                cell.border = thin_border
-
-        for row in ws_issues.iter_rows(min_row=2):
+    for row in ws_issues.iter_rows(min_row=2):
+        for cell in row:
+            cell.border = thin_border
+            cell.alignment = Alignment(wrap_text=True, vertical="top")
+
+    for col in ws_issues.columns:
+        max_len = max((len(str(cell.value)) for cell in col if cell.value), default=10)
+        col_letter = get_column_letter(col[0].column)
+        ws_issues.column_dimensions[col_letter].width = max_len + 2
+
+    # --- Output stream ---
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+# Workbook of the enriched rows with the rows lacking a VAT rule highlighted
+def render_manual_review_workbook(df: pd.DataFrame) -> bytes:
+    manual_email_stream = io.BytesIO()
+    with pd.ExcelWriter(manual_email_stream, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name="VAT Report")
+    manual_email_stream.seek(0)
+
+    workbook = load_workbook(manual_email_stream)
+    fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+
+    for sheet_name in ["VAT Report", "Summary"]:
+        if sheet_name in workbook.sheetnames:
+            sheet = workbook[sheet_name]
+            for row in sheet.iter_rows(min_row=2, max_row=sheet.max_row):
+                highlight_row = any(str(cell.value).strip() == "Not Found" for cell in row)
+                for cell in row:
+                    cell.font = Font(name='Calibri', size=12, bold=False)
+                    if highlight_row:
+                        cell.fill = fill
+            for cell in sheet[1]:
+                cell.font = Font(name='Calibri', size=12, bold=False)
+
+    final_manual_email_stream = io.BytesIO()
+    workbook.save(final_manual_email_stream)
+    return final_manual_email_stream.getvalue()
+
+
+# Sheet column (1-based) of a report column; the totals row goes under the column it sums
+def _report_column(df: pd.DataFrame, label: str, default: int) -> int:
+    return df.columns.get_loc(label) + 1 if label in df.columns else default
+
+
+# Zip of the VAT report (overall totals under the rows) and the summary workbook (with
+# the OSS rollup sheets); returns (zip name, zip bytes). `net_price_label` is the
+# configured label of the net price column.
+def render_vat_report_zip(enriched_df: pd.DataFrame, summary_df: pd.DataFrame, vat_summary: dict, oss_rollup: dict, file_name: str, net_price_label: str = "Net Price") -> tuple[str, bytes]:
+    enriched_df = enriched_df.copy()
+
+    for col in enriched_df.columns:
+        if "order date" in col.lower() and pd.api.types.is_datetime64_any_dtype(enriched_df[col]):
+            enriched_df[col] = enriched_df[col].dt.strftime("%d-%m-%Y")
+
+    # Create in-memory files for each report
+    vat_report_stream = io.BytesIO()
+    summary_stream = io.BytesIO()
+    zip_stream = io.BytesIO()
+
+    # Create VAT Report Excel
+    with pd.ExcelWriter(vat_report_stream, engine='openpyxl') as writer:
+        enriched_df.to_excel(writer, index=False, sheet_name="VAT Report")
+        vat_report_sheet = writer.sheets["VAT Report"]
+
+        # Add summary at the bottom of VAT Report
+        start_row = enriched_df.shape[0] + 3
+        net_column = _report_column(enriched_df, net_price_label, 5)
+        vat_column = _report_column(enriched_df, "Total VAT", 13)
+        gross_column = _report_column(enriched_df, "Final Gross Total", 14)
+        vat_report_sheet.cell(row=start_row, column=net_column, value="Overall Net Total")
+        vat_report_sheet.cell(row=start_row + 1, column=net_column, value=vat_summary["overall_net_price"])
+        vat_report_sheet.cell(row=start_row, column=vat_column, value="Overall VAT Amount")
+        vat_report_sheet.cell(row=start_row + 1, column=vat_column, value=vat_summary["overall_vat_amount"])
+        vat_report_sheet.cell(row=start_row, column=gross_column, value="Overall Gross Total")
+        vat_report_sheet.cell(row=start_row + 1, column=gross_column, value=vat_summary["overall_gross_total"])
+
+        # Apply formatting
+        for row in vat_report_sheet.iter_rows():
             for cell in row:
-                cell.border = thin_border
-                cell.alignment = Alignment(wrap_text=True, vertical="top")
+                cell.font = Font(name='Calibri', size=12, bold=False)
 
-        for col in ws_issues.columns:
-            max_len = max((len(str(cell.value)) for cell in col if cell.value), default=10)
-            col_letter = get_column_letter(col[0].column)
-            ws_issues.column_dimensions[col_letter].width = max_len + 2
+    # Create Summary Excel, with the OSS return rollup sheets
+    with pd.ExcelWriter(summary_stream, engine='openpyxl') as writer:
+        summary_df.to_excel(writer, index=False, sheet_name="Summary")
+        write_oss_sheets(writer, oss_rollup)
 
-        # --- Output stream ---
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
+        # Apply formatting
+        for summary_sheet in writer.sheets.values():
+            for row in summary_sheet.iter_rows():
+                for cell in row:
+                    cell.font = Font(name='Calibri', size=12, bold=False)
 
-        download_name = file_name.rsplit('.', 1)[0] + "_validation_annotated.xlsx"
-        return StreamingResponse(
-            output,
-            media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            headers={"Content-Disposition": f"attachment; filename={download_name}"}
-        )
+    # Create a zip file containing both reports
+    base_name = file_name.rsplit('.', 1)[0] if '.' in file_name else file_name
+    zip_name = f"{base_name}_VAT_Reports.zip"
+
+    with zipfile.ZipFile(zip_stream, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        zipf.writestr(f"{base_name}_VAT_Report.xlsx", vat_report_stream.getvalue())
+        zipf.writestr(f"{base_name}_Summary.xlsx", summary_stream.getvalue())
+
+    return zip_name, zip_stream.getvalue()
+
+
+# Manual-review payload for the email and download routes, and the highlighted workbook
+# when it will be emailed. Works on copies, the enrichment is cached on the session.
+def render_manual_review(result: dict, df: pd.DataFrame, file_name: str, with_workbook: bool) -> tuple[dict, bytes | None]:
+    result = dict(result)
+    manual_review_rows = [dict(row) for row in result.get("manual_review_rows", [])]
+    result["manual_review_rows"] = manual_review_rows
+
+    # ✅ Convert timestamps to strings for JSON safety
+    for row in manual_review_rows:
+        for key, value in row.items():
+            if isinstance(value, pd.Timestamp):
+                row[key] = value.strftime("%Y-%m-%d")
+
+    result["file_name"] = file_name  # ensure included
+
+    # Build Excel with highlighting
+    manual_workbook = render_manual_review_workbook(df) if with_workbook else None
+    return result, manual_workbook
+
+
+# Report for a session, shared by the download route and the report job. Returns
+# {'manual_review': payload, 'manual_workbook': bytes | None} when rows lack a VAT rule
+# (the workbook is rendered for the review email when there is an address), otherwise
+# {'zip_name': ..., 'zip_content': ...}. `progress(stage, fraction)` follows the enrichment
+# and rendering stages when given.
+async def prepare_vat_report(stored_data: Dict[str, Any], user_email: str | None, progress=None) -> Dict[str, Any]:
+    file_name = stored_data['file_name']
+
+    enrich_progress = (lambda fraction: progress('enriching', fraction)) if progress else None
+    if progress:
+        progress('enriching')
+    enrichment = await get_session_enrichment(stored_data, enrich_progress)
+    df = enrichment['frame']
+    result = enrichment['result']
+    if progress:
+        progress('rendering')
+
+    # Handle manual review scenario
+    if isinstance(result, dict) and result.get("status") == "manual_review_required":
+        print("Manual review required. Preparing email.")
+        # The row copies and the workbook are built off the event loop
+        result, manual_workbook = await run_in_thread(render_manual_review, result, df, file_name, bool(user_email))
+        return {'manual_review': result, 'manual_workbook': manual_workbook}
+
+    # Proceed with downloadable file generation
+    enriched_df, summary_df, manual_df, vat_summary = result
+    header_config = await get_header_config()
+    zip_name, zip_content = await run_in_thread(
+        render_vat_report_zip, enriched_df, summary_df, vat_summary, enrichment['oss_rollup'], file_name,
+        header_config['header_labels'].get('net_price', 'net_price'),
+    )
+    return {'zip_name': zip_name, 'zip_content': zip_content}
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Could not generate issue report: {str(e)}")
 
 @router.post("/download-vat-report/{session_id}")
 async def download_vat_report(session_id: str, background_tasks: BackgroundTasks, user_email: str = Form(...)):
@@ -804,132 +1068,34 @@ async def download_vat_report(session_id: str, background_tasks: BackgroundTasks
             raise HTTPException(status_code=404, detail="Session not found or expired")
 
         stored_data = processed_data_store[session_id]
-        df = stored_data['original_df'].copy()
-        file_name = stored_data['file_name']
 
         print("File validation completed")
 
-        result = await enrich_dataframe_with_vat(df)
-        print("Enrichment result:", result)
-
-        # Handle manual review scenario
-        if isinstance(result, dict) and result.get("status") == "manual_review_required":
-            print("Manual review required. Preparing email.")
-            manual_review_rows = result.get("manual_review_rows", [])
-
-            # ✅ Convert timestamps to strings for JSON safety
-            for row in manual_review_rows:
-                for key, value in row.items():
-                    if isinstance(value, pd.Timestamp):
-                        row[key] = value.strftime("%Y-%m-%d")
-
-            if user_email:
-                # Build Excel with highlighting
-                manual_email_stream = io.BytesIO()
-                with pd.ExcelWriter(manual_email_stream, engine='openpyxl') as writer:
-                    df.to_excel(writer, index=False, sheet_name="VAT Report")
-                manual_email_stream.seek(0)
-
-                workbook = load_workbook(manual_email_stream)
-                fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
-
-                for sheet_name in ["VAT Report", "Summary"]:
-                    if sheet_name in workbook.sheetnames:
-                        sheet = workbook[sheet_name]
-                        for row in sheet.iter_rows(min_row=2, max_row=sheet.max_row):
-                            highlight_row = any(str(cell.value).strip() == "Not Found" for cell in row)
-                            for cell in row:
-                                cell.font = Font(name='Calibri', size=12, bold=False)
-                                if highlight_row:
-                                    cell.fill = fill
-                        for cell in sheet[1]:
-                            cell.font = Font(name='Calibri', size=12, bold=False)
-
-                final_manual_email_stream = io.BytesIO()
-                workbook.save(final_manual_email_stream)
-                final_manual_email_stream.seek(0)
+        report = await prepare_vat_report(stored_data, user_email)
 
+        if 'manual_review' in report:
+            result = report['manual_review']
+            if report['manual_workbook'] is not None:
                 background_tasks.add_task(
                     send_manual_vat_email,
                     "mailer@xtechon.com",
                     user_email,
-                    final_manual_email_stream.getvalue(),
-                    manual_review_rows  # ✅ Now safely serializable
+                    report['manual_workbook'],
+                    result["manual_review_rows"],  # ✅ Now safely serializable
+                    result.get("unmatched_pairs"),
                 )
                 print("Manual review email task added to background.")
             else:
                 print("No user email provided. Skipping manual review email.")
 
-            result["file_name"] = file_name  # ensure included
-
             return JSONResponse(status_code=200, content=result)
 
-        # Proceed with downloadable file generation
-        enriched_df, summary_df, manual_df, vat_summary = result
-
-        for col in enriched_df.columns:
-            if "order date" in col.lower() and pd.api.types.is_datetime64_any_dtype(enriched_df[col]):
-                enriched_df[col] = enriched_df[col].dt.strftime("%d-%m-%Y")
-
-        # Create in-memory files for each report
-        vat_report_stream = io.BytesIO()
-        summary_stream = io.BytesIO()
-        zip_stream = io.BytesIO()
-
-        # Create VAT Report Excel
-        with pd.ExcelWriter(vat_report_stream, engine='openpyxl') as writer:
-            enriched_df.to_excel(writer, index=False, sheet_name="VAT Report")
-            workbook = writer.book
-            vat_report_sheet = writer.sheets["VAT Report"]
-            
-            # Add summary at the bottom of VAT Report
-            start_row = enriched_df.shape[0] + 3
-            vat_report_sheet.cell(row=start_row, column=5, value="Overall Net Total")
-            vat_report_sheet.cell(row=start_row + 1, column=5, value=vat_summary["overall_net_price"])
-            vat_report_sheet.cell(row=start_row, column=13, value="Overall VAT Amount")
-            vat_report_sheet.cell(row=start_row + 1, column=13, value=vat_summary["overall_vat_amount"])
-            vat_report_sheet.cell(row=start_row, column=14, value="Overall Gross Total")
-            vat_report_sheet.cell(row=start_row + 1, column=14, value=vat_summary["overall_gross_total"])
-            
-            # Apply formatting
-            for row in vat_report_sheet.iter_rows():
-                for cell in row:
-                    cell.font = Font(name='Calibri', size=12, bold=False)
-
-        # Create Summary Excel
-        with pd.ExcelWriter(summary_stream, engine='openpyxl') as writer:
-            summary_df.to_excel(writer, index=False, sheet_name="Summary")
-            workbook = writer.book
-            summary_sheet = writer.sheets["Summary"]
-            
-            # Apply formatting
-            for row in summary_sheet.iter_rows():
-                for cell in row:
-                    cell.font = Font(name='Calibri', size=12, bold=False)
-
-        # Reset streams to beginning
-        vat_report_stream.seek(0)
-        summary_stream.seek(0)
-
-        # Create a zip file containing both reports
-        base_name = file_name.rsplit('.', 1)[0]
-        vat_report_name = f"{base_name}_VAT_Report.xlsx"
-        summary_name = f"{base_name}_Summary.xlsx"
-        zip_name = f"{base_name}_VAT_Reports.zip"
-
-        with zipfile.ZipFile(zip_stream, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            zipf.writestr(vat_report_name, vat_report_stream.getvalue())
-            zipf.writestr(summary_name, summary_stream.getvalue())
-
-        zip_stream.seek(0)
-
-        # if session_id in processed_data_store:
-        #     del processed_data_store[session_id]
+        zip_stream = io.BytesIO(report['zip_content'])
 
         return StreamingResponse(
             zip_stream,
             media_type='application/zip',
-            headers={"Content-Disposition": f"attachment; filename={zip_name}"}
+            headers={"Content-Disposition": f"attachment; filename={report['zip_name']}"}
         )
 
     except HTTPException as he:
@@ -941,6 +1107,46 @@ async def download_vat_report(session_id: str, background_tasks: BackgroundTasks
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Could not generate download: {str(e)}")
 
+# Out-of-core mode for files too large for a session: the upload is read, validated,
+# enriched and written in fixed-size row chunks and the reports are returned as a zip.
+# Nothing is kept in processed_data_store; issues, per-country and OSS totals and missing
+# VAT rules are accumulated per chunk into the summary workbook, and the pipeline result
+# is returned in the X-Pipeline-Summary header.
+@router.post("/process-file-stream")
+async def process_file_stream(file: UploadFile = File(...), output_format: str = Form("csv")):
+    unsupported = unsupported_upload(file.filename)
+    if unsupported is not None:
+        raise HTTPException(status_code=400, detail=unsupported['message'])
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported output format '{output_format}', expected one of {', '.join(OUTPUT_FORMATS)}")
+
+    work_dir = tempfile.mkdtemp(prefix="vat_pipeline_")
+    try:
+        pipeline = ChunkedPipeline(await get_header_config(), await get_product_registry(), await get_fx_table(), output_format)
+        base_name = file.filename.rsplit('.', 1)[0]
+        # FastAPI spools large uploads to disk; the pipeline reads the spooled file in chunks
+        await file.seek(0)
+        result = await run_in_thread(pipeline.run, file.filename.lower(), file.file, work_dir, base_name)
+        print(f"Processed {result['total_rows']} rows in chunks, {result['manual_review_count']} need manual review")
+    except HTTPException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    except Exception as e:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        print(f"Error in chunked processing: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Could not process file: {str(e)}")
+
+    zip_path = result.pop('zip_path')
+    return FileResponse(
+        zip_path,
+        media_type='application/zip',
+        filename=os.path.basename(zip_path),
+        headers={"X-Pipeline-Summary": json.dumps(result)},
+        background=BackgroundTask(shutil.rmtree, work_dir, ignore_errors=True),
+    )
+
 @router.post("/send-vat-report-email/{session_id}")
 async def send_vat_report_email(session_id: str, background_tasks: BackgroundTasks, user_email: str = Form(...), file_name: str = Form(...)):
     try:
@@ -949,11 +1155,11 @@ async def send_vat_report_email(session_id: str, background_tasks: BackgroundTas
             raise HTTPException(status_code=404, detail="Session not found or expired")
         
         stored_data = processed_data_store[session_id]
-        df = stored_data['original_df'].copy()
         print(f"Preparing to send VAT report to {user_email}")
         
-        # Process the VAT data
-        result = await enrich_dataframe_with_vat(df)
+        # Process the VAT data (reused from an earlier download when the rules are unchanged)
+        enrichment = await get_session_enrichment(stored_data)
+        result = enrichment['result']
                 
         # Check if manual review is required
         if isinstance(result, dict) and result.get("status") == "manual_review_required":
@@ -964,36 +1170,11 @@ async def send_vat_report_email(session_id: str, background_tasks: BackgroundTas
             
         # Process successful VAT report
         enriched_df, summary_df, manual_df, vat_summary = result
-        
-        # Format dates
-        for col in enriched_df.columns:
-            if "order date" in col.lower() and pd.api.types.is_datetime64_any_dtype(enriched_df[col]):
-                enriched_df[col] = enriched_df[col].dt.strftime("%d-%m-%Y")
-        
-        # Create in-memory files for reports
-        vat_report_stream = io.BytesIO()
-        summary_stream = io.BytesIO()
-        
-        # Create VAT Report Excel
-        with pd.ExcelWriter(vat_report_stream, engine='openpyxl') as writer:
-            enriched_df.to_excel(writer, index=False, sheet_name="VAT Report")
-            # ... (rest of the VAT report generation code)
-        
-        # Create Summary Excel
-        with pd.ExcelWriter(summary_stream, engine='openpyxl') as writer:
-            summary_df.to_excel(writer, index=False, sheet_name="Summary")
-        
-        # Create zip file
-        base_name = file_name.rsplit('.', 1)[0] if '.' in file_name else file_name
-        zip_name = f"{base_name}_VAT_Reports.zip"
-                
-        zip_stream = io.BytesIO()
-        with zipfile.ZipFile(zip_stream, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            zipf.writestr(f"{base_name}_VAT_Report.xlsx", vat_report_stream.getvalue())
-            zipf.writestr(f"{base_name}_Summary.xlsx", summary_stream.getvalue())
-        
-        zip_stream.seek(0)
-        zip_content = zip_stream.getvalue()
+        header_config = await get_header_config()
+        zip_name, zip_content = await run_in_thread(
+            render_vat_report_zip, enriched_df, summary_df, vat_summary, enrichment['oss_rollup'], file_name,
+            header_config['header_labels'].get('net_price', 'net_price'),
+        )
         
         # Send email in background task WITHOUT raising exceptions
         background_tasks.add_task(
@@ -0,0 +1,512 @@
+import os
+import asyncio
+from collections import defaultdict
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import pandas as pd
+from app.core.helper import safe_float
+from app.core.column_validation import factorize_column
+from app.core.currency_conversion import FxTable
+from app.core.money import MINOR_UNITS, RATE_SCALE, VAT_ROUNDING_MODE, to_minor_units, from_minor_units, percent_to_rate, rate_to_fraction, compute_vat, total_amount
+from app.core.executors import PROCESS_POOL_SIZE, get_initialized_pool, reset_initialized_pool, run_in_thread
+
+NOT_FOUND = "Not Found"
+
+# Column grouping lines into invoices for VAT_ROUNDING_MODE=invoice; without it every
+# line is its own invoice
+VAT_INVOICE_COLUMN = os.getenv("VAT_INVOICE_COLUMN", "invoice_number")
+
+# Frames with at least this many rows are enriched in row chunks across the process pool
+PARALLEL_ENRICH_MIN_ROWS = int(os.getenv("PARALLEL_ENRICH_MIN_ROWS", 500_000))
+ENRICH_CHUNK_ROWS = int(os.getenv("ENRICH_CHUNK_ROWS", 250_000))
+
+
+# Day numbers (days since 1970-01-01) bounding open-ended rules
+OPEN_START_DAY = -(2 ** 30)
+OPEN_END_DAY = 2 ** 30
+_KEY_STRIDE = 2 ** 32
+
+
+def _rule_day(value) -> int | None:
+    if value is None or value == '':
+        return None
+    parsed = pd.to_datetime(value, errors='coerce')
+    if pd.isna(parsed):
+        return None
+    return int(parsed.to_datetime64().astype('datetime64[D]').astype(np.int64))
+
+
+# Effective-dated VAT rules per (product_type, country), rates as int64 millionths (see
+# app.core.money). A rule applies from valid_from through valid_to (both inclusive, either
+# may be open). Overlapping rules are stored as disjoint segments sorted by (key, start), so
+# a whole column of (key, order date) pairs resolves with one searchsorted: each row gets the
+# segment of its key with the latest start on or before the order date, if it hasn't ended.
+class VatRuleTable:
+    def __init__(self, keys: pd.MultiIndex, key_codes: np.ndarray, starts: np.ndarray, ends: np.ndarray, vat_rates: np.ndarray, shipping_vat_rates: np.ndarray):
+        self.keys = keys
+        self.key_codes = key_codes
+        self.starts = starts
+        self.ends = ends
+        self.vat_rates = vat_rates
+        self.shipping_vat_rates = shipping_vat_rates
+        self.boundaries = key_codes * _KEY_STRIDE + (starts - OPEN_START_DAY)
+        # (product_type, country) -> key code, for single-order lookups without building an index
+        self.key_positions = {key: code for code, key in enumerate(keys)}
+
+    def __len__(self) -> int:
+        return len(self.key_codes)
+
+    # Rule position for one normalized (product_type, country) on a day, -1 when none applies
+    def lookup_one(self, product_type: str, country: str, order_day: int) -> int:
+        key_code = self.key_positions.get((product_type, country))
+        if key_code is None:
+            return -1
+        day = min(max(order_day, OPEN_START_DAY), OPEN_END_DAY)
+        candidate = int(np.searchsorted(self.boundaries, key_code * _KEY_STRIDE + (day - OPEN_START_DAY), side='right')) - 1
+        if candidate < 0 or self.key_codes[candidate] != key_code or day > self.ends[candidate]:
+            return -1
+        return candidate
+
+    # Rule position for each row, -1 when the key has no rule in force on that day
+    def lookup(self, product_types: np.ndarray, countries: np.ndarray, order_days: np.ndarray) -> np.ndarray:
+        key_codes = self.keys.get_indexer(pd.MultiIndex.from_arrays([product_types, countries]))
+        positions = np.full(len(key_codes), -1, dtype=np.int64)
+        known = np.flatnonzero(key_codes >= 0)
+        if not len(known) or not len(self):
+            return positions
+
+        days = np.clip(order_days[known], OPEN_START_DAY, OPEN_END_DAY)
+        candidates = np.searchsorted(self.boundaries, key_codes[known] * _KEY_STRIDE + (days - OPEN_START_DAY), side='right') - 1
+        valid = candidates >= 0
+        candidates = np.maximum(candidates, 0)
+        valid &= (self.key_codes[candidates] == key_codes[known]) & (days <= self.ends[candidates])
+        positions[known[valid]] = candidates[valid]
+        return positions
+
+
+# The product document behind each rule, keyed by normalized (product_type, country,
+# valid_from day; OPEN_START_DAY when open). When several products share a key the first
+# one wins: get_all_products lists the newest first. Every builder over the product list
+# goes through here so they agree on the winner.
+def effective_rules(products: list[dict]) -> dict[tuple, dict]:
+    rules = {}
+    for prod in products:
+        product_type = str(prod.get('product_type', '')).strip().lower()
+        country = str(prod.get('country', '')).strip().lower()
+        if product_type and country:
+            start = _rule_day(prod.get('valid_from'))
+            rules.setdefault((product_type, country, OPEN_START_DAY if start is None else start), prod)
+    return rules
+
+
+# Build the rule table from product documents (winners as in effective_rules). Products
+# without valid_from/valid_to are open-ended. Overlapping rules of a key are split into
+# disjoint segments (see _disjoint_segments).
+def build_rate_table(products: list[dict]) -> VatRuleTable:
+    rules = defaultdict(dict)
+    for (product_type, country, start), prod in effective_rules(products).items():
+        end = _rule_day(prod.get('valid_to'))
+        rules[(product_type, country)][start] = (
+            OPEN_END_DAY if end is None else end,
+            safe_float(prod.get("vat_rate", 2)),
+            safe_float(prod.get("shipping_vat_rate", 2)),
+        )
+
+    key_list = sorted(rules)
+    ordered = [(code, segment) for code, key in enumerate(key_list) for segment in _disjoint_segments(rules[key])]
+    keys = pd.MultiIndex.from_tuples(key_list, names=['product_type', 'country']) if key_list else \
+        pd.MultiIndex.from_arrays([[], []], names=['product_type', 'country'])
+
+    return VatRuleTable(
+        keys,
+        np.array([code for code, _ in ordered], dtype=np.int64),
+        np.array([start for _, (start, _, _, _) in ordered], dtype=np.int64),
+        np.array([end for _, (_, end, _, _) in ordered], dtype=np.int64),
+        percent_to_rate([vat_rate for _, (_, _, vat_rate, _) in ordered]),
+        percent_to_rate([shipping_vat_rate for _, (_, _, _, shipping_vat_rate) in ordered]),
+    )
+
+
+# One key's rules ({valid_from: (valid_to, vat_rate, shipping_vat_rate)}) as ascending,
+# non-overlapping (start, end, vat_rate, shipping_vat_rate) segments. On days where rules
+# overlap the one that started last applies, so a temporary rate nested in an open-ended
+# rule only covers its own window and the enclosing rule applies again after it.
+def _disjoint_segments(rules: dict) -> list[tuple]:
+    points = sorted(set(rules) | {end + 1 for end, _, _ in rules.values() if end < OPEN_END_DAY})
+    segments = []
+    for segment_start, next_point in zip(points, points[1:] + [OPEN_END_DAY + 1]):
+        covering = [start for start, (end, _, _) in rules.items() if start <= segment_start <= end]
+        if not covering:
+            continue
+        rule_start = max(covering)
+        _, vat_rate, shipping_vat_rate = rules[rule_start]
+        if segments and segments[-1][0] == rule_start and segments[-1][2] == segment_start - 1:
+            # Same rule continuing past a point where another one ended
+            segments[-1][2] = next_point - 1
+        else:
+            segments.append([rule_start, segment_start, next_point - 1, vat_rate, shipping_vat_rate])
+    return [(start, end, vat_rate, shipping_vat_rate) for _, start, end, vat_rate, shipping_vat_rate in segments]
+
+
+# Apply `func` once per distinct value of the column and broadcast the results back to the rows
+def map_distinct(series: pd.Series, func) -> np.ndarray:
+    codes, representatives = factorize_column(series)
+    present = codes >= 0
+
+    result = np.empty(len(series), dtype=object)
+    if len(representatives):
+        distinct = np.empty(len(representatives), dtype=object)
+        distinct[:] = [func(val) for val in series.iloc[representatives].tolist()]
+        result[present] = distinct[codes[present]]
+    if not present.all():
+        # None / NaN / NaT stringify differently, so map them one by one
+        result[~present] = [func(val) for val in series[~present].tolist()]
+    return result
+
+
+def to_amounts(series: pd.Series) -> np.ndarray:
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        values = series.to_numpy(dtype=float, na_value=np.nan)
+        return np.where(np.isnan(values), 0.0, values)
+    return map_distinct(series, safe_float).astype(float)
+
+
+def _find_columns(df: pd.DataFrame) -> dict:
+    # Case-insensitive match on the system names; the last matching column wins
+    columns = {}
+    for col in df.columns:
+        col_lower = col.lower()
+        if col_lower in ('order_date', 'product_type', 'country', 'net_price', 'shipping_amount', 'currency', VAT_INVOICE_COLUMN):
+            columns[col_lower] = col
+    return columns
+
+
+# Parse each distinct order date once (per-value parsing keeps the old format inference);
+# blank or unreadable dates become NaT
+def _parse_order_dates(order_dates: np.ndarray) -> np.ndarray:
+    date_codes, date_uniques = pd.factorize(order_dates)
+    parsed = []
+    for order_date in date_uniques:
+        try:
+            parsed.append(pd.to_datetime(order_date).to_datetime64().astype('datetime64[D]') if order_date else np.datetime64('NaT'))
+        except Exception:
+            parsed.append(np.datetime64('NaT'))
+    return np.asarray(parsed, dtype='datetime64[D]')[date_codes]
+
+
+def _order_date_strings(df: pd.DataFrame, columns: dict) -> np.ndarray:
+    order_date_col = columns.get('order_date')
+    if not order_date_col:
+        return np.full(len(df), "", dtype=object)
+    return map_distinct(df[order_date_col], lambda val: str(val).strip())
+
+
+# VAT rule of every row: (found mask, VAT rates, shipping VAT rates), rates in millionths and
+# 0 where no rule is in force. Rules are resolved on the order date; rows without a
+# readable date use today's rules.
+def resolve_rules(df: pd.DataFrame, rate_table: VatRuleTable, columns: dict | None = None, parsed_dates: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    n_rows = len(df)
+    columns = columns if columns is not None else _find_columns(df)
+    if parsed_dates is None:
+        parsed_dates = _parse_order_dates(_order_date_strings(df, columns))
+
+    product_types = map_distinct(df[columns['product_type']], lambda val: str(val).strip().lower()) if 'product_type' in columns else np.full(n_rows, "", dtype=object)
+    countries = map_distinct(df[columns['country']], lambda val: str(val).strip().lower()) if 'country' in columns else np.full(n_rows, "", dtype=object)
+    order_days = np.where(np.isnat(parsed_dates), np.datetime64('today', 'D'), parsed_dates).astype(np.int64)
+    rate_positions = rate_table.lookup(product_types, countries, order_days)
+    found = rate_positions >= 0
+
+    vat_rates = np.zeros(n_rows, dtype=np.int64)
+    shipping_vat_rates = np.zeros(n_rows, dtype=np.int64)
+    vat_rates[found] = rate_table.vat_rates[rate_positions[found]]
+    shipping_vat_rates[found] = rate_table.shipping_vat_rates[rate_positions[found]]
+    return found, vat_rates, shipping_vat_rates
+
+
+# Distinct (product_type, country) keys of the rows without a VAT rule, most frequent
+# first, with their row count and the first sheet rows (header is row 1) using them
+def unmatched_keys(df: pd.DataFrame, found: np.ndarray, sample_rows: int = 10) -> list[dict]:
+    missing = np.flatnonzero(~found)
+    if not len(missing):
+        return []
+    columns = _find_columns(df)
+    subset = df.iloc[missing]
+    keys = pd.DataFrame({
+        'product_type': map_distinct(subset[columns['product_type']], lambda val: str(val).strip().lower()) if 'product_type' in columns else "",
+        'country': map_distinct(subset[columns['country']], lambda val: str(val).strip().lower()) if 'country' in columns else "",
+        'row': missing + 2,
+    })
+    grouped = keys.groupby(['product_type', 'country'], sort=False)['row']
+    counts = grouped.size().sort_values(ascending=False, kind='stable')
+    sample = grouped.apply(lambda rows: rows.head(sample_rows).tolist())
+    return [
+        {'product_type': product_type, 'country': country, 'row_count': int(count), 'rows': sample[(product_type, country)]}
+        for (product_type, country), count in counts.items()
+    ]
+
+
+# Widen a set of row positions to every row of the same invoices, so per-invoice rounding
+# sees whole invoices when part of a frame is recomputed
+def expand_to_invoices(df: pd.DataFrame, positions: np.ndarray) -> np.ndarray:
+    invoice_col = _find_columns(df).get(VAT_INVOICE_COLUMN)
+    if VAT_ROUNDING_MODE != 'invoice' or not invoice_col or not len(positions):
+        return positions
+    codes = _invoice_codes(df[invoice_col])
+    return np.flatnonzero(np.isin(codes, codes[positions]))
+
+
+# Rows enrich_frame can't price: a non-EUR amount whose order date can't be read has no FX
+# rate date to convert at, so the row is left unconverted and without a VAT rule
+def unreadable_order_dates(df: pd.DataFrame) -> np.ndarray:
+    columns = _find_columns(df)
+    currency_col = columns.get('currency')
+    if not currency_col:
+        return np.zeros(len(df), dtype=bool)
+    currencies = map_distinct(df[currency_col], lambda val: str(val).strip().upper())
+    order_dates = _order_date_strings(df, columns)
+    return (currencies != "EUR") & (order_dates != "") & np.isnat(_parse_order_dates(order_dates))
+
+
+# Columnar VAT enrichment. Converts non-EUR amounts, joins every row against the rate table
+# and computes VAT, shipping VAT, totals and gross in integer cents (app.core.money). `df` is
+# updated in place (as the row-by-row version did) and returned with the boolean mask of rows
+# whose (product_type, country) had a rate, the overall totals and a ledger of the amount
+# columns in cents (aligned with df) for exact summaries.
+def enrich_frame(df: pd.DataFrame, rate_table: VatRuleTable, fx_table: FxTable) -> tuple[pd.DataFrame, np.ndarray, dict, pd.DataFrame]:
+    n_rows = len(df)
+    columns = _find_columns(df)
+    currency_col = columns.get('currency')
+    net_price_col = columns.get('net_price')
+    shipping_amount_col = columns.get('shipping_amount')
+    invoice_col = columns.get(VAT_INVOICE_COLUMN)
+
+    previous_currencies = df[currency_col] if currency_col else None
+    previous_net_prices = df[net_price_col] if net_price_col else None
+
+    currencies = map_distinct(df[currency_col], lambda val: str(val).strip().upper()) if currency_col else np.full(n_rows, "EUR", dtype=object)
+    order_dates = _order_date_strings(df, columns)
+
+    if net_price_col:
+        net_prices = to_amounts(df[net_price_col])
+    elif 'price' in df.columns:
+        net_prices = to_amounts(df['price'])
+    else:
+        net_prices = np.zeros(n_rows, dtype=float)
+    shipping_amounts = to_amounts(df[shipping_amount_col]) if shipping_amount_col else np.zeros(n_rows, dtype=float)
+
+    parsed_dates = _parse_order_dates(order_dates)
+
+    # Currency conversion to EUR, then everything is whole cents. Non-EUR rows whose order
+    # date can't be read are not converted and go to manual review like rows without a rule.
+    unreadable = (currencies != "EUR") & (order_dates != "") & np.isnat(parsed_dates)
+    needs_fx = (currencies != "EUR") & (order_dates != "") & ~unreadable
+    fx_rates = np.ones(n_rows, dtype=float)
+    fx_rate_dates = np.full(n_rows, np.datetime64('NaT'), dtype='datetime64[D]')
+    fx_rates[needs_fx], fx_rate_dates[needs_fx] = fx_table.lookup(currencies[needs_fx], parsed_dates[needs_fx])
+    converted = needs_fx & (fx_rates != 0)
+    net_prices[converted] /= fx_rates[converted]
+    shipping_amounts[converted] /= fx_rates[converted]
+    net_units = to_minor_units(net_prices)
+    shipping_units = to_minor_units(shipping_amounts)
+    final_currencies = currencies.copy()
+    final_currencies[converted] = "EUR"
+
+    # Join against the rate table
+    found, vat_rates, shipping_vat_rates = resolve_rules(df, rate_table, columns, parsed_dates)
+    if unreadable.any():
+        found &= ~unreadable
+        vat_rates[unreadable] = 0
+        shipping_vat_rates[unreadable] = 0
+
+    invoice_codes = _invoice_codes(df[invoice_col]) if invoice_col else None
+    vat_units = compute_vat(net_units, vat_rates, _rounding_groups(invoice_codes, vat_rates))
+    shipping_vat_units = compute_vat(shipping_units, shipping_vat_rates, _rounding_groups(invoice_codes, shipping_vat_rates))
+    total_vat_units = vat_units + shipping_vat_units
+    gross_total_units = net_units + total_vat_units
+
+    if net_price_col:
+        df[net_price_col] = from_minor_units(net_units)
+    if shipping_amount_col:
+        df[shipping_amount_col] = from_minor_units(shipping_units)
+    if currency_col:
+        df[currency_col] = final_currencies
+
+    df["Previous Currency"] = previous_currencies
+    df["Previous Net Price"] = previous_net_prices
+    # Rate actually applied (1.0 for EUR, empty when a non-EUR row had no order date) and the
+    # ECB date it was published for
+    df["FX Rate"] = np.where(converted | (currencies == "EUR"), fx_rates, np.nan)
+    df["FX Rate Date"] = pd.Series(fx_rate_dates, index=df.index).dt.strftime('%Y-%m-%d').where(converted, None)
+    df["VAT Rate"] = _with_not_found(rate_to_fraction(vat_rates), found)
+    df["Product VAT"] = _with_not_found(from_minor_units(vat_units), found)
+    df["Shipping VAT Rate"] = _with_not_found(rate_to_fraction(shipping_vat_rates), found)
+    df["Shipping VAT"] = _with_not_found(from_minor_units(shipping_vat_units), found)
+    df["Total VAT"] = from_minor_units(total_vat_units)
+    df["Final Gross Total"] = np.where(found, from_minor_units(gross_total_units), 0.0)
+
+    # Rows without a rate carry no VAT and no gross, as before
+    gross_total_units = np.where(found, gross_total_units, 0)
+    ledger = pd.DataFrame({
+        'net_price': net_units,
+        'shipping_amount': shipping_units,
+        'vat': vat_units,
+        'shipping_vat': shipping_vat_units,
+        'total_vat': total_vat_units,
+        'gross_total': gross_total_units,
+        'vat_rate': vat_rates,
+        'shipping_vat_rate': shipping_vat_rates,
+    }, index=df.index)
+
+    print(f"Enriched {n_rows} rows: {int(found.sum())} with VAT rates, {int(converted.sum())} converted to EUR")
+    return df, found, ledger_totals(ledger), ledger
+
+
+# Overall totals of an enrichment ledger (exact integer sums)
+def ledger_totals(ledger: pd.DataFrame) -> dict:
+    return {
+        "overall_vat_amount": total_amount(ledger['total_vat'].to_numpy()),
+        "overall_net_price": total_amount(ledger['net_price'].to_numpy()),
+        "overall_gross_total": total_amount(ledger['gross_total'].to_numpy()),
+    }
+
+
+# VAT quote for a single order line, straight from the in-memory rule and FX tables (no
+# frame). Same conversion, rule resolution and cent rounding as enrich_frame; returns None
+# when no VAT rule applies to the product type and country on the order date. Raises
+# ValueError for a currency without an FX series, which can't be quoted in EUR.
+def quote_vat(rate_table: VatRuleTable, fx_table: FxTable, product_type: str, country: str, net_price: float, shipping_amount: float, currency: str, order_date: np.datetime64) -> dict | None:
+    currency = str(currency).strip().upper() or "EUR"
+    if currency != "EUR" and currency not in fx_table.series:
+        raise ValueError(f"No FX rates for currency '{currency}'")
+
+    order_day = int(order_date.astype('datetime64[D]').astype(np.int64))
+    position = rate_table.lookup_one(str(product_type).strip().lower(), str(country).strip().lower(), order_day)
+    if position < 0:
+        return None
+
+    fx_rate, fx_rate_date = 1.0, None
+    if currency != "EUR":
+        rate, rate_date = fx_table.lookup_one(currency, order_date)
+        if rate != 0:
+            fx_rate = rate
+            fx_rate_date = None if rate_date is None else str(rate_date)
+
+    units = to_minor_units([net_price / fx_rate, shipping_amount / fx_rate])
+    rates = np.array([rate_table.vat_rates[position], rate_table.shipping_vat_rates[position]], dtype=np.int64)
+    vat_units = compute_vat(units, rates)
+    net_units, shipping_units = int(units[0]), int(units[1])
+    vat, shipping_vat = int(vat_units[0]), int(vat_units[1])
+
+    return {
+        "currency": "EUR",
+        "previous_currency": currency,
+        "fx_rate": fx_rate,
+        "fx_rate_date": fx_rate_date,
+        "net_price": net_units / MINOR_UNITS,
+        "shipping_amount": shipping_units / MINOR_UNITS,
+        "vat_rate": int(rates[0]) / RATE_SCALE,
+        "product_vat": vat / MINOR_UNITS,
+        "shipping_vat_rate": int(rates[1]) / RATE_SCALE,
+        "shipping_vat": shipping_vat / MINOR_UNITS,
+        "total_vat": (vat + shipping_vat) / MINOR_UNITS,
+        "gross_total": (net_units + vat + shipping_vat) / MINOR_UNITS,
+    }
+
+
+# Rate table and FX series preloaded into each enrichment worker by the pool initializer,
+# so chunks only carry rows
+_worker_tables: dict = {}
+
+
+def _init_enrichment_worker(rate_table: VatRuleTable, fx_table: FxTable):
+    _worker_tables['rate_table'] = rate_table
+    _worker_tables['fx_table'] = fx_table
+
+
+def _enrich_chunk_job(chunk: pd.DataFrame) -> tuple[pd.DataFrame, np.ndarray, pd.DataFrame]:
+    enriched, found, _, ledger = enrich_frame(chunk, _worker_tables['rate_table'], _worker_tables['fx_table'])
+    return enriched, found, ledger
+
+
+# enrich_frame for large frames: row chunks run in parallel on workers preloaded with the
+# current tables (the pool is rebuilt when the product or FX version changes) and are put
+# back together in row order. Per-invoice rounding needs whole invoices, so in that mode
+# chunks are cut on invoice boundaries (or not at all when invoices are not contiguous).
+# `progress`, when given, is called on the event loop with the fraction of chunks done.
+async def enrich_frame_parallel(df: pd.DataFrame, rate_table: VatRuleTable, fx_table: FxTable, rate_version: str, progress=None) -> tuple[pd.DataFrame, np.ndarray, dict, pd.DataFrame]:
+    chunk_bounds = _chunk_bounds(df)
+    if len(df) < PARALLEL_ENRICH_MIN_ROWS or PROCESS_POOL_SIZE < 2 or len(chunk_bounds) < 2:
+        return await run_in_thread(enrich_frame, df, rate_table, fx_table)
+
+    pool = get_initialized_pool(
+        "enrichment",
+        (rate_version, fx_table.version),
+        _init_enrichment_worker,
+        (rate_table, fx_table),
+    )
+    loop = asyncio.get_running_loop()
+    futures = [loop.run_in_executor(pool, _enrich_chunk_job, df.iloc[start:end]) for start, end in chunk_bounds]
+    if progress is not None:
+        # Report the share of chunks done as each one completes
+        def chunk_done(_):
+            progress(sum(future.done() for future in futures) / len(futures))
+        for future in futures:
+            future.add_done_callback(chunk_done)
+    try:
+        results = await asyncio.gather(*futures)
+    except BrokenProcessPool:
+        print("Enrichment worker pool crashed, enriching inline")
+        reset_initialized_pool("enrichment")
+        return await run_in_thread(enrich_frame, df, rate_table, fx_table)
+
+    enriched = pd.concat([chunk for chunk, _, _ in results])
+    found = np.concatenate([chunk_found for _, chunk_found, _ in results])
+    ledger = pd.concat([chunk_ledger for _, _, chunk_ledger in results])
+
+    # Same in-place contract as enrich_frame
+    for col in enriched.columns:
+        df[col] = enriched[col].to_numpy()
+
+    print(f"Enriched {len(df)} rows in {len(chunk_bounds)} chunks: {int(found.sum())} with VAT rates")
+    return df, found, ledger_totals(ledger), ledger
+
+
+def _chunk_bounds(df: pd.DataFrame) -> list[tuple[int, int]]:
+    n_rows = len(df)
+    cuts = list(range(ENRICH_CHUNK_ROWS, n_rows, ENRICH_CHUNK_ROWS))
+
+    invoice_col = _find_columns(df).get(VAT_INVOICE_COLUMN)
+    if VAT_ROUNDING_MODE == 'invoice' and invoice_col and cuts:
+        invoices = df[invoice_col]
+        if not invoices.is_monotonic_increasing:
+            return [(0, n_rows)]
+        # Move every cut back to the first row of its invoice
+        values = invoices.to_numpy()
+        cuts = sorted({int(np.searchsorted(values, values[cut], side='left')) for cut in cuts} - {0})
+
+    bounds = [0] + cuts + [n_rows]
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def _invoice_codes(series: pd.Series) -> np.ndarray:
+    codes, uniques = pd.factorize(series)
+    # Lines without an invoice number are invoices of their own
+    missing = codes < 0
+    codes[missing] = len(uniques) + np.arange(int(missing.sum()))
+    return codes
+
+
+# Rounding groups for per-invoice VAT: one group per (invoice, rate)
+def _rounding_groups(invoice_codes: np.ndarray | None, rates: np.ndarray) -> np.ndarray | None:
+    if invoice_codes is None:
+        return None
+    group_codes, _ = pd.MultiIndex.from_arrays([invoice_codes, rates]).factorize()
+    return group_codes
+
+
+def _with_not_found(values: np.ndarray, found: np.ndarray):
+    if found.all():
+        return values
+    column = values.astype(object)
+    column[~found] = NOT_FOUND
+    return column
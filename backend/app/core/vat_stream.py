@@ -0,0 +1,171 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from app.core.money import VAT_ROUNDING_MODE
+from app.core.vat_engine import VAT_INVOICE_COLUMN, enrich_frame, unreadable_order_dates
+from app.core.executors import run_in_thread
+
+# Order lines enriched together; memory per request is bounded by one batch plus one
+# partial input line
+VAT_STREAM_BATCH_ROWS = int(os.getenv("VAT_STREAM_BATCH_ROWS", 5_000))
+# Longest input line (bytes) that is buffered and parsed; a longer line (e.g. a huge JSON
+# array) is skipped as it arrives and answered with an error
+VAT_STREAM_MAX_LINE_BYTES = int(os.getenv("VAT_STREAM_MAX_LINE_BYTES", 8 * 1024 * 1024))
+
+# enrich_frame column -> field name in the streamed output
+STREAM_OUTPUT_FIELDS = {
+    "Previous Currency": "previous_currency",
+    "FX Rate": "fx_rate",
+    "FX Rate Date": "fx_rate_date",
+    "VAT Rate": "vat_rate",
+    "Product VAT": "product_vat",
+    "Shipping VAT Rate": "shipping_vat_rate",
+    "Shipping VAT": "shipping_vat",
+    "Total VAT": "total_vat",
+    "Final Gross Total": "gross_total",
+}
+NOT_FOUND_FIELDS = ("vat_rate", "product_vat", "shipping_vat_rate", "shipping_vat")
+
+
+# Order lines from a request body streamed in arbitrary byte chunks. Every non-empty text
+# line holds either one JSON object (NDJSON) or a JSON array of objects. Yields
+# (line number, record) or (line number, error message) for lines that can't be read.
+async def iter_order_lines(byte_chunks):
+    # Only the current line is buffered; each chunk is scanned once for line ends
+    pending = bytearray()
+    line_number = 0
+    too_long = False
+    async for chunk in byte_chunks:
+        start = 0
+        while (end := chunk.find(b"\n", start)) >= 0:
+            line_number += 1
+            if too_long or len(pending) + end - start > VAT_STREAM_MAX_LINE_BYTES:
+                too_long = False
+                yield line_number, _line_too_long()
+            else:
+                pending += chunk[start:end]
+                for item in _parse_line(pending):
+                    yield line_number, item
+            pending.clear()
+            start = end + 1
+        if not too_long:
+            pending += chunk[start:]
+            if len(pending) > VAT_STREAM_MAX_LINE_BYTES:
+                # Drop the rest of this line as it arrives
+                too_long = True
+                pending.clear()
+    if too_long:
+        yield line_number + 1, _line_too_long()
+    elif pending.strip():
+        for item in _parse_line(pending):
+            yield line_number + 1, item
+
+
+def _line_too_long() -> str:
+    return f"Line longer than {VAT_STREAM_MAX_LINE_BYTES} bytes, split it into shorter lines"
+
+
+def _parse_line(line: bytes | bytearray) -> list:
+    if not line.strip():
+        return []
+    try:
+        value = json.loads(line)
+    except ValueError as e:
+        return [f"Invalid JSON: {str(e)}"]
+    items = value if isinstance(value, list) else [value]
+    return [item if isinstance(item, dict) else "Expected a JSON object" for item in items]
+
+
+# Enrich streamed order lines in batches of VAT_STREAM_BATCH_ROWS through enrich_frame and
+# yield the results as NDJSON, in input order. Each output line is the input line plus the
+# EUR amounts, rates and VAT; lines that couldn't be read or enriched come back as
+# {"line": n, "error": ...}.
+async def stream_enriched_lines(byte_chunks, rate_table, fx_table):
+    batch = []
+    async for line_number, item in iter_order_lines(byte_chunks):
+        if isinstance(item, str):
+            # Flush first so output stays in input order
+            if batch:
+                yield await run_in_thread(_enrich_batch, batch, rate_table, fx_table)
+                batch = []
+            yield _error_line(line_number, item)
+            continue
+
+        batch.append((line_number, item))
+        if len(batch) >= VAT_STREAM_BATCH_ROWS:
+            batch, carry = _split_at_invoice(batch)
+            yield await run_in_thread(_enrich_batch, batch, rate_table, fx_table)
+            batch = carry
+
+    if batch:
+        yield await run_in_thread(_enrich_batch, batch, rate_table, fx_table)
+
+
+# With per-invoice rounding the trailing lines of the batch's last invoice wait for the
+# next batch, so an invoice is never split (its lines must be contiguous in the stream)
+def _split_at_invoice(batch: list) -> tuple[list, list]:
+    if VAT_ROUNDING_MODE != 'invoice':
+        return batch, []
+    last_invoice = batch[-1][1].get(VAT_INVOICE_COLUMN)
+    if last_invoice is None:
+        return batch, []
+    split = len(batch)
+    while split > 0 and batch[split - 1][1].get(VAT_INVOICE_COLUMN) == last_invoice:
+        split -= 1
+    if split == 0:
+        # One invoice fills the whole batch, keep it together
+        return batch, []
+    return batch[:split], batch[split:]
+
+
+# NDJSON output of one batch, one line per item. Lines whose order date can't be read are
+# answered up front so they don't fail the rest of the batch.
+def _enrich_batch(batch: list, rate_table, fx_table) -> str:
+    unreadable = unreadable_order_dates(_batch_frame(batch))
+    if not unreadable.any():
+        return "".join(_enrich_lines(batch, rate_table, fx_table))
+
+    output = [None] * len(batch)
+    readable = np.flatnonzero(~unreadable)
+    if len(readable):
+        enriched = _enrich_lines([batch[position] for position in readable], rate_table, fx_table)
+        for position, line in zip(readable, enriched):
+            output[position] = line
+    for position in np.flatnonzero(unreadable):
+        line_number, record = batch[position]
+        # Field names match case-insensitively, as in enrich_frame
+        order_date = [value for field, value in record.items() if field.lower() == 'order_date'][-1]
+        output[position] = _error_line(line_number, f"Invalid order date '{str(order_date).strip()}'")
+    return "".join(output)
+
+
+def _batch_frame(batch: list) -> pd.DataFrame:
+    # Fields missing from a line are blank, as empty cells in an upload
+    return pd.DataFrame.from_records([record for _, record in batch]).fillna("")
+
+
+# Output lines for `batch`, in order. If the batch fails to enrich it is bisected, so a
+# bad line costs a few extra enrich_frame calls rather than one per line.
+def _enrich_lines(batch: list, rate_table, fx_table) -> list[str]:
+    line_numbers = [line_number for line_number, _ in batch]
+    try:
+        df, found, _, _ = enrich_frame(_batch_frame(batch), rate_table, fx_table)
+    except Exception as e:
+        if len(batch) > 1:
+            middle = len(batch) // 2
+            return _enrich_lines(batch[:middle], rate_table, fx_table) + _enrich_lines(batch[middle:], rate_table, fx_table)
+        print(f"Error enriching streamed line {line_numbers[0]}: {str(e)}")
+        return [_error_line(line_numbers[0], str(e))]
+
+    df = df.drop(columns=["Previous Net Price"]).rename(columns=STREAM_OUTPUT_FIELDS)
+    for field in NOT_FOUND_FIELDS:
+        df[field] = pd.to_numeric(df[field].where(found, np.nan))
+    df.insert(0, "line", line_numbers)
+    df["vat_rule_found"] = found
+    # Strings are escaped, so every record is exactly one output line
+    return [line + "\n" for line in df.to_json(orient="records", lines=True, date_format="iso").rstrip("\n").split("\n")]
+
+
+def _error_line(line_number: int, message: str) -> str:
+    return json.dumps({"line": line_number, "error": message}) + "\n"
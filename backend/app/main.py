@@ -1,8 +1,10 @@
 from itertools import product
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import auth, header, product, currency
+from app.routes import auth, header, product, currency, vat_aggregates, vat, jobs
 from app.core import validate_file
+from app.core.executors import shutdown_pools
+from app.core.currency_conversion import reload_fx_table
 
 app = FastAPI(title="Qhuube Tax Compliance")
 
@@ -11,6 +13,20 @@ app.include_router(header.router, prefix="/api/v1", tags=["Header"])
 app.include_router(product.router, prefix="/api/v1", tags=["Product"])
 app.include_router(validate_file.router, prefix="/api/v1", tags=["File Validation"])
 app.include_router(currency.router, prefix="/api/v1", tags=["Currency Rates"])
+app.include_router(vat_aggregates.router, prefix="/api/v1", tags=["VAT Aggregates"])
+app.include_router(vat.router, prefix="/api/v1", tags=["VAT Calculation"])
+app.include_router(jobs.router, prefix="/api/v1", tags=["Jobs"])
+
+
+@app.on_event("startup")
+async def warm_fx_table():
+    # Load the FX rates before the first request needs them
+    await reload_fx_table()
+
+
+@app.on_event("shutdown")
+def shutdown_worker_pools():
+    shutdown_pools()
 
 
 app.add_middleware(
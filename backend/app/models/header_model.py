@@ -14,24 +14,26 @@ async def get_all_headers():
     return headers
 
 
-async def create_header(label: str, value: str, aliases: list[str], type: str):
+async def create_header(label: str, value: str, aliases: list[str], type: str, constraints: dict | None = None):
     header = {
         "label": label,
         "value": value,
         "aliases": aliases,
-        "type": type
+        "type": type,
+        **(constraints or {})
     }
     result = await db.headers.insert_one(header)
     header["_id"] = str(result.inserted_id)  # Convert to string immediately
     return header
 
 
-async def update_header(header_id: str, label: str, value: str, aliases: list[str], type: str):
+async def update_header(header_id: str, label: str, value: str, aliases: list[str], type: str, constraints: dict | None = None):
     updated_data = {
         "label": label,
         "value": value,
         "aliases": aliases,
-        "type": type
+        "type": type,
+        **(constraints or {})
     }
     result = await db.headers.update_one(
         {"_id": ObjectId(header_id)},
@@ -1,6 +1,15 @@
 from app.core.database import db
 from bson import ObjectId
-from datetime import datetime
+from datetime import datetime, date
+
+# Mongo stores validity dates as datetimes; the API speaks plain ISO dates
+def _validity_to_db(value: date | None) -> datetime | None:
+    return datetime(value.year, value.month, value.day) if value else None
+
+def _validity_from_db(product: dict):
+    for field in ("valid_from", "valid_to"):
+        if isinstance(product.get(field), datetime):
+            product[field] = product[field].date().isoformat()
 
 async def get_all_products():
     product_cursor = db.products.find({}).sort("created_at", -1)
@@ -14,9 +23,10 @@ async def get_all_products():
             product["created_at"] = product["created_at"].isoformat()
         if "updated_at" in product:
             product["updated_at"] = product["updated_at"].isoformat()
+        _validity_from_db(product)
     return products
 
-async def create_product(product_type: str, country: str, vat_rate: float, vat_category: str, shipping_vat_rate: float):
+async def create_product(product_type: str, country: str, vat_rate: float, vat_category: str, shipping_vat_rate: float, valid_from: date | None = None, valid_to: date | None = None):
     current_time = datetime.utcnow()
     product = {
         "product_type": product_type,
@@ -24,6 +34,8 @@ async def create_product(product_type: str, country: str, vat_rate: float, vat_c
         "vat_rate": vat_rate,
         "vat_category": vat_category,
         "shipping_vat_rate": shipping_vat_rate,
+        "valid_from": _validity_to_db(valid_from),
+        "valid_to": _validity_to_db(valid_to),
         "created_at": current_time,
         "updated_at": current_time
     }
@@ -32,15 +44,18 @@ async def create_product(product_type: str, country: str, vat_rate: float, vat_c
     # Convert datetime to ISO string for response
     product["created_at"] = product["created_at"].isoformat()
     product["updated_at"] = product["updated_at"].isoformat()
+    _validity_from_db(product)
     return product
 
-async def update_product(product_id: str, product_type: str, country: str, vat_rate: float, vat_category: str, shipping_vat_rate: float):
+async def update_product(product_id: str, product_type: str, country: str, vat_rate: float, vat_category: str, shipping_vat_rate: float, valid_from: date | None = None, valid_to: date | None = None):
     updated_data = {
         "product_type": product_type,
         "country": country,
         "vat_rate": vat_rate,
         "vat_category": vat_category,
         "shipping_vat_rate": shipping_vat_rate,
+        "valid_from": _validity_to_db(valid_from),
+        "valid_to": _validity_to_db(valid_to),
         "updated_at": datetime.utcnow()
     }
     result = await db.products.update_one(
@@ -58,6 +73,7 @@ async def update_product(product_id: str, product_type: str, country: str, vat_r
             updated_product["created_at"] = updated_product["created_at"].isoformat()
         if "updated_at" in updated_product:
             updated_product["updated_at"] = updated_product["updated_at"].isoformat()
+        _validity_from_db(updated_product)
     return updated_product
 
 async def delete_product(product_id: str):
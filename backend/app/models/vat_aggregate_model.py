@@ -0,0 +1,111 @@
+from app.core.database import db, client
+import hashlib
+from pymongo import UpdateOne
+from datetime import datetime
+
+# Running VAT totals per user, month, country, VAT rate and supply, maintained with $inc
+# as uploads are recorded and deleted. Amounts are integer cents and rates millionths, so
+# adding and subtracting contributions is exact.
+vat_aggregates_col = db["vat_aggregates"]
+# One document per recorded upload holding the contribution it added to the totals
+vat_uploads_col = db["vat_uploads"]
+
+AGGREGATE_KEY_FIELDS = ("month", "country", "vat_rate", "supply")
+AGGREGATE_SUM_FIELDS = ("taxable_amount", "vat_amount", "line_count")
+
+
+def _increment_ops(user_email: str, contributions: list[dict], sign: int) -> list[UpdateOne]:
+    now = datetime.utcnow()
+    return [
+        UpdateOne(
+            {"user_email": user_email, **{field: contribution[field] for field in AGGREGATE_KEY_FIELDS}},
+            {
+                "$inc": {field: sign * contribution[field] for field in AGGREGATE_SUM_FIELDS},
+                "$set": {"updated_at": now},
+            },
+            upsert=True,
+        )
+        for contribution in contributions
+    ]
+
+
+async def _apply_contributions(user_email: str, contributions: list[dict], sign: int, session=None):
+    if contributions:
+        await vat_aggregates_col.bulk_write(_increment_ops(user_email, contributions, sign), ordered=False, session=session)
+    if sign < 0:
+        # Keys whose every contribution was removed
+        await vat_aggregates_col.delete_many({"user_email": user_email, "line_count": {"$lte": 0}}, session=session)
+
+
+# Run `callback(session)` in a transaction: the upload document and the totals it moves
+# commit together or not at all. Two writers of the same upload conflict on its document;
+# with_transaction retries the loser from the start, so it sees the winner's contribution.
+async def _in_transaction(callback):
+    async with await client.start_session() as session:
+        return await session.with_transaction(callback)
+
+
+# Uploads are identified by their owner and file content, so recording the same file again
+# from a new session replaces its earlier contribution instead of counting it twice
+def upload_id_for(user_email: str, content_hash: str) -> str:
+    return hashlib.sha1(f"{user_email}\n{content_hash}".encode()).hexdigest()
+
+
+async def get_upload(upload_id: str, session=None):
+    return await vat_uploads_col.find_one({"_id": upload_id}, session=session)
+
+
+# Add an upload's contribution to the user's totals. Recording the same upload again
+# (a retry, a re-enriched session or the same file in a new session) replaces its
+# previous contribution.
+# Raises PermissionError when the upload is recorded for another user.
+async def record_upload(upload_id: str, user_email: str, file_name: str, contributions: list[dict]):
+    upload = {
+        "user_email": user_email,
+        "file_name": file_name,
+        "contributions": contributions,
+        "recorded_at": datetime.utcnow(),
+    }
+
+    async def record(session):
+        previous = await get_upload(upload_id, session)
+        if previous:
+            if previous["user_email"] != user_email:
+                raise PermissionError("Upload is recorded for another user")
+            await _apply_contributions(previous["user_email"], previous["contributions"], -1, session)
+        await _apply_contributions(user_email, contributions, 1, session)
+        await vat_uploads_col.replace_one({"_id": upload_id}, upload, upsert=True, session=session)
+
+    await _in_transaction(record)
+    return upload
+
+
+# Subtract an upload's contribution from the totals and forget it. Only the user the
+# upload belongs to can remove it; returns None when they have no such upload.
+async def delete_upload(upload_id: str, user_email: str):
+    async def delete(session):
+        upload = await vat_uploads_col.find_one({"_id": upload_id, "user_email": user_email}, session=session)
+        if not upload:
+            return None
+        await _apply_contributions(upload["user_email"], upload["contributions"], -1, session)
+        await vat_uploads_col.delete_one({"_id": upload_id}, session=session)
+        return upload
+
+    return await _in_transaction(delete)
+
+
+async def get_uploads(user_email: str):
+    upload_cursor = vat_uploads_col.find({"user_email": user_email}, {"contributions": 0}).sort("recorded_at", -1)
+    uploads = await upload_cursor.to_list(length=None)
+    for upload in uploads:
+        upload["upload_id"] = upload.pop("_id")
+        upload["recorded_at"] = upload["recorded_at"].isoformat()
+    return uploads
+
+
+async def get_aggregates(user_email: str, months: list[str]):
+    aggregate_cursor = vat_aggregates_col.find(
+        {"user_email": user_email, "month": {"$in": months}},
+        {"_id": 0, "user_email": 0, "updated_at": 0},
+    )
+    return await aggregate_cursor.to_list(length=None)
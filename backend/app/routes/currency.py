@@ -1,9 +1,12 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
 import httpx
 from app.models.currency_model import fetch_two_years_ecb_rates
 from app.utils.country_mapping import currency_country_map
-from app.schemas.currencies_schemas import CurrencyUpdate
+from app.schemas.currencies_schemas import CurrencyUpdate, FxConvertRequest
 from app.core.database import db
+from app.core.currency_conversion import FX_MATCH_MODE, reload_fx_table, get_fx_table, fx_table_stats, convert_amounts
+from app.core.executors import run_in_thread
 from datetime import datetime, timedelta, timezone
 import aiohttp
 import logging
@@ -13,11 +16,38 @@ router = APIRouter()
 @router.get("/currency/fetch-two-years")
 async def sync_two_year_currency():
     inserted_count = await fetch_two_years_ecb_rates()
+    await reload_fx_table()
     return {
         "message": "2-year historical ECB currency data synced successfully.",
         "records_inserted": inserted_count
     }
 
+# Historical EUR conversion of a batch of (amount, currency, date) items against the
+# cached ECB rate table; Mongo is only read when the table has expired. Item i of every
+# output array belongs to item i of the input.
+@router.post("/currency/convert")
+async def convert_currency_batch(payload: FxConvertRequest):
+    if not (len(payload.amounts) == len(payload.currencies) == len(payload.dates)):
+        raise HTTPException(status_code=400, detail="amounts, currencies and dates must have the same length")
+
+    fx_table = await get_fx_table()
+    try:
+        result = await run_in_thread(convert_amounts, fx_table, payload.amounts, payload.currencies, payload.dates, payload.mode or FX_MATCH_MODE)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error in bulk FX conversion: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Could not convert amounts: {str(e)}")
+
+    result["fx_table_version"] = fx_table.version
+    # Plain lists, sent without FastAPI's per-item encoding pass
+    return JSONResponse(content=result)
+
+# Hit/miss counters and state of the in-process FX rate cache
+@router.get("/currency/fx-cache/stats")
+async def get_fx_cache_stats():
+    return fx_table_stats()
+
 @router.post("/currency/init-supported-countries-from-existing-data")
 async def init_offline_supported_countries():
     # Step 1: Get all unique currencies in your data
@@ -166,6 +196,7 @@ async def daily_live_currency_sync():
     # Determine final cron status
     if all_inserted > 0:
         cron_status = "Updated"
+        await reload_fx_table()
     elif all_failed == 0:
         cron_status = "Holiday"
     else:
@@ -2,6 +2,8 @@ from fastapi import APIRouter, HTTPException, Depends
 from app.core.security import verify_access_token
 from app.schemas.header_schemas import HeaderSchema, HeaderCreateSchema, HeaderListResponse
 from app.models.header_model import get_all_headers, create_header, update_header, get_header_by_label, delete_header
+from app.core.header_config import invalidate_header_config
+from app.core.constraints import CONSTRAINT_FIELDS
 
 router = APIRouter()
 
@@ -16,8 +18,10 @@ async def create_new_header(header: HeaderCreateSchema, admin=Depends(verify_acc
             header.label,
             header.value,
             header.aliases or [],
-            header.type
+            header.type,
+            header.model_dump(include=set(CONSTRAINT_FIELDS))
         )
+        invalidate_header_config()
         return created_header
     except HTTPException:
         raise
@@ -43,9 +47,10 @@ async def update_header_in_db(header_id: str, updated: HeaderCreateSchema, admin
             updated.label,
             updated.value,
             updated.aliases or [],
-            updated.type
-
+            updated.type,
+            updated.model_dump(include=set(CONSTRAINT_FIELDS))
         )
+        invalidate_header_config()
         return {
             "success": True,
             "header": updated_header
@@ -57,6 +62,7 @@ async def update_header_in_db(header_id: str, updated: HeaderCreateSchema, admin
 async def delete_existing_header(header_id: str, admin=Depends(verify_access_token)):
     try:
         result = await delete_header(header_id)
+        invalidate_header_config()
         return result
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -0,0 +1,138 @@
+import io
+from typing import List, Optional
+from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+from app.core.jobs import start_job, get_job, iter_job_events
+from app.core.send_mail import send_manual_vat_email
+from app.core.validate_file import (
+    processed_data_store, cleanup_old_data, unsupported_upload,
+    upload_error, read_upload, validate_upload, prepare_vat_report,
+)
+
+router = APIRouter()
+
+# Job variants of /validate-file and /download-vat-report for uploads too large to finish
+# within a proxy timeout. The POST returns a job id at once; the job is polled at
+# /jobs/{job_id} or followed over server-sent events at /jobs/{job_id}/events, and its
+# result fetched from /jobs/{job_id}/result when done.
+
+
+def job_accepted(job) -> JSONResponse:
+    return JSONResponse(status_code=202, content={
+        "job_id": job.job_id,
+        "status_url": f"/api/v1/jobs/{job.job_id}",
+        "events_url": f"/api/v1/jobs/{job.job_id}/events",
+        "result_url": f"/api/v1/jobs/{job.job_id}/result",
+    })
+
+
+def find_job(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+
+@router.post("/jobs/validate-file")
+async def start_validate_file_job(files: List[UploadFile] = File(...), previous_session_id: Optional[str] = Form(None)):
+    cleanup_old_data()
+
+    # The uploads are closed when this request ends, so their content is read now
+    uploads = []
+    for file in files:
+        unsupported = unsupported_upload(file.filename)
+        if unsupported is not None:
+            uploads.append((file.filename, unsupported))
+            continue
+        uploads.append((file.filename, await read_upload(file)))
+
+    async def run(job):
+        results = []
+        for part, (file_name, upload) in enumerate(uploads):
+            if isinstance(upload, dict):
+                results.append(upload)
+                continue
+            content, content_hash = upload
+            try:
+                print(f"Processing file: {file_name} (job {job.job_id})")
+                results.append(await validate_upload(
+                    file_name, content, content_hash, previous_session_id,
+                    lambda stage, part=part: job.progress(stage, part=part, parts=len(uploads)),
+                ))
+            except Exception as e:
+                results.append(upload_error(file_name, e))
+            # Each file's content is released once it's validated
+            uploads[part] = (file_name, None)
+            job.progress('validating', 1.0, part=part, parts=len(uploads))
+        job.finish({"files": results})
+
+    return job_accepted(start_job('validate', run))
+
+
+@router.post("/jobs/vat-report/{session_id}")
+async def start_vat_report_job(session_id: str, user_email: str = Form(...)):
+    if session_id not in processed_data_store:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    stored_data = processed_data_store[session_id]
+
+    async def run(job):
+        report = await prepare_vat_report(stored_data, user_email, job.progress)
+
+        if 'manual_review' not in report:
+            job.finish(download=(report['zip_name'], 'application/zip', report['zip_content']))
+            return
+
+        result = report['manual_review']
+        if report['manual_workbook'] is not None:
+            job.progress('emailing')
+            try:
+                await send_manual_vat_email(
+                    "mailer@xtechon.com",
+                    user_email,
+                    report['manual_workbook'],
+                    result["manual_review_rows"],
+                    result.get("unmatched_pairs"),
+                )
+            except Exception as e:
+                # The review payload is still the job's result
+                print(f"Failed to send manual review email for job {job.job_id}: {str(e)}")
+        job.finish(result)
+
+    return job_accepted(start_job('vat_report', run))
+
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    return find_job(job_id).status_payload()
+
+
+# Progress as server-sent events ("progress", then "done" or "failed"), for EventSource
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    job = find_job(job_id)
+    return StreamingResponse(
+        iter_job_events(job),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# The finished job's output: the report zip, or the JSON result (validation results, or
+# the manual-review payload of a report job)
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = find_job(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=409, detail=f"Job failed: {job.error}")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is still {job.status} ({job.stage}, {job.percent}%)")
+
+    if job.download is not None:
+        file_name, media_type, content = job.download
+        return StreamingResponse(
+            io.BytesIO(content),
+            media_type=media_type,
+            headers={"Content-Disposition": f"attachment; filename={file_name}"}
+        )
+    return job.result
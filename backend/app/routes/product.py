@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from app.core.security import verify_access_token
 from app.schemas.product_schemas import ProductSchema, ProductCreateSchema, ProductListResponse
 from app.models.product_model import get_all_products, create_product, update_product, delete_product
+from app.core.product_registry import invalidate_product_registry
 from fastapi import UploadFile, File
 from openpyxl import load_workbook
 from io import BytesIO
@@ -17,7 +18,10 @@ async def create_new_product(product: ProductCreateSchema, admin=Depends(verify_
         vat_rate=product.vat_rate,
         vat_category=product.vat_category,
         shipping_vat_rate=product.shipping_vat_rate,
+        valid_from=product.valid_from,
+        valid_to=product.valid_to,
     )
+    invalidate_product_registry()
     return ProductSchema(**product_data)
 
 
@@ -38,8 +42,11 @@ async def update_existing_product(product_id: str, updated: ProductCreateSchema,
             country=updated.country,
             vat_rate=updated.vat_rate,
             vat_category=updated.vat_category,
-            shipping_vat_rate=updated.shipping_vat_rate
+            shipping_vat_rate=updated.shipping_vat_rate,
+            valid_from=updated.valid_from,
+            valid_to=updated.valid_to,
         )
+        invalidate_product_registry()
         return ProductSchema(**updated_product)
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -48,7 +55,9 @@ async def update_existing_product(product_id: str, updated: ProductCreateSchema,
 @router.delete("/delete/product/{product_id}")
 async def delete_existing_product(product_id: str, admin=Depends(verify_access_token)):
     try:
-        return await delete_product(product_id)
+        result = await delete_product(product_id)
+        invalidate_product_registry()
+        return result
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
 
@@ -69,11 +78,16 @@ async def import_products_json(data: dict, admin=Depends(verify_access_token)):
                 vat_rate=product.vat_rate,
                 vat_category=product.vat_category,
                 shipping_vat_rate=product.shipping_vat_rate,
+                valid_from=product.valid_from,
+                valid_to=product.valid_to,
             )
             success_count += 1
         except Exception as e:
             errors.append(f"Row {idx}: {str(e)}")
-    
+
+    if success_count:
+        invalidate_product_registry()
+
     return {
         "imported": success_count,
         "errors": errors
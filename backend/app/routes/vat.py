@@ -0,0 +1,74 @@
+from datetime import date
+import numpy as np
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from app.core.product_registry import get_product_registry
+from app.core.currency_conversion import get_fx_table
+from app.core.vat_engine import quote_vat
+from app.core.vat_stream import stream_enriched_lines
+from app.schemas.vat_schemas import VatQuoteRequest
+
+router = APIRouter()
+
+
+# StreamingResponse for handlers that keep reading the request body while they respond.
+# The stock response listens for a client disconnect on older ASGI servers, and that
+# listener consumes the body messages the handler is still waiting for; a disconnect
+# surfaces here as a failed send instead.
+class BodyStreamingResponse(StreamingResponse):
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+# Live VAT for a single order line (checkout). Served from the cached rule and FX tables,
+# Mongo is only read when one of them has expired.
+@router.post("/vat/quote")
+async def get_vat_quote(payload: VatQuoteRequest):
+    registry = await get_product_registry()
+    fx_table = await get_fx_table()
+    order_date = payload.order_date or date.today()
+
+    try:
+        quote = quote_vat(
+            registry['rate_table'],
+            fx_table,
+            payload.product_type,
+            payload.country,
+            payload.net_price,
+            payload.shipping_amount,
+            payload.currency,
+            np.datetime64(order_date, 'D'),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        print(f"Error in VAT quote: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Could not compute VAT: {str(e)}")
+
+    if quote is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No VAT rule for product type '{payload.product_type}' in {payload.country} on {order_date.isoformat()}"
+        )
+
+    return {
+        "product_type": payload.product_type,
+        "country": payload.country,
+        "order_date": order_date.isoformat(),
+        **quote,
+    }
+
+# Batch VAT for integrators: the body is NDJSON order lines (or JSON arrays of them, one per
+# line) using the system column names (order_date, product_type, country, net_price,
+# shipping_amount, currency). Enriched lines are streamed back as NDJSON while the body is
+# still being read, so arbitrarily long bodies run in constant memory.
+@router.post("/vat/stream")
+async def stream_vat(request: Request):
+    registry = await get_product_registry()
+    fx_table = await get_fx_table()
+
+    return BodyStreamingResponse(
+        stream_enriched_lines(request.stream(), registry['rate_table'], fx_table),
+        media_type="application/x-ndjson",
+    )
@@ -0,0 +1,75 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from app.core.security import verify_access_token
+from app.core.validate_file import processed_data_store, get_session_enrichment
+from app.core.oss_rollup import monthly_contributions, quarter_months, merge_aggregates, rollup_records
+from app.models.vat_aggregate_model import record_upload, delete_upload, get_uploads, get_aggregates, upload_id_for
+from app.core.executors import run_in_thread
+
+router = APIRouter()
+
+# Add a session's VAT totals (by month, country, rate and goods/shipping) to the signed-in
+# user's running aggregates. The uploaded file's content identifies the upload; recording
+# it again, from this or a later session, replaces its earlier contribution.
+@router.post("/vat-aggregates/uploads/{session_id}")
+async def record_session_upload(session_id: str, user=Depends(verify_access_token)):
+    user_email = user["email"]
+    if session_id not in processed_data_store:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+
+    stored_data = processed_data_store[session_id]
+    upload_id = upload_id_for(user_email, stored_data['content_hash'])
+    enrichment = await get_session_enrichment(stored_data)
+
+    try:
+        contributions, undated_lines = await run_in_thread(monthly_contributions, enrichment['frame'], enrichment['found'], enrichment['ledger'])
+        await record_upload(upload_id, user_email, stored_data['file_name'], contributions)
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except Exception as e:
+        print(f"Error recording VAT aggregates: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Could not record VAT aggregates: {str(e)}")
+
+    return {
+        "upload_id": upload_id,
+        "months": sorted({contribution['month'] for contribution in contributions}),
+        "aggregate_keys": len(contributions),
+        # Rows without a VAT rule or without an order date are not aggregated
+        "manual_review_count": int((~enrichment['found']).sum()),
+        "undated_lines": undated_lines,
+    }
+
+@router.get("/vat-aggregates/uploads")
+async def list_uploads(user=Depends(verify_access_token)):
+    try:
+        return await get_uploads(user["email"])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/vat-aggregates/uploads/{upload_id}")
+async def remove_upload(upload_id: str, user=Depends(verify_access_token)):
+    try:
+        upload = await delete_upload(upload_id, user["email"])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"message": "Upload removed from VAT aggregates", "upload_id": upload_id}
+
+# Quarter totals merged from the persisted monthly aggregates, without re-reading any upload
+@router.get("/vat-aggregates/quarter")
+async def get_quarter_totals(year: int = Query(...), quarter: int = Query(..., ge=1, le=4), user=Depends(verify_access_token)):
+    user_email = user["email"]
+    months = quarter_months(year, quarter)
+    try:
+        merged = merge_aggregates(await get_aggregates(user_email, months))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "user_email": user_email,
+        "year": year,
+        "quarter": quarter,
+        "months": months,
+        "totals": merged.pop('totals'),
+        **rollup_records(merged),
+    }
@@ -1,6 +1,6 @@
 from bson import ObjectId
 from pydantic import BaseModel, Field
-from typing  import Literal, Optional
+from typing  import List, Literal, Optional
 from datetime import datetime, timezone
 
 
@@ -34,4 +34,12 @@ class CurrencyCronLog(BaseModel):
     date: str
     status: Literal["Updated", "Failed", "Holiday"]
     logs_details: str
-    created_at: datetime = Field(default_factory=lambda: datetime(timezone.utc))
\ No newline at end of file
+    created_at: datetime = Field(default_factory=lambda: datetime(timezone.utc))
+
+# Bulk EUR conversion as parallel arrays: item i is (amounts[i], currencies[i], dates[i]),
+# dates as YYYY-MM-DD. `mode` overrides the FX_MATCH_MODE rate-date matching.
+class FxConvertRequest(BaseModel):
+    amounts: List[float]
+    currencies: List[str]
+    dates: List[str]
+    mode: Optional[Literal["nearest", "previous"]] = None
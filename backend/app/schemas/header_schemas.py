@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field
-from typing import List
+import re
+from pydantic import BaseModel, Field, field_validator
+from typing import List, Optional
 from pydantic import GetCoreSchemaHandler, GetJsonSchemaHandler
 from pydantic_core import core_schema
 from bson import ObjectId
@@ -34,6 +35,23 @@ class HeaderCreateSchema(BaseModel):
     value: str
     aliases: List[str] = Field(default_factory=list)
     type: str
+    # Optional business rules, compiled into vectorized checks when the header config changes
+    regex: Optional[str] = None
+    min_value: Optional[float] = None
+    max_value: Optional[float] = None
+    allowed_values: Optional[List[str]] = None
+    max_length: Optional[int] = None
+    required: bool = True
+
+    @field_validator("regex")
+    @classmethod
+    def validate_regex(cls, v):
+        if v is not None:
+            try:
+                re.compile(v)
+            except re.error as e:
+                raise ValueError(f"Invalid regex: {e}")
+        return v
 
 
 class HeaderSchema(HeaderCreateSchema):
@@ -1,6 +1,7 @@
-from typing import List
+from typing import List, Optional
+from datetime import date
 import typing
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from pydantic import GetCoreSchemaHandler, GetJsonSchemaHandler
 from pydantic_core import core_schema
 from bson import ObjectId
@@ -36,6 +37,15 @@ class ProductCreateSchema(BaseModel):
         vat_rate: float
         vat_category: str
         shipping_vat_rate: float
+        # Optional effective dates (inclusive); open-ended when not set
+        valid_from: Optional[date] = None
+        valid_to: Optional[date] = None
+
+        @model_validator(mode="after")
+        def check_validity_period(self):
+            if self.valid_from and self.valid_to and self.valid_to < self.valid_from:
+                raise ValueError("valid_to must not be before valid_from")
+            return self
 
 
 class ProductUpdateSchema(BaseModel):
@@ -44,6 +54,8 @@ class ProductUpdateSchema(BaseModel):
         vat_rate: float
         vat_category: str
         shipping_vat_rate: float
+        valid_from: Optional[date] = None
+        valid_to: Optional[date] = None
 
 class ProductSchema(ProductCreateSchema):
     id: PyObjectId = Field(..., alias="_id")
@@ -0,0 +1,14 @@
+from typing import Any, List
+from pydantic import BaseModel
+
+
+class CellEdit(BaseModel):
+    # Spreadsheet row number as reported in validation issues (first data row is 2)
+    row: int
+    # Standardized column name (header value) or its label
+    column: str
+    value: Any = None
+
+
+class CellEditRequest(BaseModel):
+    edits: List[CellEdit]
@@ -0,0 +1,13 @@
+from typing import Optional
+from datetime import date
+from pydantic import BaseModel
+
+
+class VatQuoteRequest(BaseModel):
+    product_type: str
+    country: str
+    net_price: float
+    shipping_amount: float = 0.0
+    currency: str = "EUR"
+    # Rules and FX rates are resolved on this date; today when omitted
+    order_date: Optional[date] = None
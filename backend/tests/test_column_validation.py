@@ -0,0 +1,44 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from app.core.column_validation import hash_rows, match_previous_rows
+
+
+def read_csv(text: str) -> pd.DataFrame:
+    return pd.read_csv(io.StringIO(text))
+
+
+def test_filling_a_blank_numeric_cell_keeps_other_rows_matched():
+    # The blank makes net_price float64 in the first upload; filled in, it is int64
+    previous = read_csv("net_price,currency\n100,EUR\n20,EUR\n,EUR\n")
+    corrected = read_csv("net_price,currency\n100,EUR\n20,EUR\n30,EUR\n")
+    assert previous['net_price'].dtype == np.float64
+    assert corrected['net_price'].dtype == np.int64
+
+    matched = match_previous_rows(hash_rows(corrected), hash_rows(previous))
+    assert matched.tolist() == [0, 1, -1]
+
+
+def test_numbers_hash_like_their_text():
+    numbers = pd.DataFrame({'net_price': [3.5, 100.0, np.nan]})
+    text = pd.DataFrame({'net_price': ["3.5", "100", None]})
+    assert hash_rows(numbers).tolist() == hash_rows(text).tolist()
+
+
+def test_changed_values_do_not_match():
+    previous = read_csv("net_price,currency\n100,EUR\n20.5,EUR\n")
+    corrected = read_csv("net_price,currency\n100,EUR\n20.25,EUR\n")
+    assert match_previous_rows(hash_rows(corrected), hash_rows(previous)).tolist() == [0, -1]
+
+
+def test_text_column_fixed_to_numbers_keeps_rows_matched():
+    # "abc" keeps the first upload's column as text; corrected, it parses as float
+    previous = read_csv("net_price,currency\n3.0,EUR\n1.5,EUR\nabc,EUR\n007,EUR\n")
+    corrected = read_csv("net_price,currency\n3.0,EUR\n1.5,EUR\n2.0,EUR\n7,EUR\n")
+    assert previous['net_price'].dtype == object
+    assert corrected['net_price'].dtype == np.float64
+
+    matched = match_previous_rows(hash_rows(corrected), hash_rows(previous))
+    assert matched.tolist() == [0, 1, -1, -1]
@@ -0,0 +1,18 @@
+from app.core.money import RATE_SCALE
+from app.core.product_registry import build_rule_index
+from app.core.vat_engine import build_rate_table
+
+
+def test_duplicate_products_resolve_to_the_same_rule_everywhere():
+    # get_all_products lists the newest product first
+    products = [
+        {'_id': 'new', 'product_type': 'Books', 'country': 'Germany', 'vat_rate': 7, 'shipping_vat_rate': 7},
+        {'_id': 'old', 'product_type': ' books', 'country': 'GERMANY ', 'vat_rate': 19, 'shipping_vat_rate': 19},
+    ]
+
+    rate_table = build_rate_table(products)
+    position = rate_table.lookup_one('books', 'germany', 0)
+    assert rate_table.vat_rates[position] / RATE_SCALE == 0.07
+
+    matches = build_rule_index(products).search('books germany', limit=5, min_score=0)
+    assert [payload['product_id'] for _, _, payload in matches] == ['new']
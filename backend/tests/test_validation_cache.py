@@ -0,0 +1,46 @@
+import asyncio
+
+import pandas as pd
+
+import app.core.validate_file as validate_file
+
+
+def test_concurrent_identical_uploads_share_one_cache_entry(monkeypatch):
+    validations = []
+
+    async def header_config():
+        return {'version': 'h1'}
+
+    async def product_registry():
+        return {'version': 'r1'}
+
+    async def validate_file_data(headers, df, previous_state=None):
+        validations.append(len(df))
+        # Let the other upload run while this one validates
+        await asyncio.sleep(0.01)
+        return {'missing_headers': [], 'data_issues': []}, {'reused_rows': 0}
+
+    monkeypatch.setattr(validate_file, 'get_header_config', header_config)
+    monkeypatch.setattr(validate_file, 'get_product_registry', product_registry)
+    monkeypatch.setattr(validate_file, 'parse_file_content', lambda file_name, content: (['a'], pd.DataFrame({'a': [1, 2]})))
+    monkeypatch.setattr(validate_file, 'validate_file_data', validate_file_data)
+    monkeypatch.setattr(validate_file, 'processed_data_store', {})
+    monkeypatch.setattr(validate_file, 'validation_cache', {})
+
+    async def upload_twice():
+        return await asyncio.gather(
+            validate_file.validate_upload('a.csv', b'a\n1\n2\n', 'hash'),
+            validate_file.validate_upload('a.csv', b'a\n1\n2\n', 'hash'),
+        )
+
+    first, second = asyncio.run(upload_twice())
+    cache_key = ('hash', '.csv', 'h1', 'r1')
+    assert validations == [2]
+    assert validate_file.validation_cache[cache_key]['refcount'] == 2
+    assert validate_file.validation_locks == {}
+
+    # Releasing one session keeps the entry the other still shares
+    validate_file.release_cached_validation(cache_key)
+    assert validate_file.validation_cache[cache_key]['refcount'] == 1
+    sessions = validate_file.processed_data_store
+    assert sessions[first['session_id']]['original_df'] is sessions[second['session_id']]['original_df']
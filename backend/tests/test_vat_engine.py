@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from app.core.currency_conversion import FxTable
+from app.core.money import RATE_SCALE
+from app.core.vat_engine import NOT_FOUND, build_rate_table, enrich_frame, resolve_rules
+
+
+def test_blank_order_date_in_foreign_currency_row_goes_to_manual_review():
+    rate_table = build_rate_table([{'product_type': 'books', 'country': 'germany', 'vat_rate': 19, 'shipping_vat_rate': 19}])
+    fx_table = FxTable.from_rates({'2024-01-01': {'USD': 0.9}})
+    df = pd.DataFrame({
+        'order_date': ['2024-01-01', np.nan],
+        'product_type': ['books', 'books'],
+        'country': ['germany', 'germany'],
+        'net_price': [100.0, 50.0],
+        'currency': ['USD', 'USD'],
+    })
+
+    enriched, found, totals, _ = enrich_frame(df, rate_table, fx_table)
+
+    assert found.tolist() == [True, False]
+    # The readable row is converted and priced as usual
+    assert enriched['currency'].tolist() == ['EUR', 'USD']
+    assert enriched.loc[0, 'net_price'] == 111.11
+    assert enriched.loc[0, 'Total VAT'] == 21.11
+    # The blank-dated row is left unconverted, without VAT
+    assert enriched.loc[1, 'net_price'] == 50.0
+    assert np.isnan(enriched.loc[1, 'FX Rate'])
+    assert enriched.loc[1, 'VAT Rate'] == NOT_FOUND
+    assert enriched.loc[1, 'Total VAT'] == 0.0
+    assert enriched.loc[1, 'Final Gross Total'] == 0.0
+    assert totals['overall_vat_amount'] == 21.11
+
+
+def test_rule_enclosing_a_temporary_rate_applies_again_after_it():
+    rate_table = build_rate_table([
+        {'product_type': 'Books', 'country': 'Germany', 'vat_rate': 19, 'shipping_vat_rate': 19},
+        {'product_type': 'Books', 'country': 'Germany', 'vat_rate': 16, 'shipping_vat_rate': 16, 'valid_from': '2020-07-01', 'valid_to': '2020-12-31'},
+    ])
+    df = pd.DataFrame({
+        'order_date': ['2019-01-01', '2020-07-01', '2020-12-31', '2021-01-01', '2021-03-01'],
+        'product_type': ['books'] * 5,
+        'country': ['germany'] * 5,
+    })
+
+    found, vat_rates, _ = resolve_rules(df, rate_table)
+
+    assert found.all()
+    assert (vat_rates / RATE_SCALE).tolist() == [0.19, 0.16, 0.16, 0.19, 0.19]
+    # Single-order lookups see the same segments
+    after_cut = int(np.datetime64('2021-03-01', 'D').astype(np.int64))
+    assert rate_table.vat_rates[rate_table.lookup_one('books', 'germany', after_cut)] / RATE_SCALE == 0.19